@@ -165,6 +165,7 @@ python3 -m venv /opt/markdownmaster
 chmod +x "${SITEPATH}/cgi-bin/crawler.py"
 chmod +x "${SITEPATH}/cgi-bin/sitemap.py"
 chmod +x "${SITEPATH}/cgi-bin/meta.py"
+chmod +x "${SITEPATH}/cgi-bin/search.py"
 
 debug "Installing config to /etc/nginx/sites-enabled/${DIRECTORY}.conf"
 sleep 1
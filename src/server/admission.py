@@ -0,0 +1,159 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import importlib.util
+import os
+import time
+from typing import Union
+
+from siteconfig import SiteConfig
+
+_admission = None
+
+
+class Admission:
+    # Seconds between checks for a free slot while queued
+    POLL_INTERVAL = 0.02
+    # Slot handed out when the lock files cannot be used, (the request is let through without a limit)
+    UNLIMITED = -1
+
+    def __init__(self, path: str, slots: int, queue: int, wait: float):
+        """
+        Limit of how many pages are rendered at once, shared by every CGI process and WSGI thread
+
+        Each slot and each place in the queue is a lock file held with flock for as long as it is in use,
+        so the operating system releases them even when a process is killed part way through a request.
+        Requests which find every slot and every place in the queue taken are turned away immediately.
+
+        :param path: Fully resolved directory to keep the lock files in
+        :param slots: Maximum number of pages rendered at once
+        :param queue: Maximum number of requests waiting for a free slot
+        :param wait: Maximum number of seconds a queued request waits before being turned away
+        """
+        self.path = path
+        self.slots = slots
+        self.queue = queue
+        self.wait = wait
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def _lock(self, name: str, count: int) -> Union[int, None]:
+        """
+        Take the first free lock file of a group, ie: "slot-0.lock" to "slot-3.lock"
+        :param name: Group of lock files, ie: "slot"
+        :param count: Number of lock files in the group
+        :return: File descriptor holding the lock, or None if every one is taken
+        """
+        import fcntl
+        for number in range(count):
+            fd = os.open(os.path.join(self.path, '%s-%d.lock' % (name, number)), os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+            except OSError:
+                os.close(fd)
+                raise
+        return None
+
+    def acquire(self) -> Union[int, None]:
+        """
+        Take a free slot, waiting in the queue for one if there is room
+
+        If the lock files cannot be opened, (ie: the directory was removed or too many files are open),
+        the request is let through rather than failing.
+
+        :return: Slot to pass to release once the page is rendered, or None if the request should be turned away
+        """
+        try:
+            return self._acquire()
+        except OSError:
+            self.admitted += 1
+            return self.UNLIMITED
+
+    def _acquire(self) -> Union[int, None]:
+        slot = self._lock('slot', self.slots)
+        if slot is not None:
+            self.admitted += 1
+            return slot
+
+        place = self._lock('queue', self.queue)
+        if place is None:
+            self.rejected += 1
+            return None
+
+        self.queued += 1
+        try:
+            deadline = time.monotonic() + self.wait
+            while time.monotonic() < deadline:
+                time.sleep(self.POLL_INTERVAL)
+                slot = self._lock('slot', self.slots)
+                if slot is not None:
+                    self.admitted += 1
+                    return slot
+        finally:
+            os.close(place)
+
+        self.rejected += 1
+        return None
+
+    def release(self, slot: int) -> None:
+        """
+        Free a slot taken with acquire
+        """
+        if slot != self.UNLIMITED:
+            # Closing the file releases its lock
+            os.close(slot)
+
+    def get_stats(self) -> dict:
+        """
+        Get the admitted, queued and rejected counters of this process
+        """
+        return {'admitted': self.admitted, 'queued': self.queued, 'rejected': self.rejected}
+
+
+def get_admission() -> Union[Admission, None]:
+    """
+    Get the shared admission control, or None if the number of concurrent renders is not limited
+    """
+    global _admission
+    if SiteConfig.get_admission_slots() <= 0:
+        return None
+    if _admission is None:
+        if importlib.util.find_spec('fcntl') is None:
+            # File locks are only available on Unix-like systems
+            return None
+        try:
+            os.makedirs(SiteConfig.get_path_admission(), exist_ok=True)
+        except OSError:
+            return None
+        _admission = Admission(
+            SiteConfig.get_path_admission(),
+            SiteConfig.get_admission_slots(),
+            SiteConfig.get_admission_queue(),
+            SiteConfig.get_admission_wait()
+        )
+
+    return _admission
@@ -0,0 +1,585 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import argparse
+import builtins
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Callable
+
+import filecollection
+import handlers
+from filecollection import FileCollection
+from markdownloader import MarkdownLoader
+from simplesite import SimpleSite
+from siteconfig import get_config_for_tests
+from templater import Templater
+
+# Server modules copied into the cgi-bin of each generated site, (tests are left behind)
+SERVER_DIR = os.path.dirname(os.path.realpath(__file__))
+
+# Import time budgets in milliseconds for each entry point, (measured with `python -X importtime`),
+# results over budget are flagged so regressions in startup cost are noticed.
+# Set from what a clean tree measures, (crawler ~180ms, meta and sitemap ~125ms), with some headroom for noise.
+IMPORT_BUDGETS = {
+    'crawler.py': 200,
+    'meta.py': 140,
+    'sitemap.py': 140,
+}
+
+_WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+    'magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur excepteur sint '
+    'occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim id est laborum zebra giraffe'
+).split()
+
+_TEMPLATE = '''<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Benchmark Site</title>
+    <meta name="description" content="Synthetic site for benchmarking">
+    <meta property="og:title" content="Benchmark Site">
+    <link rel="stylesheet" href="/css/site.css">
+  </head>
+  <body>
+    <div class="container">
+      <nav><ul><li><a href="/posts.html">Posts</a></li><li><a href="/pages.html">Pages</a></li></ul></nav>
+      <div id="cms"></div>
+    </div>
+    <script src="/js/cms.min.js"></script>
+  </body>
+</html>
+'''
+
+
+class Corpus:
+    def __init__(
+            self,
+            root: str,
+            documents: int = 1000,
+            body_size: int = 2000,
+            front_matter: str = 'simple',
+            topics: int = 10,
+            seed: int = 1
+    ):
+        """
+        Shape of a synthetic site to generate
+
+        :param root: Directory to generate the site into
+        :param documents: Number of posts, (a further 1% of pages are generated alongside them)
+        :param body_size: Approximate size of each Markdown body in characters
+        :param front_matter: "simple" for the common fields only, "complex" for nested and custom fields too
+        :param topics: Number of topic subdirectories to spread posts between, 0 to keep them all in one directory
+        :param seed: Random seed, the same shape and seed always produces the same site
+        """
+        self.root = os.path.realpath(root)
+        self.documents = documents
+        self.body_size = body_size
+        self.front_matter = front_matter
+        self.topics = topics
+        self.seed = seed
+
+    def get_shape(self) -> dict:
+        return {
+            'documents': self.documents,
+            'body_size': self.body_size,
+            'front_matter': self.front_matter,
+            'topics': self.topics,
+            'seed': self.seed,
+        }
+
+    def generate(self, settings: dict) -> None:
+        """
+        Write the site to disk, Markdown files are only regenerated when the shape has changed
+        :param settings: Additional config.ini settings, section => {key => value}
+        """
+        shape_file = os.path.join(self.root, '.corpus.json')
+        try:
+            with open(shape_file) as fp:
+                regenerate = json.load(fp) != self.get_shape()
+        except (FileNotFoundError, ValueError):
+            regenerate = True
+
+        if regenerate:
+            for col_type in ('posts', 'pages'):
+                shutil.rmtree(os.path.join(self.root, col_type), ignore_errors=True)
+            rand = random.Random(self.seed)
+            for i in range(self.documents):
+                topic = 'topic-%d' % (i % self.topics) if self.topics else ''
+                self._write_document(rand, os.path.join(self.root, 'posts', topic, 'post-%d.md' % i), i)
+            for i in range(max(1, self.documents // 100)):
+                self._write_document(rand, os.path.join(self.root, 'pages', 'page-%d.md' % i), i)
+            with open(shape_file, 'w') as fp:
+                json.dump(self.get_shape(), fp)
+
+        with open(os.path.join(self.root, 'index.html'), 'w') as fp:
+            fp.write(_TEMPLATE)
+
+        # Always refresh the server code and configuration so the current working tree is measured
+        cgi = os.path.join(self.root, 'cgi-bin')
+        shutil.rmtree(cgi, ignore_errors=True)
+        os.makedirs(cgi)
+        for file in os.listdir(SERVER_DIR):
+            if file.endswith('.py') and not file.startswith('test_'):
+                shutil.copy(os.path.join(SERVER_DIR, file), cgi)
+
+        config = {
+            'site': {
+                'host': 'https://benchmark.test',
+                'webpath': '/',
+                'defaultView': 'posts',
+                'types': 'posts, pages',
+                'debug': 'false',
+            }
+        }
+        for section, values in settings.items():
+            config.setdefault(section, {}).update(values)
+        with open(os.path.join(cgi, 'config.ini'), 'w') as fp:
+            for section, values in config.items():
+                fp.write('[%s]\n' % section)
+                for key, value in values.items():
+                    fp.write('%s = %s\n' % (key, value))
+                fp.write('\n')
+
+    def _write_document(self, rand: random.Random, filename: str, number: int) -> None:
+        words = rand.sample(_WORDS, 4)
+        published = date(2015, 1, 1) + timedelta(days=rand.randrange(3650))
+        lines = [
+            '---',
+            'title: %s %d' % (' '.join(words).title(), number),
+            'date: %s' % published.isoformat(),
+            'author: %s' % rand.choice(['Alice', 'Bob', 'Carol', 'Dave']),
+            'tags: [%s]' % ', '.join(rand.sample(_WORDS, 3)),
+        ]
+        if rand.random() < 0.02:
+            lines.append('draft: true')
+        if self.front_matter == 'complex':
+            lines += [
+                'seotitle: %s | Benchmark Site' % ' '.join(words).title(),
+                'description: %s' % ' '.join(rand.choices(_WORDS, k=20)),
+                'image:',
+                '  src: images/%s.jpg' % words[0],
+                '  alt: %s' % words[1],
+                'banner:',
+                '  src: https://benchmark.test/banners/%s.jpg' % words[2],
+                'categories:',
+            ]
+            lines += ['  - %s' % word for word in rand.sample(_WORDS, 3)]
+            lines += ['custom_%d: %s' % (i, rand.choice(_WORDS)) for i in range(20)]
+        lines += ['---', '', '# ' + ' '.join(words).title(), '']
+
+        size = 0
+        while size < self.body_size:
+            kind = rand.random()
+            if kind < 0.1:
+                block = '## ' + ' '.join(rand.choices(_WORDS, k=4)).title()
+            elif kind < 0.2:
+                block = '\n'.join('* ' + ' '.join(rand.choices(_WORDS, k=6)) for _ in range(4))
+            elif kind < 0.25:
+                block = '```\n' + '\n'.join(' '.join(rand.choices(_WORDS, k=5)) for _ in range(3)) + '\n```'
+            elif kind < 0.3:
+                block = '![%s](images/%s.jpg)' % (rand.choice(_WORDS), rand.choice(_WORDS))
+            else:
+                sentence = rand.choices(_WORDS, k=60)
+                sentence[10] = '[%s](/posts/post-%d.html)' % (sentence[10], rand.randrange(self.documents or 1))
+                sentence[20] = '**' + sentence[20] + '**'
+                block = ' '.join(sentence).capitalize() + '.'
+            lines += [block, '']
+            size += len(block)
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as fp:
+            fp.write('\n'.join(lines))
+
+
+class SlowFilesystem:
+    """
+    Stand-in for a high-latency filesystem, (ie: a network mount), within this process
+
+    Every directory listing, stat and open sleeps for the given latency first,
+    sleeping releases the GIL the same as waiting on a real mount.
+    """
+
+    def __init__(self, latency: float):
+        """
+        :param latency: Seconds to add to every call
+        """
+        self.latency = latency
+        self._originals = None
+
+    def __enter__(self):
+        self._originals = (os.scandir, os.stat, builtins.open)
+        scandir, stat, open_ = self._originals
+        latency = self.latency
+
+        class SlowEntry:
+            # DirEntry cannot be subclassed, (is_dir() and name come with the listing, stat() is a round trip)
+            def __init__(self, entry):
+                self._entry = entry
+                self.name = entry.name
+                self.path = entry.path
+
+            def is_dir(self, **kwargs):
+                return self._entry.is_dir(**kwargs)
+
+            def is_file(self, **kwargs):
+                return self._entry.is_file(**kwargs)
+
+            def stat(self, **kwargs):
+                time.sleep(latency)
+                return self._entry.stat(**kwargs)
+
+        class SlowScandir:
+            def __init__(self, path):
+                time.sleep(latency)
+                self._it = scandir(path)
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                self._it.close()
+
+            def __iter__(self):
+                return (SlowEntry(entry) for entry in self._it)
+
+        def slow_stat(*args, **kwargs):
+            time.sleep(latency)
+            return stat(*args, **kwargs)
+
+        def slow_open(*args, **kwargs):
+            time.sleep(latency)
+            return open_(*args, **kwargs)
+
+        os.scandir, os.stat, builtins.open = SlowScandir, slow_stat, slow_open
+        return self
+
+    def __exit__(self, *args):
+        os.scandir, os.stat, builtins.open = self._originals
+
+
+def _summarize(name: str, mode: str, timings: list, peak_memory: int) -> dict:
+    return {
+        'name': name,
+        'mode': mode,
+        'runs': len(timings),
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'peak_memory': peak_memory,
+    }
+
+
+def time_script(corpus: Corpus, script: str, query: str, runs: int) -> dict:
+    """
+    Time a CGI script from a fresh interpreter, (imports, configuration, and the request itself)
+
+    :param corpus: Generated site
+    :param script: Script within cgi-bin, ie: "crawler.py"
+    :param query: QUERY_STRING to send
+    :param runs: Number of times to run it
+    :return: Summary, with peak memory as the maximum resident set size in bytes
+    """
+    env = dict(os.environ, QUERY_STRING=query, REQUEST_METHOD='GET', GATEWAY_INTERFACE='CGI/1.1')
+    timings = []
+    peak = 0
+    for _ in range(runs):
+        # A file rather than a pipe, so a script writing more than the pipe can hold does not block forever
+        with tempfile.TemporaryFile() as stderr:
+            start = time.perf_counter()
+            proc = subprocess.Popen(
+                [sys.executable, os.path.join(corpus.root, 'cgi-bin', script)],
+                env=env, stdout=subprocess.DEVNULL, stderr=stderr
+            )
+            _, status, usage = os.wait4(proc.pid, 0)
+            timings.append(time.perf_counter() - start)
+            # Linux reports this in kilobytes
+            peak = max(peak, usage.ru_maxrss * 1024)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            if proc.returncode != 0:
+                stderr.seek(0)
+                raise RuntimeError('%s?%s failed: %s' % (script, query, stderr.read().decode()))
+
+    return _summarize(script + '?' + query, 'cold', timings, peak)
+
+
+def time_imports(corpus: Corpus, script: str, query: str, top: int = 10) -> dict:
+    """
+    Measure the module imports of a CGI script with `python -X importtime`
+
+    :param corpus: Generated site
+    :param script: Script within cgi-bin, ie: "crawler.py"
+    :param query: QUERY_STRING to send
+    :param top: Number of the most expensive modules to report
+    :return: Total import time in seconds, the number of modules, and the most expensive modules by their own time
+    """
+    env = dict(os.environ, QUERY_STRING=query, REQUEST_METHOD='GET', GATEWAY_INTERFACE='CGI/1.1')
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.join(corpus.root, 'cgi-bin', script)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+
+    modules = []
+    for line in proc.stderr.splitlines():
+        # "import time:       250 |       1743 |       sqlite3", (times in microseconds)
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(own) / 1000000))
+
+    total = sum(own for _, own in modules)
+    budget = IMPORT_BUDGETS.get(script)
+    return {
+        'total': total,
+        'modules': len(modules),
+        'top': sorted(modules, key=lambda m: m[1], reverse=True)[:top],
+        'loaded': sorted(name for name, _ in modules),
+        'budget': budget,
+        'over_budget': budget is not None and total * 1000 > budget,
+    }
+
+
+def time_call(name: str, func: Callable, runs: int) -> list:
+    """
+    Time a function within this process, the first call is reported as "first" and the rest as "warm"
+
+    :param name: Name to report the results under
+    :param func: Function to call, (no arguments)
+    :param runs: Number of warm calls to time
+    :return: Summaries, with peak memory as the peak of Python allocations in bytes
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    first = time.perf_counter() - start
+    first_peak = tracemalloc.get_traced_memory()[1]
+    # Anything still held from the first call, (ie: caches), is not part of the warm call's peak
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    func()
+    warm_peak = tracemalloc.get_traced_memory()[1] - held
+    tracemalloc.stop()
+
+    # Timed separately, tracemalloc slows allocations down considerably
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    return [_summarize(name, 'first', [first], first_peak), _summarize(name, 'warm', timings, warm_peak)]
+
+
+def time_slow_scan(corpus: Corpus, latency: float, io_threads: int, runs: int) -> list:
+    """
+    Time loading the posts collection, (listing, stat'ing and parsing every file), on a simulated slow filesystem
+
+    Configuration must already be loaded for the site.
+
+    :param corpus: Generated site
+    :param latency: Seconds added to every filesystem call
+    :param io_threads: Threads to compare against making one call at a time
+    :param runs: Number of times to repeat each measurement
+    :return: Summaries for one call at a time and with the I/O threads
+    """
+    config = get_config_for_tests()
+    results = []
+    for threads in (0, io_threads):
+        config.io_threads = threads
+        filecollection._io_executor = None
+
+        timings = []
+        with SlowFilesystem(latency):
+            for _ in range(runs):
+                start = time.perf_counter()
+                FileCollection('posts')
+                timings.append(time.perf_counter() - start)
+        results.append(_summarize(
+            'FileCollection(posts) +%gms io_threads=%d' % (latency * 1000, threads), 'slow', timings, 0
+        ))
+
+    if filecollection._io_executor is not None:
+        filecollection._io_executor.shutdown()
+    filecollection._io_executor = None
+    config.io_threads = 0
+    return results
+
+
+def run(corpus: Corpus, runs: int, latency: float = 0, io_threads: int = 16) -> list:
+    """
+    Run every benchmark against a generated site
+    :param corpus: Generated site
+    :param runs: Number of times to repeat each measurement
+    :param latency: Seconds of simulated filesystem latency to also time loading with, 0 to skip
+    :param io_threads: Number of I/O threads to compare against when simulating latency
+    """
+    results = []
+    post = '/posts/%spost-0.html' % ('topic-0/' if corpus.topics else '')
+    requests = [
+        ('crawler.py', 'page=' + post),
+        ('crawler.py', 'page=/posts.html'),
+        ('meta.py', ''),
+        ('sitemap.py', ''),
+    ]
+    for script, query in requests:
+        result = time_script(corpus, script, query, runs)
+        result['imports'] = time_imports(corpus, script, query)
+        results.append(result)
+
+    # The same requests and their key methods within this process, (as under WSGI)
+    config = get_config_for_tests()
+    config.path_root = corpus.root
+    config.path_config = os.path.join(corpus.root, 'cgi-bin', 'config.ini')
+    config.load()
+
+    filename = os.path.join(corpus.root, post[1:].replace('.html', '.md'))
+    template = os.path.join(corpus.root, 'index.html')
+    calls = [
+        ('FileCollection(posts)', lambda: FileCollection('posts')),
+        ('MarkdownLoader', lambda: MarkdownLoader(filename).get_metas()),
+        ('MarkdownLoader(lazy)', lambda: MarkdownLoader(filename, lazy=True).get_metas()),
+        ('MarkdownLoader.__str__', lambda: str(MarkdownLoader(filename))),
+        ('Templater', lambda: str(Templater(template))),
+    ]
+    for script, query in requests:
+        handler = getattr(handlers, script[:-3])
+        calls.append((
+            'handlers.%s?%s' % (handler.__name__, query),
+            lambda h=handler, q=query: SimpleSite.handle(h, {'QUERY_STRING': q}).get_body()
+        ))
+    for name, func in calls:
+        results += time_call(name, func, runs)
+
+    if latency:
+        results += time_slow_scan(corpus, latency, io_threads, runs)
+
+    return results
+
+
+def compare(results: list, baseline: list) -> None:
+    """
+    Print the change in median time and peak memory of each result from an earlier run
+    """
+    previous = {(r['corpus']['documents'], r['name'], r['mode']): r for r in baseline}
+    for result in results:
+        old = previous.get((result['corpus']['documents'], result['name'], result['mode']))
+        if old is None:
+            continue
+        print('%8d %-50s %-5s time %+7.1f%%  memory %+7.1f%%' % (
+            result['corpus']['documents'],
+            result['name'][:50],
+            result['mode'],
+            (result['median'] / old['median'] - 1) * 100 if old['median'] else 0,
+            (result['peak_memory'] / old['peak_memory'] - 1) * 100 if old['peak_memory'] else 0,
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the server-side application against synthetic sites')
+    parser.add_argument('--documents', type=int, nargs='+', default=[1000], help='Site sizes to test, (default: 1000)')
+    parser.add_argument('--body-size', type=int, default=2000, help='Approximate characters per document body')
+    parser.add_argument('--front-matter', choices=['simple', 'complex'], default='simple', help='Front matter shape')
+    parser.add_argument('--topics', type=int, default=10, help='Number of topic subdirectories, (0 for none)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for generating sites')
+    parser.add_argument('--runs', type=int, default=3, help='Number of times to repeat each measurement')
+    parser.add_argument(
+        '--set', action='append', default=[], metavar='SECTION.KEY=VALUE',
+        help='Additional config.ini setting for the generated sites, ie: index.enabled=true'
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0,
+        help='Also time loading with this many milliseconds added to every filesystem call, (ie: 2 for a network mount)'
+    )
+    parser.add_argument('--io-threads', type=int, default=16, help='I/O threads to compare against with --latency')
+    parser.add_argument('--site', default=None, help='Directory to generate sites in, (default: a temporary directory)')
+    parser.add_argument('--output', default=None, help='Write the results to this JSON file')
+    parser.add_argument('--compare', default=None, help='Compare against the results of an earlier run')
+    args = parser.parse_args()
+
+    settings = {}
+    for setting in args.set:
+        key, _, value = setting.partition('=')
+        section, _, key = key.partition('.')
+        settings.setdefault(section, {})[key] = value
+
+    site = args.site or os.path.join(os.environ.get('TMPDIR', '/tmp'), 'markdownmaster-benchmark')
+    results = []
+    for documents in args.documents:
+        corpus = Corpus(
+            os.path.join(site, str(documents)), documents, args.body_size, args.front_matter, args.topics, args.seed
+        )
+        corpus.generate(settings)
+        for result in run(corpus, args.runs, args.latency / 1000, args.io_threads):
+            result['corpus'] = corpus.get_shape()
+            results.append(result)
+            print('%8d %-50s %-5s %9.2fms %10.1fKB' % (
+                documents, result['name'][:50], result['mode'], result['median'] * 1000, result['peak_memory'] / 1024
+            ), flush=True)
+            if 'imports' in result:
+                imports = result['imports']
+                print('%8s imports %7.2fms%s, %d modules; %s' % (
+                    '',
+                    imports['total'] * 1000,
+                    ' (OVER BUDGET of %dms)' % imports['budget'] if imports['over_budget'] else '',
+                    imports['modules'],
+                    ', '.join('%s %.1fms' % (name, own * 1000) for name, own in imports['top'][:5])
+                ), flush=True)
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=SERVER_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'commit': commit,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.time(),
+                'settings': settings,
+                'results': results,
+            }, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/opt/markdownmaster/bin/python3
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+
+import handlers
+from filecollection import FileCollection
+from markdownloader import get_html_path
+from simplesite import SimpleSite
+from siteconfig import SiteConfig, get_config, init_worker_config
+
+MANIFEST = '.build-manifest.json'
+
+
+def write_atomic(path: str, content: str) -> None:
+    """
+    Write a file so that readers only ever see the old or the new version, never a partial one
+    :param path: Fully resolved destination path
+    :param content: Content to write
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            fp.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _init_worker(path_config: str, path_root: str) -> None:
+    """
+    Set up a worker process to render with the site configuration, without the limit on concurrent renders
+
+    The build has its own fixed number of workers and must render every page,
+    (never be turned away because live traffic is holding the render slots).
+    """
+    init_worker_config(path_config, path_root)
+    get_config().admission_slots = 0
+
+
+def _render(page: str) -> tuple:
+    """
+    Render a single crawler page within a worker process
+    :param page: Page to render, ie: "posts/my_post.html"
+    :return: (page, status code, body)
+    """
+    response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=' + quote(page)})
+    return page, response.code, response.get_body().decode('utf-8')
+
+
+class Builder:
+    def __init__(self, output: str, workers: int = None, force: bool = False):
+        """
+        Pre-render every crawler page, listing page, sitemap.xml and meta.json into a static directory
+        :param output: Directory to write the static site into
+        :param workers: Number of worker processes to render with, (defaults to the number of CPUs)
+        :param force: Set to True to render everything, even sources which have not changed
+        """
+        self.output = os.path.realpath(output)
+        if self.output == os.path.realpath(SiteConfig.get_path_root()):
+            # The crawler passes existing .html files straight through, so would serve back stale output
+            raise ValueError('Output directory must not be the site root')
+        self.workers = workers
+        self.force = force
+        self.manifest = {}
+        # Pages which could not be rendered by the last build, as (page, status code)
+        self.failed = []
+        if not force:
+            try:
+                with open(os.path.join(self.output, MANIFEST)) as fp:
+                    self.manifest = json.load(fp)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    def build(self) -> dict:
+        """
+        Build the static site, returning counts of rendered, skipped, removed, and failed files
+
+        Pages which failed to render are listed in self.failed and are tried again by the next build.
+        """
+        template = os.path.join(SiteConfig.get_path_root(), 'index.html')
+        template_sig = os.stat(template).st_mtime_ns
+        signatures = {}
+        site_sig = [template_sig]
+        # Number of sitemap URLs of each type, (its listing page plus every published file, the same as the handler)
+        counts = {}
+
+        for collection_type in SiteConfig.get_types():
+            try:
+                collection = FileCollection(collection_type)
+            except FileNotFoundError:
+                continue
+
+            listing_sig = [template_sig]
+            published = 0
+            for file in collection.files:
+                stat = os.stat(file.filename)
+                listing_sig.append([file.path, stat.st_mtime_ns, stat.st_size])
+                if not file.get_meta(['draft'], False):
+                    signatures[get_html_path(file.path)[1:]] = [template_sig, stat.st_mtime_ns, stat.st_size]
+                    published += 1
+
+            signatures[collection_type + '.html'] = listing_sig
+            # Later pages of long listings, (the crawler serves "?page=2" and "/page/2.html" alike)
+            size = SiteConfig.get_listing_page_size()
+            for number in range(2, -(-published // size) + 1 if size > 0 else 2):
+                signatures['%s/page/%d.html' % (collection_type, number)] = listing_sig
+            site_sig.append(listing_sig)
+            counts[collection_type] = published + 1
+
+        # Only render pages whose sources have changed since the previous build, (or are missing)
+        pages = [
+            page for page, sig in signatures.items()
+            if self.force or self.manifest.get(page) != sig or not os.path.exists(os.path.join(self.output, page))
+        ]
+
+        stats = {'rendered': 0, 'skipped': len(signatures) - len(pages), 'removed': 0, 'failed': 0}
+        self.failed = []
+        config = get_config()
+        with ProcessPoolExecutor(
+            self.workers, initializer=_init_worker, initargs=(config.path_config, config.path_root)
+        ) as executor:
+            for page, code, body in executor.map(_render, pages, chunksize=16):
+                if code == 200:
+                    write_atomic(os.path.join(self.output, page), body)
+                    stats['rendered'] += 1
+                else:
+                    # Unable to render, do not record it so it gets retried on the next build
+                    del signatures[page]
+                    self.failed.append((page, code))
+                    stats['failed'] += 1
+
+        # The feeds cover every collection, so are regenerated whenever anything changed
+        feeds = [('sitemap.xml', handlers.sitemap, {}), ('meta.json', handlers.meta, {})]
+        if sum(counts.values()) > handlers.SITEMAP_LIMIT:
+            # Large sites get a sitemap index, so also need each of the child sitemaps it links to
+            for collection_type, count in counts.items():
+                for page in range(1, -(-count // handlers.SITEMAP_LIMIT) + 1):
+                    feeds.append((
+                        'sitemap-%s-%d.xml' % (collection_type, page),
+                        handlers.sitemap,
+                        {'QUERY_STRING': 'type=%s&page=%d' % (collection_type, page)}
+                    ))
+
+        for name, handler, environ in feeds:
+            if not self.force and self.manifest.get(name) == site_sig and os.path.exists(os.path.join(self.output, name)):
+                signatures[name] = site_sig
+                stats['skipped'] += 1
+                continue
+
+            response = SimpleSite.handle(handler, environ)
+            if response.code == 200:
+                write_atomic(os.path.join(self.output, name), response.get_body().decode('utf-8'))
+                signatures[name] = site_sig
+                stats['rendered'] += 1
+            else:
+                self.failed.append((name, response.code))
+                stats['failed'] += 1
+
+        # Drop any output from documents which have been deleted or switched back to a draft
+        for page in self.manifest:
+            if page not in signatures:
+                try:
+                    os.unlink(os.path.join(self.output, page))
+                    stats['removed'] += 1
+                except FileNotFoundError:
+                    pass
+
+        write_atomic(os.path.join(self.output, MANIFEST), json.dumps(signatures))
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-render the crawler pages, sitemap.xml and meta.json as static files')
+    parser.add_argument('output', help='Directory to write the rendered site into')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes, (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='Render everything, even unchanged sources')
+    args = parser.parse_args()
+
+    builder = Builder(args.output, args.workers, args.force)
+    stats = builder.build()
+    print('Rendered %(rendered)d, skipped %(skipped)d unchanged, removed %(removed)d, failed %(failed)d' % stats)
+    if builder.failed:
+        for page, code in builder.failed:
+            print('Unable to render %s, (status %d)' % (page, code), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
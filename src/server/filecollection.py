@@ -21,44 +21,535 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import heapq
+import json
 import os
-from typing import Union
+import re
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING, Union
 
 from markdownloader import MarkdownLoader
-from siteconfig import SiteConfig
+from metaindex import get_index
+from siteconfig import SiteConfig, get_config, init_worker_config
+import timing
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+
+_executor = None
+_io_executor = None
+# Compiled ignore globs, (patterns, regex)
+_ignore = None
+
+
+def _get_executor() -> Union['Executor', None]:
+    """
+    Get the shared worker pool for parsing files, or None if parallel loading is disabled
+    """
+    global _executor
+    if _executor is None and SiteConfig.get_workers() > 1:
+        # Only imported when workers are enabled, it is a noticeable part of a CGI request's startup
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        if SiteConfig.get_worker_mode() == 'thread':
+            _executor = ThreadPoolExecutor(SiteConfig.get_workers())
+        else:
+            config = get_config()
+            _executor = ProcessPoolExecutor(
+                SiteConfig.get_workers(),
+                initializer=init_worker_config,
+                initargs=(config.path_config, config.path_root)
+            )
+
+    return _executor
+
+
+def _get_io_executor() -> Union['Executor', None]:
+    """
+    Get the shared thread pool for filesystem calls, or None if they should be made one at a time
+
+    Separate from the worker pool, this only keeps many slow calls in flight at once, (ie: on network mounts).
+    """
+    global _io_executor
+    if _io_executor is None and SiteConfig.get_io_threads() > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        _io_executor = ThreadPoolExecutor(SiteConfig.get_io_threads())
+
+    return _io_executor
+
+
+def _stat(path: str) -> Union[os.stat_result, None]:
+    """
+    Stat a file, or None if it no longer exists, (or is a broken symlink)
+    """
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _load_file(path: str, stat: Union[os.stat_result, None] = None) -> MarkdownLoader:
+    """
+    Load a single file for a collection, only the front matter is read up front
+    """
+    return MarkdownLoader(path, lazy=True, stat=stat)
+
+
+def _load_file_resolved(path: str, stat: Union[os.stat_result, None] = None) -> MarkdownLoader:
+    """
+    Load a single file within a worker process, generating its excerpt there too
+    rather than leaving that work for the parent process
+    """
+    loader = MarkdownLoader(path, lazy=True, stat=stat)
+    loader.get_metas()
+    return loader
+
+
+def load_files(paths: list, stats: Union[list, None] = None) -> list:
+    """
+    Parse a list of Markdown files, spreading the work across the worker pool if one is configured
+
+    Files are always returned in the same order as requested.
+
+    :param paths: List of fully resolved paths, ie: ["/var/www/posts/my_post.md"]
+    :param stats: Matching list of os.stat results if already known, (ie: from scanning the directory)
+    """
+    if stats is None:
+        stats = [None] * len(paths)
+
+    executor = _get_executor()
+    if executor is None and len(paths) > 1 and _get_io_executor() is not None:
+        # Parsing is left in this process, but many files are read at once,
+        # (excerpts are generated up front too, so their reads happen concurrently as well)
+        return list(_get_io_executor().map(_load_file_resolved, paths, stats))
+    if executor is None or len(paths) < 2:
+        return [_load_file(path, stat) for path, stat in zip(paths, stats)]
+
+    # Send the work in batches to keep the per-task overhead of process pools down
+    chunksize = max(1, len(paths) // (SiteConfig.get_workers() * 4))
+    load = _load_file if SiteConfig.get_worker_mode() == 'thread' else _load_file_resolved
+    return list(executor.map(load, paths, stats, chunksize=chunksize))
+
+
+def is_ignored(name: str) -> bool:
+    """
+    Check if a file or directory name matches one of the configured ignore globs
+    :param name: Base name of the file or directory, ie: "_drafts"
+    """
+    global _ignore
+    patterns = SiteConfig.get_scan_ignore()
+    if not patterns:
+        return False
+
+    if _ignore is None or _ignore[0] != patterns:
+        import fnmatch
+        _ignore = (patterns, re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns)))
+
+    return _ignore[1].match(name) is not None
 
 
 class FileCollection:
-    def __init__(self, col_type: str):
+    # Set by long-running processes to keep parsed files in memory between requests
+    keep_warm = False
+    # Parsed files kept between requests, path => (mtime_ns, size, MarkdownLoader)
+    _loaders = {}
+
+    def __init__(self, col_type: str, scanned: Union[list, None] = None):
         """
         Initialize a new collection of files, will scan the filesystem in the given directory for all files
         :param col_type: Directory to scan, ie: "posts"
+        :param scanned: Files of this type already found by get_sources in this request, saves scanning them again
         """
         self.files = []
         self.url = SiteConfig.get_host() + os.path.join(SiteConfig.get_path_web(), col_type + '.html')
+        # Lookup tables, built on first use
+        self._by_path = None
+        self._by_tag = None
+        self._by_author = None
+        self._drafts = None
+        self._published = None
+        self._sorted = None
+        self._dates = None
 
         p_dir = SiteConfig.get_path_root()
+        with timing.span('scan'):
+            watched = self._get_watched(col_type)
+        if watched is not None:
+            # The watcher keeps the index current, so there is no need to touch the filesystem at all
+            for path, mtime, size, metas in watched:
+                path = p_dir + path
+                warm = FileCollection._loaders.get(path) if self.keep_warm else None
+                if warm is not None and warm[0] == mtime and warm[1] == size:
+                    self.files.append(warm[2])
+                    continue
+                loader = MarkdownLoader.from_metas(path, json.loads(metas))
+                if self.keep_warm:
+                    self._set_warm(path, mtime, size, loader)
+                self.files.append(loader)
+            if self.keep_warm:
+                self._prune_warm(col_type, [file.filename for file in self.files])
+            return
 
-        for file in os.listdir(os.path.join(p_dir, col_type)):
-            if os.path.isdir(os.path.join(p_dir, col_type, file)):
-                # Iterate once
-                for subfile in os.listdir(os.path.join(p_dir, col_type, file)):
-                    if subfile.endswith('.md'):
-                        # Files like to be fully resolved
-                        path = os.path.join(p_dir, col_type, file, subfile)
-                        self.files.append(MarkdownLoader(path))
-            elif file.endswith('.md'):
-                # Files like to be fully resolved
-                path = os.path.join(p_dir, col_type, file)
-                self.files.append(MarkdownLoader(path))
+        index = get_index()
+        # Records still left in here after the scan belong to files which have since been removed
+        indexed = index.get_type(col_type) if index is not None else {}
+        changed = []
+        # Files which need to be parsed, (position in self.files, path, stat)
+        pending = []
+
+        with timing.span('scan'):
+            if scanned is None:
+                scanned = self._scan(os.path.join(p_dir, col_type))
+            for path, stat in scanned:
+                record = indexed.pop(path[len(p_dir):], None)
+                warm = FileCollection._loaders.get(path) if self.keep_warm else None
+                if warm is not None and warm[0] == stat.st_mtime_ns and warm[1] == stat.st_size:
+                    # Already parsed by an earlier request in this process
+                    self.files.append(warm[2])
+                elif record is not None and record[0] == stat.st_mtime_ns and record[1] == stat.st_size:
+                    # File is unchanged since it was indexed, skip parsing it entirely
+                    loader = MarkdownLoader.from_metas(path, json.loads(record[2]))
+                    if self.keep_warm:
+                        self._set_warm(path, stat.st_mtime_ns, stat.st_size, loader)
+                    self.files.append(loader)
+                else:
+                    pending.append((len(self.files), path, stat))
+                    self.files.append(None)
+
+        with timing.span('parse'):
+            loaders = load_files([p[1] for p in pending], [p[2] for p in pending])
+            for (pos, path, stat), loader in zip(pending, loaders):
+                self.files[pos] = loader
+                changed.append((loader.path, stat.st_mtime_ns, stat.st_size, loader.get_metas()))
+                if self.keep_warm:
+                    self._set_warm(path, stat.st_mtime_ns, stat.st_size, loader)
+
+        if self.keep_warm:
+            self._prune_warm(col_type, [file.filename for file in self.files])
+
+        if index is not None and (changed or indexed):
+            index.update(col_type, changed, list(indexed.keys()))
+
+    @staticmethod
+    def _set_warm(path: str, mtime: int, size: int, loader: MarkdownLoader) -> None:
+        """
+        Keep a parsed file in memory for later requests, (its body is read again whenever it is needed)
+        :param path: Fully resolved path
+        :param mtime: Modification time in nanoseconds the file was parsed at
+        :param size: Size of the file it was parsed at
+        :param loader: Parsed file
+        """
+        loader.unload_content()
+        FileCollection._loaders[path] = (mtime, size, loader)
+
+    @staticmethod
+    def _prune_warm(col_type: str, paths: list) -> None:
+        """
+        Drop files kept in memory which were not found by the latest scan of a collection, (ie: deleted or moved)
+        :param col_type: Collection type, ie: "posts"
+        :param paths: Fully resolved paths of every file currently in the collection
+        """
+        prefix = os.path.join(SiteConfig.get_path_root(), col_type) + os.sep
+        paths = set(paths)
+        # Copied first, other collections may be loaded at the same time
+        for path in list(FileCollection._loaders):
+            if path.startswith(prefix) and path not in paths:
+                FileCollection._loaders.pop(path, None)
+
+    @classmethod
+    def load_all(cls, col_types: list, scans: Union[dict, None] = None) -> dict:
+        """
+        Load multiple collections, concurrently if parallel loading or I/O threads are enabled
+
+        :param col_types: List of directories to scan, ie: ["posts", "pages"]
+        :param scans: Files already found by get_sources in this request, type => list of (path, stat)
+        :return: Dictionary of type => FileCollection, (or None if the directory does not exist), in the requested order
+        """
+        def load(col_type: str) -> Union[FileCollection, None]:
+            try:
+                return cls(col_type, scans.get(col_type) if scans is not None else None)
+            except FileNotFoundError:
+                return None
+
+        if (SiteConfig.get_workers() > 1 or SiteConfig.get_io_threads() > 1) and len(col_types) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(len(col_types)) as executor:
+                return dict(zip(col_types, executor.map(load, col_types)))
+
+        return {col_type: load(col_type) for col_type in col_types}
+
+    @classmethod
+    def get_sources(cls, col_type: str, scans: Union[dict, None] = None) -> list:
+        """
+        Get the path, modification time and size of every file in a collection, without parsing any of them
+
+        Useful as a cheap validator for anything generated from the whole collection.
+
+        :param col_type: Directory to scan, ie: "posts"
+        :param scans: Dictionary to store the files found under the type, (if the filesystem was scanned),
+            so loading the collection later in the same request does not need to scan it again
+        :return: List of (path, mtime_ns, size)
+        :throws FileNotFoundError:
+        """
+        watched = cls._get_watched(col_type)
+        if watched is not None:
+            return [record[0:3] for record in watched]
+
+        p_dir = SiteConfig.get_path_root()
+        sources = []
+        with timing.span('scan'):
+            scanned = cls._scan(os.path.join(p_dir, col_type))
+            for path, stat in scanned:
+                sources.append((path[len(p_dir):], stat.st_mtime_ns, stat.st_size))
+        if scans is not None:
+            scans[col_type] = scanned
+        return sources
+
+    @staticmethod
+    def _get_watched(col_type: str) -> Union[list, None]:
+        """
+        Get the indexed records of a collection type if they are kept up to date by watcher.py,
+        in the same order as _scan would find the files
+
+        :param col_type: Directory to scan, ie: "posts"
+        :return: List of (path, mtime_ns, size, metas_json), or None if the filesystem needs to be checked instead
+        """
+        if not SiteConfig.get_index_watched():
+            return None
+        index = get_index()
+        if index is None or not index.is_watched(col_type):
+            return None
+
+        records = index.get_type(col_type)
+        # Directories sort by their own name, (not with their trailing slash), the same as listdir
+        return [(path,) + records[path] for path in sorted(records, key=lambda p: p.split('/'))]
+
+    @staticmethod
+    def _scan(directory: str, directories: Union[list, None] = None) -> list:
+        """
+        Get all Markdown files within a directory and its subdirectories, (up to the configured depth)
+
+        Each file is only stat'ed once, the results are passed along so nothing needs to stat it again.
+        Names matching the configured ignore globs are skipped, (along with everything within ignored directories).
+
+        :param directory: Directory to scan, ie: "/var/www/posts"
+        :param directories: List to append every directory scanned to, (ie: for watching them for changes)
+        :return: List of (fully resolved path, os.stat_result)
+        :throws FileNotFoundError:
+        """
+        max_depth = SiteConfig.get_scan_depth()
+        files = []
+        # Directories already scanned as (device, inode), so symlinks pointing back up the tree are not followed forever
+        visited = set()
+
+        def scan(path: str, stat: os.stat_result, depth: int):
+            if (stat.st_dev, stat.st_ino) in visited:
+                return
+            visited.add((stat.st_dev, stat.st_ino))
+            if directories is not None:
+                directories.append(path)
+
+            with os.scandir(path) as it:
+                # Sorted so the collection order is the same regardless of filesystem or loading mode
+                entries = sorted(it, key=lambda e: e.name)
+
+            for entry in entries:
+                if is_ignored(entry.name):
+                    continue
+                try:
+                    if entry.is_dir():
+                        if depth < max_depth:
+                            scan(entry.path, entry.stat(), depth + 1)
+                    elif entry.name.endswith('.md'):
+                        files.append((entry.path, entry.stat()))
+                except FileNotFoundError:
+                    # Removed while scanning, or a broken symlink
+                    pass
+
+        executor = _get_io_executor()
+        if executor is None:
+            scan(directory, os.stat(directory), 0)
+            return files
+
+        # Concurrently, every directory of a level is listed at once then every file is stat'ed at once
+        level = [(directory, os.stat(directory))]
+        paths = []
+        for depth in range(max_depth + 1):
+            unvisited = []
+            for path, stat in level:
+                if (stat.st_dev, stat.st_ino) not in visited:
+                    visited.add((stat.st_dev, stat.st_ino))
+                    unvisited.append(path)
+            if directories is not None:
+                directories += unvisited
+
+            subdirectories = []
+            for found_paths, found_directories in executor.map(
+                lambda d: FileCollection._list_directory(d, depth < max_depth), unvisited
+            ):
+                paths += found_paths
+                subdirectories += found_directories
+            level = subdirectories
+            if not level:
+                break
+
+        files = [(path, stat) for path, stat in zip(paths, executor.map(_stat, paths)) if stat is not None]
+        # The same order as scanning one directory at a time, (directories sort by their own name)
+        files.sort(key=lambda f: f[0][len(directory):].split('/'))
+        if directories is not None:
+            directories.sort(key=lambda d: d[len(directory):].split('/'))
+        return files
+
+    @staticmethod
+    def _list_directory(path: str, subdirectories: bool) -> tuple:
+        """
+        List the Markdown files and, (optionally), the subdirectories of a single directory
+        :param path: Fully resolved directory
+        :param subdirectories: Set to False to leave out subdirectories
+        :return: List of file paths, and list of (path, stat) of subdirectories
+        """
+        files = []
+        directories = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if is_ignored(entry.name):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if subdirectories:
+                                directories.append((entry.path, entry.stat()))
+                        elif entry.name.endswith('.md'):
+                            files.append(entry.path)
+                    except FileNotFoundError:
+                        # Removed while scanning, or a broken symlink
+                        pass
+        except FileNotFoundError:
+            # Removed while scanning, the top-level directory is checked before getting here
+            pass
+        return files, directories
 
     def get_by_path(self, file_path: str) -> Union[MarkdownLoader, None]:
         """
         Get a file by its relative path or None if not found
         :param file_path: File path, relative to the application, ie: "/posts/my_post.md"
         """
+        if self._by_path is None:
+            self._by_path = {file.path: file for file in self.files}
+
+        return self._by_path.get(file_path)
+
+    def _build_indexes(self) -> None:
+        """
+        Build the lookup tables for tags, authors and drafts in a single pass over the files
+        """
+        if self._published is not None:
+            return
+
+        self._by_tag = {}
+        self._by_author = {}
+        self._drafts = []
+        self._published = []
         for file in self.files:
-            if file.path == file_path:
-                return file
+            if file.get_meta(['draft'], False):
+                self._drafts.append(file)
+                continue
 
-        return None
+            self._published.append(file)
+            # Matched case-insensitively, the same as the client
+            for tag in self._get_values(file.get_meta(['tags'], None)):
+                self._by_tag.setdefault(tag.lower(), []).append(file)
+            for author in self._get_values(file.get_meta(['author'], None)):
+                self._by_author.setdefault(author.lower(), []).append(file)
+
+    @staticmethod
+    def _get_values(value) -> list:
+        """
+        Get the meta value of a file as a list of strings, (tags and authors may be a single value or a list)
+        """
+        if value is None or value == '':
+            return []
+        if isinstance(value, list):
+            return [str(v) for v in value]
+        return [str(value)]
+
+    def by_tag(self, tag: str) -> list:
+        """
+        Get the published files with a given tag, in collection order
+        :param tag: Tag to search, (case-insensitive), ie: "Configuration"
+        """
+        self._build_indexes()
+        return list(self._by_tag.get(tag.lower(), []))
+
+    def by_author(self, author: str) -> list:
+        """
+        Get the published files by a given author, in collection order
+        :param author: Author to search, (case-insensitive), ie: "Alice"
+        """
+        self._build_indexes()
+        return list(self._by_author.get(author.lower(), []))
+
+    def get_published(self) -> list:
+        """
+        Get the files not marked as a draft, in collection order
+        """
+        self._build_indexes()
+        return list(self._published)
+
+    def get_drafts(self) -> list:
+        """
+        Get the files marked as a draft, in collection order
+        """
+        self._build_indexes()
+        return list(self._drafts)
+
+    @staticmethod
+    def sort_newest(files: list, limit: Union[int, None] = None, offset: int = 0) -> list:
+        """
+        Sort files newest first, files with the same date keep their original order
+
+        When a limit is given only the top offset + limit files are selected, rather than sorting everything.
+
+        :param files: Files to sort, ie: the results of by_tag
+        :param limit: Maximum number of files to return, or None for all of them
+        :param offset: Number of files to skip
+        """
+        def key(file: MarkdownLoader) -> str:
+            return str(file.get_meta(['date'], ''))
+
+        if limit is None:
+            return sorted(files, key=key, reverse=True)[offset:]
+        return heapq.nlargest(offset + limit, files, key=key)[offset:]
+
+    def published_sorted(self, limit: Union[int, None] = None, offset: int = 0) -> list:
+        """
+        Get the published files, newest first
+        :param limit: Maximum number of files to return, or None for all of them
+        :param offset: Number of files to skip
+        """
+        if self._sorted is None:
+            self._build_indexes()
+            return self.sort_newest(self._published, limit, offset)
+        return self._sorted[offset:None if limit is None else offset + limit]
+
+    def by_date(self, start: Union[str, None] = None, end: Union[str, None] = None) -> list:
+        """
+        Get the published files dated within a range, (inclusive), newest first
+
+        Dates are compared as ISO strings, so partial dates work as expected,
+        ie: by_date('2023-03', '2023-04') returns everything from March and April 2023.
+
+        :param start: Earliest date, ie: "2023-03-01", or None for no lower limit
+        :param end: Latest date, ie: "2023-03-31", or None for no upper limit
+        """
+        if self._sorted is None:
+            self._build_indexes()
+            self._sorted = self.sort_newest(self._published)
+            # Oldest first, for searching date ranges
+            self._dates = [str(file.get_meta(['date'], '')) for file in reversed(self._sorted)]
+
+        lo = 0 if start is None else bisect_left(self._dates, start)
+        # Anything which starts with the end date is still within the range, ie: "2023-03-31T12:00:00"
+        hi = len(self._dates) if end is None else bisect_right(self._dates, end + '\uffff')
+        count = len(self._dates)
+        return self._sorted[count - hi:count - lo]
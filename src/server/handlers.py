@@ -0,0 +1,618 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import os
+import re
+from datetime import date
+from html import escape as html_escape
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Union
+from urllib.parse import parse_qsl, urlencode
+
+from filecollection import FileCollection
+from markdownloader import MarkdownLoader, get_html_path
+from metaindex import get_index
+from simplesite import Request, Response, SimpleSite
+from siteconfig import SiteConfig
+from templater import Templater
+
+# Maximum number of URLs within a single sitemap, (per the sitemap protocol)
+SITEMAP_LIMIT = 50000
+
+# Dates which can be used as-is for sitemap lastmod, ie: "2023-04-10" or "2023-04-10T12:00:00+00:00"
+_W3C_DATE = re.compile(r'^[0-9]{4}-[0-9]{2}-[0-9]{2}(T[0-9]{2}:[0-9]{2}(:[0-9]{2}(\.[0-9]+)?)?(Z|[+-][0-9]{2}:[0-9]{2}))?$')
+
+
+def _get_source(filename: str) -> tuple:
+    """
+    Get the (path, mtime_ns, size) of a single source file for use with SimpleSite.get_validators
+    :param filename: Fully resolved path
+    """
+    stat = os.stat(filename)
+    return filename, stat.st_mtime_ns, stat.st_size
+
+
+def _get_collection_sources(col_types: list, scans: Union[dict, None] = None) -> list:
+    """
+    Get the sources of every file within the given collections, (and the configuration itself)
+    :param col_types: List of collection types, ie: ["posts", "pages"]
+    :param scans: Dictionary to store the files scanned for each type, to pass on to FileCollection
+    """
+    sources = [_get_source(SiteConfig.get_path_config())]
+    for col_type in col_types:
+        try:
+            sources += FileCollection.get_sources(col_type, scans)
+        except FileNotFoundError:
+            sources.append((col_type, 0, 0))
+    return sources
+
+
+def _admitted(render: Callable[[], Response]) -> Response:
+    """
+    Render a page once one of the limited render slots is free, or turn the request away if the server is too busy
+    :param render: Function to render the page, (no arguments)
+    """
+    # Imported here as only rendering pages needs it, (not the meta, sitemap or search entry points)
+    from admission import get_admission
+    admission = get_admission()
+    if admission is None:
+        return render()
+
+    slot = admission.acquire()
+    if slot is None:
+        return SimpleSite.error(
+            'Server is busy, please try again shortly',
+            503,
+            headers={'Retry-After': str(SiteConfig.get_admission_retry_after())}
+        )
+
+    try:
+        return render()
+    finally:
+        admission.release(slot)
+
+
+def crawler(request: Request) -> Response:
+    """
+    Render a crawler-friendly HTML version of the requested page, listing, or original HTML file
+    :param request: Request with the "page" parameter, ie: "/posts/my_post.html"
+    """
+    pages = request.get_all('page')
+    page = pages[0] if pages else None
+    if page is None:
+        # No page requested, detect the default page and redirect there.
+        return SimpleSite.redirect(SiteConfig.get_home_url())
+
+    # Listings can be filtered, ie: "/posts.html?tag=Configuration"
+    page_args = dict(parse_qsl(page.partition('?')[2]))
+    tag = request.get('tag', page_args.get('tag'))
+    author = request.get('author', page_args.get('author'))
+    # Listing page number, (the rewrite rules pass the original "?page=2" on after the requested page)
+    number = pages[1] if len(pages) > 1 else page_args.get('page', '1')
+
+    # Perform some basic sanitization on the page input
+    page = page.replace('../', '')
+    # Trim page arguments, we don't need them.
+    page = re.sub(r'\?.*$', '', page)
+    # Trim .html, we'll look up the source markdown files instead.
+    page = page.replace('.html', '')
+    # Trim starting '/' if present
+    if page.startswith('/'):
+        page = page[1:]
+
+    # Check if the page is present
+    md_doc = os.path.join(SiteConfig.get_path_root(), page + '.md')
+    orig_doc = os.path.join(SiteConfig.get_path_root(), page + '.html')
+
+    template_file = os.path.join(SiteConfig.get_path_root(), 'index.html')
+
+    if os.path.exists(orig_doc) and os.path.isfile(orig_doc):
+        # Original page requested exists, just return that original page
+        validators = SimpleSite.get_validators([_get_source(orig_doc)])
+        not_modified = SimpleSite.not_modified(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        with open(orig_doc, 'r') as file:
+            lines = file.readlines()
+        return SimpleSite.render(lines, headers=validators)
+    elif os.path.exists(md_doc) and os.path.isfile(md_doc):
+        # Check if the client already has this version before doing any of the expensive work
+        validators = SimpleSite.get_validators([
+            _get_source(md_doc), _get_source(template_file), _get_source(SiteConfig.get_path_config())
+        ])
+        not_modified = SimpleSite.not_modified(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        # A copy rendered from these same sources skips parsing and rendering entirely
+        from pagecache import get_page_cache
+        cache = get_page_cache()
+        if cache is not None:
+            body = cache.get(page, validators['ETag'])
+            if body is not None:
+                return SimpleSite.render(body, headers=validators)
+
+        # Only the expensive rendering is limited, cached copies and 304s are always served right away
+        response = _admitted(lambda: _render_page(md_doc, page, template_file, validators))
+        if cache is not None and response.code == 200:
+            cache.set(page, validators['ETag'], response.get_body())
+        return response
+
+    # Try a listing page instead, (ie: "posts" or "posts/page/2")
+    match = re.match(r'^(.+)/page/([0-9]+)$', page)
+    if match is not None and match.group(1) in SiteConfig.get_types():
+        page, number = match.groups()
+    doc = os.path.join(SiteConfig.get_path_root(), page)
+    if os.path.exists(doc) and page in SiteConfig.get_types():
+        number = int(number) if number.isdigit() else 0
+        if number < 1:
+            return SimpleSite.error('Requested page not found', 404)
+
+        # The files scanned for the validators are reused when the listing has to be rendered
+        scans = {}
+        sources = _get_collection_sources([page], scans)
+        sources += [_get_source(template_file), (repr((tag, author, number)), 0, 0)]
+        validators = SimpleSite.get_validators(sources)
+        not_modified = SimpleSite.not_modified(request, validators)
+        if not_modified is not None:
+            return not_modified
+
+        from pagecache import get_page_cache
+        cache = get_page_cache()
+        key = page + '?' + urlencode({'tag': tag or '', 'author': author or '', 'page': number})
+        if cache is not None:
+            body = cache.get(key, validators['ETag'])
+            if body is not None:
+                return SimpleSite.render(body, headers=validators)
+
+        response = _admitted(
+            lambda: _render_listing(page, template_file, tag, author, number, validators, scans.get(page))
+        )
+        if cache is not None and response.code == 200:
+            cache.set(key, validators['ETag'], response.get_body())
+        return response
+
+    return SimpleSite.error('Requested page not found', 404)
+
+
+def _render_page(md_doc: str, page: str, template_file: str, validators: dict) -> Response:
+    """
+    Render a single Markdown file into the site template
+    :param md_doc: Fully resolved path of the Markdown file
+    :param page: Normalized page, ie: "posts/my_post", (used as the title if the file has none)
+    :param template_file: Filename of the template to render into
+    :param validators: Headers as returned by get_validators
+    """
+    loader = MarkdownLoader(md_doc)
+
+    # Pull in the meta fields useful for spiders
+    seotitle = loader.get_meta(['seotitle', 'title'], page)
+    title = loader.get_meta(['title'], page)
+    description = loader.get_meta(['description', 'excerpt'], '')
+    image = loader.get_meta(['image'], '')
+
+    template = Templater(template_file)
+    template.set_canonical(loader.url)
+    template.set_title(seotitle)
+    if description != '':
+        template.set_description(description)
+
+    if image != '' and 'src' in image:
+        template.set_meta_content('og:image', image['src'])
+
+    template.set_body('<h1>' + title + '</h1>' + str(loader))
+    return SimpleSite.render(str(template), headers=validators)
+
+
+def _render_listing(
+        col_type: str,
+        template_file: str,
+        tag: Union[str, None],
+        author: Union[str, None],
+        number: int,
+        validators: dict,
+        scanned: Union[list, None] = None
+) -> Response:
+    """
+    Render a single page of a listing, newest first, with links to the previous and next pages
+    :param col_type: Collection type to list, ie: "posts"
+    :param template_file: Filename of the template to render into
+    :param tag: Only list files with this tag, (or None)
+    :param author: Only list files by this author, (or None)
+    :param number: Page number, starting from 1
+    :param validators: Headers as returned by get_validators
+    :param scanned: Files of the type already scanned for the validators, (or None to scan them)
+    """
+    collection = FileCollection(col_type, scanned)
+    args = {}
+    title = 'Listing of ' + col_type
+    if tag:
+        files = collection.by_tag(tag)
+        title += ' tagged ' + tag
+        args['tag'] = tag
+    elif author:
+        files = collection.by_author(author)
+        title += ' by ' + author
+        args['author'] = author
+    else:
+        files = collection.get_published()
+
+    size = SiteConfig.get_listing_page_size()
+    pages = max(1, -(-len(files) // size)) if size > 0 else 1
+    if number > pages:
+        return SimpleSite.error('Requested page not found', 404)
+
+    def get_url(n: int) -> str:
+        query = urlencode(dict(args, page=n) if n > 1 else args)
+        return collection.url + ('?' + query if query else '')
+
+    # Only the files on this page are sorted into place and rendered
+    files = FileCollection.sort_newest(files, size if size > 0 else None, (number - 1) * size)
+    html = ['<h1>' + html_escape(title) + '</h1>']
+    html += [file.get_listing() for file in files]
+
+    template = Templater(template_file)
+    template.set_canonical(get_url(number))
+    if number > 1:
+        title += ' - Page ' + str(number)
+        template.set_link('prev', get_url(number - 1))
+        html.append('<a href="' + html_escape(get_url(number - 1)) + '" rel="prev">Previous Page</a>')
+    if number < pages:
+        template.set_link('next', get_url(number + 1))
+        html.append('<a href="' + html_escape(get_url(number + 1)) + '" rel="next">Next Page</a>')
+    template.set_title(title)
+    template.set_body(''.join(html))
+    return SimpleSite.render(str(template), headers=validators)
+
+
+def _split_param(value: Union[str, None]) -> list:
+    """
+    Split a comma-separated request parameter into its unique, non-empty values
+    :param value: Raw parameter, ie: "title,date,tags"
+    """
+    values = []
+    for item in (value or '').split(','):
+        item = item.strip()
+        if item and item not in values:
+            values.append(item)
+    return values
+
+
+def _render_meta(collections: dict, fields: list, drafts: bool) -> Iterator[str]:
+    """
+    Generate the metadata JSON document chunk by chunk, one file at a time
+    :param collections: Dictionary of type => FileCollection, (or None if the directory does not exist)
+    :param fields: Meta fields to include for each file, or an empty list for all of them
+    :param drafts: Set to False to leave out any file marked as a draft
+    """
+    yield '{'
+    first_type = True
+    for collection_type, collection in collections.items():
+        if collection is None:
+            continue
+
+        yield ('' if first_type else ', ') + json.dumps(collection_type) + ': ['
+        first_type = False
+        first_file = True
+        for file in collection.files:
+            metas = file.get_metas()
+            if not drafts and metas.get('draft', False):
+                continue
+            if fields:
+                metas = {key: metas[key] for key in fields if key in metas}
+
+            yield ('' if first_file else ', ') + json.dumps({'url': file.url, 'path': file.path, 'meta': metas})
+            first_file = False
+        yield ']'
+    yield '}'
+
+
+def meta(request: Request) -> Response:
+    """
+    Render the metadata of every file within the requested collection types as JSON
+
+    The document is streamed one file at a time rather than built up in memory.
+    With the metadata index enabled its version is sent in the X-Meta-Version header,
+    pass that back as "since" to only get the files changed after it.
+
+    :param request: Request with the optional parameters
+        "type", (comma-separated list of collection types, ie: "posts,pages"),
+        "fields", (comma-separated list of meta fields to include, ie: "title,date,tags"),
+        "drafts", (set to "0" to leave out drafts), and "since", (version from an earlier response)
+    """
+    col_types = _split_param(request.get('type')) or SiteConfig.get_types()
+    for col_type in col_types:
+        if col_type not in SiteConfig.get_types():
+            return SimpleSite.error('Collection type not found', 404)
+    fields = _split_param(request.get('fields'))
+    drafts = request.get('drafts', '1') not in ('0', 'false', 'no')
+    since = request.get('since')
+    if since is not None:
+        return _meta_changes(col_types, fields, drafts, since)
+
+    # Different filters produce different documents from the same files, so they are part of the validator too
+    scans = {}
+    validators = SimpleSite.get_validators(
+        _get_collection_sources(col_types, scans) + [(','.join(fields), 0, 0), (str(drafts), 0, 0)]
+    )
+    not_modified = SimpleSite.not_modified(request, validators, SimpleSite.TYPE_JSON)
+    if not_modified is not None:
+        return not_modified
+
+    headers = dict(validators)
+    index = get_index()
+    if index is not None:
+        # Taken before loading, so any change made while loading is sent again rather than missed
+        headers['X-Meta-Version'] = index.get_version()
+
+    return SimpleSite.render(
+        _render_meta(FileCollection.load_all(col_types, scans), fields, drafts),
+        SimpleSite.TYPE_JSON,
+        headers
+    )
+
+
+def _meta_changes(col_types: list, fields: list, drafts: bool, since: str) -> Response:
+    """
+    Render the files added, modified and deleted since an earlier version of the metadata as JSON
+
+    Deleted files, (and files which became drafts when they are left out), are listed by their path.
+    If the version is too old or unknown every file is listed as changed and "full" is set,
+    the client should then replace everything it has rather than apply the changes.
+
+    :param col_types: List of collection types, ie: ["posts", "pages"]
+    :param fields: Meta fields to include for each file, or an empty list for all of them
+    :param drafts: Set to False to leave out any file marked as a draft
+    :param since: Version as sent in the X-Meta-Version header of an earlier response
+    """
+    index = get_index()
+    if index is None:
+        return SimpleSite.error('Changes are only available with the metadata index enabled', 404)
+
+    # Bring the index up to date with the filesystem, (only new and modified files are parsed)
+    FileCollection.load_all(col_types)
+    version, full, changed, deleted = index.get_changes(since, col_types)
+
+    document = {
+        'version': version,
+        'full': full,
+        'changed': {col_type: [] for col_type in col_types},
+        'deleted': {col_type: [] for col_type in col_types},
+    }
+    root = SiteConfig.get_path_root()
+    for col_type, path, metas in changed:
+        metas = json.loads(metas)
+        if not drafts and metas.get('draft', False):
+            if not full:
+                document['deleted'][col_type].append(path)
+            continue
+        url = MarkdownLoader.from_metas(root + path, metas).url
+        if fields:
+            metas = {key: metas[key] for key in fields if key in metas}
+        document['changed'][col_type].append({'url': url, 'path': path, 'meta': metas})
+    for col_type, path in deleted:
+        document['deleted'][col_type].append(path)
+
+    return SimpleSite.render(document, SimpleSite.TYPE_JSON, {'X-Meta-Version': version})
+
+
+def search(request: Request) -> Response:
+    """
+    Search the title, metas and body of every file within the requested collection types
+
+    The search index is brought up to date with any changed files before each query.
+
+    :param request: Request with the parameter "q", (search text),
+        and the optional parameters "type", (comma-separated list of collection types, ie: "posts,pages"),
+        "fields", (comma-separated list of meta fields to include, ie: "title,date,tags"),
+        "drafts", (set to "0" to leave out drafts), "page" and "limit", (results per page, up to 100)
+    """
+    # Imported here as only search needs it, (along with sqlite3 when the metadata index is off)
+    from searchindex import get_search_index
+    index = get_search_index()
+    if index is None:
+        return SimpleSite.error('Search is not enabled', 404)
+
+    col_types = _split_param(request.get('type')) or SiteConfig.get_types()
+    for col_type in col_types:
+        if col_type not in SiteConfig.get_types():
+            return SimpleSite.error('Collection type not found', 404)
+    query = request.get('q', '').strip()
+    fields = _split_param(request.get('fields'))
+    drafts = request.get('drafts', '1') not in ('0', 'false', 'no')
+    try:
+        page = max(1, int(request.get('page', '1')))
+        limit = min(100, max(1, int(request.get('limit', str(SiteConfig.get_search_page_size())))))
+    except ValueError:
+        return SimpleSite.error('Invalid page or limit', 400)
+
+    sources = {}
+    for col_type in col_types:
+        try:
+            sources[col_type] = FileCollection.get_sources(col_type)
+        except FileNotFoundError:
+            sources[col_type] = []
+
+    validators = SimpleSite.get_validators(
+        [_get_source(SiteConfig.get_path_config())]
+        + [source for col_sources in sources.values() for source in col_sources]
+        + [(repr((query, fields, drafts, page, limit)), 0, 0)]
+    )
+    not_modified = SimpleSite.not_modified(request, validators, SimpleSite.TYPE_JSON)
+    if not_modified is not None:
+        return not_modified
+
+    for col_type, col_sources in sources.items():
+        index.refresh(col_type, col_sources)
+
+    total, matches = index.search(query, col_types, drafts, limit, (page - 1) * limit)
+    results = []
+    for score, path, col_type, metas in matches:
+        if fields:
+            metas = {key: metas[key] for key in fields if key in metas}
+        results.append({
+            'url': SiteConfig.get_host() + get_html_path(path),
+            'path': path,
+            'type': col_type,
+            'score': round(score, 4),
+            'meta': metas,
+        })
+
+    return SimpleSite.render(
+        {
+            'query': query,
+            'total': total,
+            'page': page,
+            'pages': (total + limit - 1) // limit,
+            'results': results,
+        },
+        SimpleSite.TYPE_JSON,
+        validators
+    )
+
+
+def _get_lastmod(file: MarkdownLoader) -> str:
+    """
+    Get the W3C datetime a file was last modified, from its date meta or else the file itself
+    :param file: File to check
+    """
+    value = str(file.get_meta(['date'], ''))
+    if _W3C_DATE.match(value):
+        return value
+    return date.fromtimestamp(os.path.getmtime(file.filename)).isoformat()
+
+
+def _get_sitemap_entries(collection: FileCollection) -> Iterator[tuple]:
+    """
+    Get the (url, lastmod) of each of a collection's published files followed by its listing page
+
+    Entries are generated one at a time, the listing page comes last as it changes whenever any of its files do.
+
+    :param collection: Collection to list
+    """
+    latest = None
+    for file in collection.files:
+        if not file.get_meta(['draft'], False):
+            lastmod = _get_lastmod(file)
+            if latest is None or lastmod > latest:
+                latest = lastmod
+            yield file.url, lastmod
+    yield collection.url, latest
+
+
+def _render_sitemap(entries: Iterable[tuple], comments: list, tag: str = 'url') -> Iterator[str]:
+    """
+    Generate a urlset, (or sitemapindex when tag is "sitemap"), chunk by chunk
+    :param entries: Iterable of (url, lastmod)
+    :param comments: Any comments to include at the top of the document
+    :param tag: Tag for each entry, "url" or "sitemap"
+    """
+    root = 'urlset' if tag == 'url' else 'sitemapindex'
+    yield '''<?xml version="1.0" encoding="UTF-8"?>
+<%s 
+    xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" 
+    xmlns:xhtml="http://www.w3.org/1999/xhtml" 
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" 
+    xsi:schemaLocation="http://www.sitemaps.org/schemas/sitemap/0.9/sitemap.xsd">
+''' % root
+
+    for c in comments:
+        yield '\t<!-- ' + c + '-->\n'
+
+    for url, lastmod in entries:
+        entry = '\t<' + tag + '>\n\t\t<loc>' + html_escape(url, quote=False) + '</loc>\n'
+        if lastmod is not None:
+            entry += '\t\t<lastmod>' + lastmod + '</lastmod>\n'
+        yield entry + '\t</' + tag + '>\n'
+
+    yield '</' + root + '>'
+
+
+def sitemap(request: Request) -> Response:
+    """
+    Render the sitemap of every published file within every collection type
+
+    Sites with more than SITEMAP_LIMIT URLs get a sitemap index instead,
+    linking to numbered child sitemaps for each type, ie: "sitemap-posts-1.xml".
+
+    :param request: Request, optionally with "type" and "page" parameters to render a single child sitemap
+    """
+    col_type = request.get('type')
+    col_types = SiteConfig.get_types() if col_type is None else [col_type]
+    if col_type is not None and col_type not in SiteConfig.get_types():
+        return SimpleSite.error('Requested sitemap not found', 404, SimpleSite.TYPE_XML)
+
+    scans = {}
+    validators = SimpleSite.get_validators(_get_collection_sources(col_types, scans))
+    not_modified = SimpleSite.not_modified(request, validators, SimpleSite.TYPE_XML)
+    if not_modified is not None:
+        return not_modified
+
+    collections = FileCollection.load_all(col_types, scans)
+
+    if col_type is not None:
+        # Single page of a single type, as linked from the sitemap index
+        try:
+            page = int(request.get('page', '1'))
+        except ValueError:
+            page = 0
+        entries = list(islice(
+            _get_sitemap_entries(collections[col_type]) if collections[col_type] is not None else [],
+            (page - 1) * SITEMAP_LIMIT if page > 0 else 0,
+            page * SITEMAP_LIMIT
+        ))
+        if page < 1 or not entries:
+            return SimpleSite.error('Requested sitemap not found', 404, SimpleSite.TYPE_XML)
+
+        return SimpleSite.render(_render_sitemap(entries, []), SimpleSite.TYPE_XML, validators)
+
+    comments = []
+    counts = {}
+    for collection_type, collection in collections.items():
+        if collection is None:
+            comments.append('Unable to read directory ' + collection_type)
+        else:
+            # Listing page plus every published file
+            counts[collection_type] = 1 + sum(1 for f in collection.files if not f.get_meta(['draft'], False))
+
+    if sum(counts.values()) <= SITEMAP_LIMIT:
+        entries = chain.from_iterable(_get_sitemap_entries(collections[t]) for t in counts)
+        return SimpleSite.render(_render_sitemap(entries, comments), SimpleSite.TYPE_XML, validators)
+
+    # Too many URLs for a single sitemap, link to a child sitemap for each page of each type instead
+    def index_entries():
+        for collection_type, count in counts.items():
+            entries = _get_sitemap_entries(collections[collection_type])
+            for page in range(1, (count - 1) // SITEMAP_LIMIT + 2):
+                latest = None
+                for url, lastmod in islice(entries, SITEMAP_LIMIT):
+                    if lastmod is not None and (latest is None or lastmod > latest):
+                        latest = lastmod
+                url = SiteConfig.get_host() + os.path.join(
+                    SiteConfig.get_path_web(), 'sitemap-' + collection_type + '-' + str(page) + '.xml'
+                )
+                yield url, latest
+
+    return SimpleSite.render(_render_sitemap(index_entries(), comments, 'sitemap'), SimpleSite.TYPE_XML, validators)
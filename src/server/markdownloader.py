@@ -23,55 +23,243 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SO
 
 import os
 import re
+from typing import Iterable, Iterator, Union
 
-import markdown
-import frontmatter
 from datetime import date
+from rendercache import get_render_cache
 from siteconfig import SiteConfig
+import timing
 
+# Same boundary as used by python-frontmatter for YAML headers
+_FM_BOUNDARY = re.compile(r'^-{3,}\s*$')
+_FM_SPLIT = re.compile(r'^-{3,}\s*$', re.MULTILINE)
+# Used for automatic excerpts
+_EXCERPT_START = re.compile(r'[a-zA-Z]')
+_EXCERPT_DROP = re.compile(r'\{.*?}|!\[.*?]\(.*?\)')
+_EXCERPT_LINK = re.compile(r'\[(.*?)]\(.*?\)')
+_EXCERPT_EMPHASIS = str.maketrans('', '', '*_')
+_UPPERCASE = re.compile(r'[A-Z]')
+_URL_DATE = re.compile(r'.+([0-9]{4})[-/]([0-9]{2})[-/]([0-9]{2}).+')
 
-def _get_excerpt(content: str) -> str:
-    text = ''
-    for line in content.split('\n'):
-        if line.strip() == '' and text != '':
-            # Stop after the first paragraph
+
+class _Post:
+    """
+    Minimal stand-in for frontmatter.Post, holding the body and metadata of a file
+    """
+    def __init__(self, content: str, metadata: dict):
+        self.content = content
+        self.metadata = metadata
+
+    def __getitem__(self, key):
+        return self.metadata[key]
+
+    def __setitem__(self, key, value):
+        self.metadata[key] = value
+
+    def __delitem__(self, key):
+        del self.metadata[key]
+
+    def __contains__(self, key):
+        return key in self.metadata
+
+    def get(self, key, default=None):
+        return self.metadata.get(key, default)
+
+    def keys(self):
+        return self.metadata.keys()
+
+
+def _load_yaml(text: str):
+    """
+    Parse a YAML front matter header, using the much faster LibYAML loader when enabled and available
+    """
+    import yaml
+
+    loader = yaml.SafeLoader
+    if SiteConfig.get_libyaml():
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return yaml.load(text, Loader=loader)
+
+
+def _parse(text: str) -> tuple:
+    """
+    Split a file into its front matter and body, the same as frontmatter.parse
+
+    :return: Tuple of the metadata dictionary and the body
+    """
+    text = text.strip()
+    if not _FM_SPLIT.match(text):
+        # JSON or TOML headers, (or none at all), are left to python-frontmatter
+        import frontmatter
+        post = frontmatter.loads(text)
+        return post.metadata, post.content
+
+    try:
+        _, header, content = _FM_SPLIT.split(text, 2)
+    except ValueError:
+        # Header was never closed
+        return {}, text
+
+    metadata = _load_yaml(header)
+    return metadata if isinstance(metadata, dict) else {}, content.strip()
+
+
+def _load_post(filename: str) -> _Post:
+    """
+    Load and parse a full file
+    """
+    # Newlines are left as-is, the same as python-frontmatter
+    with open(filename, 'r', encoding='utf-8', newline='') as fp:
+        metadata, content = _parse(fp.read())
+    return _Post(content, metadata)
+
+
+def _read_front_matter(filename: str) -> Union[dict, None]:
+    """
+    Read and parse only the YAML front matter of a file, stopping at the closing '---'
+
+    Returns None if the file does not start with a YAML header it can read this way,
+    in which case the caller should fall back to loading the full file.
+    """
+    lines = []
+    with open(filename, 'r', encoding='utf-8') as fp:
+        started = False
+        for line in fp:
+            if not started:
+                if line.strip() == '':
+                    continue
+                if not _FM_BOUNDARY.match(line):
+                    return None
+                started = True
+            elif _FM_BOUNDARY.match(line):
+                metadata = _load_yaml(''.join(lines))
+                return metadata if isinstance(metadata, dict) else {}
+            else:
+                lines.append(line)
+
+    # Header was never closed
+    return None
+
+
+def _read_body_lines(filename: str) -> Iterator[str]:
+    """
+    Iterate over the lines of the body of a file, (after the YAML front matter), reading only as far as requested
+    """
+    with open(filename, 'r', encoding='utf-8') as fp:
+        boundaries = 0
+        for line in fp:
+            if boundaries < 2:
+                if _FM_BOUNDARY.match(line):
+                    boundaries += 1
+                continue
+
+            if line.strip() == '':
+                continue
+
+            # Leading whitespace of the body is trimmed, the same as a full load
+            yield line.lstrip()
             break
 
-        if line.strip() == '':
+        yield from fp
+
+
+def _iter_lines(text: str) -> Iterator[str]:
+    """
+    Iterate over the lines of a string without splitting all of it up front
+    """
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def get_html_path(path: str) -> str:
+    """
+    Get the path of the page rendered from a Markdown file, ie: "/posts/my_post.md" => "/posts/my_post.html"
+
+    Only the extension is swapped, a ".md" anywhere else in the name is left as-is.
+    """
+    return path[:-3] + '.html' if path.endswith('.md') else path
+
+
+def _get_excerpt(content: Union[str, Iterable[str]], max_length: int = 0) -> str:
+    """
+    Generate a plain text excerpt from the first paragraph of a Markdown body
+
+    :param content: Markdown body, or an iterable of its lines
+    :param max_length: Maximum number of characters, (including the "…" added when truncated on a word boundary),
+        or 0 for the full paragraph
+    """
+    lines = []
+    if isinstance(content, str):
+        content = _iter_lines(content)
+
+    for line in content:
+        stripped = line.strip()
+        if stripped == '':
+            if lines:
+                # Stop after the first paragraph
+                break
             continue
 
-        if re.match(r'^[a-zA-Z].*', line) and text == '':
-            # Line starts with a word and text is empty; trigger this to start the paragraph
-            text += line.strip() + ' '
-        elif text != '':
-            # If the text has been started, then just add whatever text to the detected string
-            # This provides for an easy chance to skip any H# tags, images, and other tags
+        if lines or _EXCERPT_START.match(line):
+            # The paragraph is started by a line starting with a word,
+            # this provides for an easy chance to skip any H# tags, images, and other tags
             # which are commonly at the top of pages, while still allowing some inside the paragraph
-            text += line.strip() + ' '
+            lines.append(stripped)
 
-    # Strip any tags inside the loaded text, this will just be a plain text excerpt.
-    # Strip {...} HTML attribute tags from the text
-    text = re.sub(r'\{.*?}', '', text)
-    # Strip images from the text
-    text = re.sub(r'!\[.*?]\(.*?\)', '', text)
-    # Drop the link from links
-    text = re.sub(r'\[(.*?)]\(.*?\)', '\\1', text)
-    # Drop italic and bold
-    text = re.sub(r'[*_]', '', text)
+    # Strip any tags inside the loaded text, this will just be a plain text excerpt:
+    # {...} HTML attribute tags and images are dropped, links are replaced with their text,
+    # and italic and bold markers are removed.
+    text = _EXCERPT_DROP.sub('', ' '.join(lines))
+    text = _EXCERPT_LINK.sub('\\1', text).translate(_EXCERPT_EMPHASIS).strip()
 
-    return text.strip()
+    if 0 < max_length < len(text):
+        # One character is left for the ellipsis, the next one shows if the last word is complete
+        text = text[:max_length]
+        # Cut at the last full word, unless the first word alone is over the limit
+        cut = text.rfind(' ')
+        text = (text[:cut] if cut > 0 else text[:max_length - 1]).rstrip() + '…'
+
+    return text
 
 
 class MarkdownLoader:
-    def __init__(self, filename: str):
+    # Set to False by unload_content so the body is not kept after it is read
+    keep_content = True
+
+    def __init__(self, filename: str, lazy: bool = False, stat: Union[os.stat_result, None] = None):
         """
         Initialize and load a Markdown file from the filesystem
+
+        In lazy mode only the front matter is read;
+        the body is read only when it is rendered or an automatic excerpt is requested.
+
         :param filename: Fully resolved path, ie: "/var/www/posts/my_post.md"
+        :param lazy: Set to True to defer reading the body of the file until it is needed
+        :param stat: Result of os.stat for this file if already known, saves statting it again
         """
+        self.filename = filename
         self.path = filename[len(SiteConfig.get_path_root()):]
-        self.url = SiteConfig.get_host() + self.path.replace('.md', '.html')
+        self.url = SiteConfig.get_host() + get_html_path(self.path)
         self.dir = os.path.dirname(self.path)
-        self.post = frontmatter.load(filename)
+        self.post = None
+        self._excerpt_pending = False
+
+        with timing.span('frontmatter'):
+            if lazy:
+                metadata = _read_front_matter(filename)
+                if metadata is not None:
+                    self.post = _Post('', metadata)
+                    self._content_loaded = False
+
+            if self.post is None:
+                self.post = _load_post(filename)
+                self._content_loaded = True
 
         # Parse attributes for src and href tags,
         # these allow for relative attributes, but should be resolved
@@ -79,7 +267,7 @@ class MarkdownLoader:
         # ie: listing pages
         # While we're in this loop, let's ensure all keys are lowercase.
         for key in sorted(self.post.keys()):
-            if re.match('.*[A-Z].*', key) is not None:
+            if _UPPERCASE.search(key) is not None:
                 l_key = key.lower()
                 self.post[l_key] = self.post[key]
                 del(self.post[key])
@@ -105,19 +293,82 @@ class MarkdownLoader:
 
         # Expected values
         if 'date' not in self.post:
-            if re.match('.+([0-9]{4})[-/]([0-9]{2})[-/]([0-9]{2}).+', self.path):
+            m = _URL_DATE.match(self.path)
+            if m is not None:
                 # Load the date from the URL
-                m = re.match('.+([0-9]{4})[-/]([0-9]{2})[-/]([0-9]{2}).+', self.path)
                 self.post['date'] = '-'.join([m.group(1), m.group(2), m.group(3)])
             else:
                 # Load the date from the last-modified flag
-                self.post['date'] = date.fromtimestamp(os.path.getmtime(filename)).isoformat()
+                mtime = stat.st_mtime if stat is not None else os.path.getmtime(filename)
+                self.post['date'] = date.fromtimestamp(mtime).isoformat()
 
         if 'draft' not in self.post:
             self.post['draft'] = False
 
         if 'excerpt' not in self.post:
-            self.post['excerpt'] = _get_excerpt(self.post.content)
+            if self._content_loaded:
+                self.post['excerpt'] = _get_excerpt(self.post.content, SiteConfig.get_excerpt_length())
+            else:
+                # Generated on first use, reading only as far as the first paragraph
+                self._excerpt_pending = True
+
+    @classmethod
+    def from_metas(cls, filename: str, metas: dict) -> 'MarkdownLoader':
+        """
+        Create a loader from previously parsed metas (ie: from the metadata index) without reading the file
+
+        The body content is only read from the filesystem if it is actually requested.
+
+        :param filename: Fully resolved path, ie: "/var/www/posts/my_post.md"
+        :param metas: Normalized metas as returned by get_metas
+        """
+        loader = cls.__new__(cls)
+        loader.filename = filename
+        loader.path = filename[len(SiteConfig.get_path_root()):]
+        loader.url = SiteConfig.get_host() + get_html_path(loader.path)
+        loader.dir = os.path.dirname(loader.path)
+        loader.post = _Post('', metas)
+        loader._content_loaded = False
+        loader._excerpt_pending = False
+        return loader
+
+    def get_content(self) -> str:
+        """
+        Get the raw Markdown body of this file, (without the front matter)
+        """
+        if not self._content_loaded:
+            with timing.span('read'):
+                content = _load_post(self.filename).content
+            if not self.keep_content:
+                return content
+            self.post.content = content
+            self._content_loaded = True
+
+        return self.post.content
+
+    def unload_content(self) -> None:
+        """
+        Drop the body of this file and read it from disk whenever it is needed from now on
+
+        Used for files kept in memory between requests, so the whole site is not held in memory.
+        """
+        self.keep_content = False
+        self.post.content = ''
+        self._content_loaded = False
+
+    def _resolve_excerpt(self) -> None:
+        """
+        Generate the automatic excerpt of a lazily loaded file
+        """
+        if self._content_loaded:
+            self.post['excerpt'] = _get_excerpt(self.post.content, SiteConfig.get_excerpt_length())
+        else:
+            lines = _read_body_lines(self.filename)
+            try:
+                self.post['excerpt'] = _get_excerpt(lines, SiteConfig.get_excerpt_length())
+            finally:
+                lines.close()
+        self._excerpt_pending = False
 
     def get_meta(self, lookup: list, default: str = ''):
         """
@@ -128,6 +379,9 @@ class MarkdownLoader:
         :param lookup: List of tags to search, ie: ["title", "seotitle"]
         :param default: Default return value if no tags were located
         """
+        if self._excerpt_pending and 'excerpt' in lookup:
+            self._resolve_excerpt()
+
         for tag in lookup:
             try:
                 return self.post[tag]
@@ -142,6 +396,9 @@ class MarkdownLoader:
         """
         Get all meta values as a simple dictionary
         """
+        if self._excerpt_pending:
+            self._resolve_excerpt()
+
         ret = {}
         for key in sorted(self.post.keys()):
             ret[key] = self.post[key]
@@ -151,8 +408,9 @@ class MarkdownLoader:
         """
         Get this file in its full HTML version
         """
-        md = markdown.Markdown()
-        return md.convert(self.post.content)
+        content = self.get_content()
+        with timing.span('markdown'):
+            return get_render_cache().render(content)
 
     def get_listing(self) -> str:
         """
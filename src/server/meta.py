@@ -25,24 +25,7 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+from handlers import meta
 from simplesite import SimpleSite
-from filecollection import FileCollection
-from siteconfig import SiteConfig
 
-SimpleSite.type = SimpleSite.TYPE_JSON
-payload = {}
-
-for collection_type in SiteConfig.get_types():
-    try:
-        collection = FileCollection(collection_type)
-        payload[collection_type] = []
-        for file in collection.files:
-            payload[collection_type].append({
-                'url': file.url,
-                'path': file.path,
-                'meta': file.get_metas()
-            })
-    except FileNotFoundError:
-        pass
-
-SimpleSite.render(payload)
+SimpleSite.cgi(meta)
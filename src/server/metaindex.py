@@ -0,0 +1,273 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Union
+
+from siteconfig import SiteConfig
+
+_index = None
+
+
+class MetaIndex:
+    # Bump this when the table layout changes, older databases will be rebuilt automatically
+    SCHEMA_VERSION = 3
+    # Seconds since the last heartbeat from watcher.py before its records are no longer trusted
+    WATCHER_TIMEOUT = 90
+    # Number of deleted files remembered in the change journal,
+    # clients with a version older than the oldest forgotten deletion need to download everything again
+    JOURNAL_TOMBSTONES = 1000
+
+    def __init__(self, path: str, settings: str = ''):
+        """
+        Open (or create) the persistent metadata index
+
+        The index is a single SQLite database in WAL mode,
+        so any number of concurrent CGI processes can read it while one of them refreshes it.
+
+        :param path: Fully resolved path of the database, ie: "/var/www/mysite/cgi-bin/.metaindex.sqlite"
+        :param settings: Summary of the settings which affect parsed metas, all records are dropped when it changes
+        :throws sqlite3.Error:
+        """
+        self.path = path
+        # Connections are shared between threads, (ie: the threaded WSGI server), so serialize access
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+            with self.conn:
+                self.conn.execute('DROP TABLE IF EXISTS files')
+                self.conn.execute('DROP TABLE IF EXISTS state')
+                self.conn.execute('DROP TABLE IF EXISTS journal')
+                self.conn.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, '
+                'type TEXT NOT NULL, '
+                'mtime INTEGER NOT NULL, '
+                'size INTEGER NOT NULL, '
+                'metas TEXT NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS files_type ON files (type)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            # Latest change of every file, versions only ever increase, (a changed file gets a new version)
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS journal ('
+                'version INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'path TEXT NOT NULL UNIQUE, '
+                'type TEXT NOT NULL, '
+                'deleted INTEGER NOT NULL)'
+            )
+            row = self.conn.execute("SELECT value FROM state WHERE key = 'settings'").fetchone()
+            if row is None or row[0] != settings:
+                self.conn.execute('DELETE FROM files')
+                self.conn.execute('DELETE FROM journal')
+                self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('settings', ?)", (settings,))
+                # Versions handed out before now no longer mean anything
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value) VALUES ('epoch', ?)", ('%x' % time.time_ns(),)
+                )
+                self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('floor', '0')")
+
+    def get_type(self, col_type: str) -> dict:
+        """
+        Get all indexed records for a given collection type
+
+        Metas are returned still JSON-encoded so that only the files actually used need decoding.
+
+        :param col_type: Collection type, ie: "posts"
+        :return: Dictionary of path => (mtime_ns, size, metas_json)
+        """
+        with self.lock:
+            cursor = self.conn.execute('SELECT path, mtime, size, metas FROM files WHERE type = ?', (col_type,))
+            return {row[0]: (row[1], row[2], row[3]) for row in cursor}
+
+    def update(self, col_type: str, changed: list, removed: list) -> None:
+        """
+        Store new and changed records and drop records for files which no longer exist
+
+        All changes are written in a single transaction.
+        If the database is locked or read-only the update is skipped; the index is only a cache.
+
+        :param col_type: Collection type, ie: "posts"
+        :param changed: List of (path, mtime_ns, size, metas) tuples
+        :param removed: List of paths to remove from the index
+        """
+        rows = []
+        for path, mtime, size, metas in changed:
+            try:
+                rows.append((path, col_type, mtime, size, json.dumps(metas)))
+            except (TypeError, ValueError):
+                # Metadata which cannot be represented in JSON is simply not indexed,
+                # that file will get parsed from the filesystem every time.
+                pass
+
+        try:
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO files (path, type, mtime, size, metas) VALUES (?, ?, ?, ?, ?)',
+                    rows
+                )
+                self.conn.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in removed])
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO journal (path, type, deleted) VALUES (?, ?, ?)',
+                    [(row[0], col_type, 0) for row in rows] + [(p, col_type, 1) for p in removed]
+                )
+                if removed:
+                    self._trim_journal()
+        except sqlite3.OperationalError:
+            pass
+
+    def _trim_journal(self) -> None:
+        """
+        Forget the oldest deleted files once there are more than JOURNAL_TOMBSTONES of them
+        """
+        row = self.conn.execute(
+            'SELECT version FROM journal WHERE deleted = 1 ORDER BY version DESC LIMIT 1 OFFSET ?',
+            (self.JOURNAL_TOMBSTONES,)
+        ).fetchone()
+        if row is not None:
+            self.conn.execute('DELETE FROM journal WHERE deleted = 1 AND version <= ?', (row[0],))
+            self.conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('floor', ?)", (str(row[0]),))
+
+    def get_version(self) -> str:
+        """
+        Get the current version of the indexed files, to pass to get_changes later
+
+        :return: Opaque token, ie: "17d3c2f1a9b40e00.152"
+        """
+        with self.lock:
+            epoch = self.conn.execute("SELECT value FROM state WHERE key = 'epoch'").fetchone()[0]
+            version = self.conn.execute('SELECT MAX(version) FROM journal').fetchone()[0]
+        return '%s.%d' % (epoch, version or 0)
+
+    def get_changes(self, since: str, col_types: list) -> tuple:
+        """
+        Get the files added, modified and deleted since an earlier version
+
+        Everything is read from a single snapshot of the index, so the version returned always matches the records.
+        If the version is unknown, (ie: from before the index was rebuilt), or too old to still have every deletion,
+        all records are returned instead.
+
+        :param since: Version as returned by get_version, or an empty string for all records
+        :param col_types: Collection types, ie: ["posts", "pages"]
+        :return: (version, full, changed, deleted), changed is a list of (type, path, metas_json)
+            and deleted is a list of (type, path); full is True when changed holds every record
+        """
+        types = ','.join('?' * len(col_types))
+        with self.lock:
+            # Explicit transaction so nothing written by another process in between is seen half-way
+            self.conn.execute('BEGIN')
+            try:
+                state = dict(self.conn.execute("SELECT key, value FROM state WHERE key IN ('epoch', 'floor')"))
+                current = self.conn.execute('SELECT MAX(version) FROM journal').fetchone()[0] or 0
+
+                epoch, _, version = since.rpartition('.')
+                full = (
+                    epoch != state['epoch']
+                    or not version.isdigit()
+                    or int(version) < int(state['floor'])
+                    or int(version) > current
+                )
+                if full:
+                    changed = self.conn.execute(
+                        'SELECT type, path, metas FROM files WHERE type IN (%s) ORDER BY path' % types, col_types
+                    ).fetchall()
+                    deleted = []
+                else:
+                    changed = self.conn.execute(
+                        'SELECT journal.type, journal.path, files.metas FROM journal '
+                        'JOIN files ON files.path = journal.path '
+                        'WHERE journal.version > ? AND journal.deleted = 0 AND journal.type IN (%s) '
+                        'ORDER BY journal.version' % types,
+                        [int(version)] + col_types
+                    ).fetchall()
+                    deleted = self.conn.execute(
+                        'SELECT type, path FROM journal '
+                        'WHERE version > ? AND deleted = 1 AND type IN (%s) ORDER BY version' % types,
+                        [int(version)] + col_types
+                    ).fetchall()
+            finally:
+                self.conn.execute('COMMIT')
+
+        return '%s.%d' % (state['epoch'], current), full, changed, deleted
+
+    def set_watched(self, col_types: Union[list, None]) -> None:
+        """
+        Record a heartbeat from the watcher along with the collection types it is currently keeping up to date
+
+        :param col_types: Collection types being watched,
+            or None when the watcher is stopping and its records should no longer be trusted
+        """
+        try:
+            with self.lock, self.conn:
+                self.conn.execute("DELETE FROM state WHERE key = 'heartbeat' OR key LIKE 'watched:%'")
+                if col_types is None:
+                    return
+                self.conn.executemany(
+                    "INSERT INTO state (key, value) VALUES (?, '1')",
+                    [('watched:' + col_type,) for col_type in col_types]
+                )
+                self.conn.execute("INSERT INTO state (key, value) VALUES ('heartbeat', ?)", (str(time.time()),))
+        except sqlite3.OperationalError:
+            pass
+
+    def is_watched(self, col_type: str) -> bool:
+        """
+        Check if a running watcher is keeping the records of a collection type up to date
+
+        :param col_type: Collection type, ie: "posts"
+        """
+        with self.lock:
+            rows = dict(self.conn.execute(
+                "SELECT key, value FROM state WHERE key IN ('heartbeat', ?)", ('watched:' + col_type,)
+            ).fetchall())
+
+        if 'watched:' + col_type not in rows or 'heartbeat' not in rows:
+            return False
+        return time.time() - float(rows['heartbeat']) < self.WATCHER_TIMEOUT
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def get_index() -> Union[MetaIndex, None]:
+    """
+    Get the metadata index for this site, or None if it is disabled or cannot be opened
+    """
+    global _index
+    if _index is None and SiteConfig.get_index_enabled():
+        try:
+            _index = MetaIndex(SiteConfig.get_path_index(), 'excerpt_length=%d' % SiteConfig.get_excerpt_length())
+        except sqlite3.Error:
+            # Not fatal, the site will just scan the filesystem as it always has
+            _index = None
+
+    return _index
@@ -0,0 +1,146 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import hashlib
+import os
+import tempfile
+from typing import Union
+
+from siteconfig import SiteConfig
+
+_cache = None
+
+
+class PageCache:
+    def __init__(self, path: str, max_bytes: int):
+        """
+        Cache of complete rendered pages on disk, shared by every CGI process
+
+        Each page is stored once under its own key along with the ETag it was rendered for,
+        so a changed source simply replaces the old entry.
+        The least recently used entries are evicted once the total size is over the budget.
+
+        :param path: Fully resolved directory to store pages in
+        :param max_bytes: Maximum total size of all cached pages
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _get_filename(self, key: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.page')
+
+    def get(self, key: str, etag: str) -> Union[bytes, None]:
+        """
+        Get a cached page, or None if it has not been cached or was rendered from different sources
+        :param key: Normalized page, ie: "posts/my_post"
+        :param etag: ETag of the current sources, as returned by SimpleSite.get_validators
+        """
+        filename = self._get_filename(key)
+        try:
+            with open(filename, 'rb') as fp:
+                if fp.readline().rstrip(b'\n').decode('utf-8') != etag:
+                    self.misses += 1
+                    return None
+                body = fp.read()
+            # Bump the modification time so the least recently used entries are evicted first
+            os.utime(filename)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return body
+
+    def set(self, key: str, etag: str, body: bytes) -> None:
+        """
+        Store a rendered page
+        :param key: Normalized page, ie: "posts/my_post"
+        :param etag: ETag of the sources it was rendered from
+        :param body: Encoded page
+        """
+        if len(body) > self.max_bytes:
+            return
+
+        tmp = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Write to a temporary file first so concurrent readers never see a partial entry
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(etag.encode('utf-8') + b'\n')
+                fp.write(body)
+            os.replace(tmp, self._get_filename(key))
+            tmp = None
+            self._evict()
+        except OSError:
+            # Cache is best-effort, (ie: read-only directory, full disk, or an entry removed by another process)
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used pages until the total size is within the budget
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.page'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def get_stats(self) -> dict:
+        """
+        Get the hit and miss counters of this cache
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_page_cache() -> Union[PageCache, None]:
+    """
+    Get the shared page cache, or None if it is disabled
+    """
+    global _cache
+    if _cache is None and SiteConfig.get_path_page_cache() is not None:
+        _cache = PageCache(SiteConfig.get_path_page_cache(), SiteConfig.get_page_cache_bytes())
+
+    return _cache
@@ -0,0 +1,191 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import hashlib
+import importlib.util
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Union
+
+from siteconfig import SiteConfig
+
+_cache = None
+
+
+def _get_markdown_version() -> str:
+    """
+    Get a fingerprint of the installed Markdown package without importing it
+
+    Importing Markdown is only worth it when something actually has to be rendered,
+    so the version file is hashed instead; any upgrade changes it.
+    """
+    try:
+        spec = importlib.util.find_spec('markdown')
+        with open(os.path.join(os.path.dirname(spec.origin), '__meta__.py'), 'rb') as fp:
+            return hashlib.sha1(fp.read()).hexdigest()
+    except (AttributeError, TypeError, OSError):
+        import markdown
+        return markdown.__version__
+
+
+class RenderCache:
+    # Markdown extensions used to render all files, (part of the cache key)
+    EXTENSIONS = []
+
+    def __init__(self, max_entries: int = 256, path: Union[str, None] = None):
+        """
+        Cache of rendered Markdown HTML, keyed by a hash of the body and the Markdown configuration
+
+        Entries are kept in memory with LRU eviction, and optionally on disk so they survive between CGI requests.
+
+        :param max_entries: Maximum number of entries to keep, (in memory and on disk each)
+        :param path: Fully resolved directory to store rendered files in, or None to only cache in memory
+        """
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Created on the first cache miss
+        self.md = None
+        self.config_key = _get_markdown_version() + repr(self.EXTENSIONS)
+
+        if self.path is not None:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+            except OSError:
+                # Not fatal, just cache in memory
+                self.path = None
+
+    def render(self, body: str) -> str:
+        """
+        Render Markdown to HTML, using a cached copy when this exact body has been rendered before
+        :param body: Markdown source
+        """
+        key = hashlib.sha256((self.config_key + '\0' + body).encode('utf-8')).hexdigest()
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+        html = self._read(key)
+        if html is None:
+            with self.lock:
+                self.misses += 1
+                if self.md is None:
+                    import markdown
+                    self.md = markdown.Markdown(extensions=self.EXTENSIONS)
+                # Markdown instances are not thread-safe, but are much cheaper to reset than to rebuild
+                html = self.md.reset().convert(body)
+            self._write(key, html)
+        else:
+            with self.lock:
+                self.hits += 1
+
+        with self.lock:
+            self.entries[key] = html
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        return html
+
+    def get_stats(self) -> dict:
+        """
+        Get the hit and miss counters of this cache
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+    def _read(self, key: str) -> Union[str, None]:
+        if self.path is None:
+            return None
+
+        filename = os.path.join(self.path, key + '.html')
+        try:
+            with open(filename, 'r', encoding='utf-8') as fp:
+                html = fp.read()
+            # Bump the modification time so the least recently used entries are evicted first
+            os.utime(filename)
+            return html
+        except OSError:
+            return None
+
+    def _write(self, key: str, html: str) -> None:
+        if self.path is None:
+            return
+
+        tmp = None
+        try:
+            # Write to a temporary file first so concurrent readers never see a partial entry
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+                fp.write(html)
+            os.replace(tmp, os.path.join(self.path, key + '.html'))
+            tmp = None
+            self._evict()
+        except OSError:
+            # Cache is best-effort, (ie: read-only directory or full disk)
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used files on disk until there are no more than max_entries
+        """
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.html'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    # Already evicted by another process
+                    pass
+
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort()
+        for mtime, path in entries[:len(entries) - self.max_entries]:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+
+
+def get_render_cache() -> RenderCache:
+    """
+    Get the shared render cache for this process
+    """
+    global _cache
+    if _cache is None:
+        _cache = RenderCache(SiteConfig.get_render_cache_entries(), SiteConfig.get_path_render_cache())
+
+    return _cache
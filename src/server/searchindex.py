@@ -0,0 +1,334 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Union
+
+from markdownloader import MarkdownLoader
+from siteconfig import SiteConfig
+
+_index = None
+
+# Link targets, {...} attribute lists and HTML tags are markup rather than searchable text
+_MARKUP = re.compile(r'\]\([^)]*\)|\{[^}]*}|<[^>]*>')
+# Runs of letters and digits, (underscores are Markdown emphasis)
+_TOKEN = re.compile(r'[^\W_]+')
+# Metas which are not searched as text
+_SKIP_METAS = ('title', 'date', 'draft')
+
+
+def tokenize(text: str) -> list:
+    """
+    Split text into lowercase search terms, ignoring Markdown and HTML markup and single characters
+    :param text: Plain text or Markdown, ie: "Searching [the docs](/docs.html)"
+    :return: List of terms in order, ie: ["searching", "the", "docs"]
+    """
+    return [term for term in _TOKEN.findall(_MARKUP.sub(' ', text).lower()) if len(term) > 1]
+
+
+def _get_meta_text(metas: dict) -> str:
+    """
+    Get the searchable text of a file's metas, (string values and lists of strings, ie: author and tags)
+    """
+    text = []
+    for key, value in metas.items():
+        if key in _SKIP_METAS:
+            continue
+        if isinstance(value, str):
+            text.append(value)
+        elif isinstance(value, list):
+            text += [item for item in value if isinstance(item, str)]
+    return ' '.join(text)
+
+
+class SearchIndex:
+    # Bump this when the table layout changes, older databases will be rebuilt automatically
+    SCHEMA_VERSION = 1
+    # BM25 term frequency saturation and length normalization
+    K1 = 1.2
+    B = 0.75
+    # SQLite limits the number of parameters in a single query
+    BATCH = 500
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the persistent full-text search index
+
+        Terms are stored once and postings reference them by number,
+        with the term frequency of each field kept separately so field boosts can change without a rebuild.
+
+        :param path: Fully resolved path of the database, ie: "/var/www/mysite/cgi-bin/.searchindex.sqlite"
+        :throws sqlite3.Error:
+        """
+        self.path = path
+        # Connections are shared between threads, (ie: the threaded WSGI server), so serialize access
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+            with self.conn:
+                self.conn.execute('DROP TABLE IF EXISTS postings')
+                self.conn.execute('DROP TABLE IF EXISTS terms')
+                self.conn.execute('DROP TABLE IF EXISTS docs')
+                self.conn.execute('PRAGMA user_version = %d' % self.SCHEMA_VERSION)
+
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS docs ('
+                'id INTEGER PRIMARY KEY, '
+                'path TEXT NOT NULL UNIQUE, '
+                'type TEXT NOT NULL, '
+                'mtime INTEGER NOT NULL, '
+                'size INTEGER NOT NULL, '
+                'draft INTEGER NOT NULL, '
+                'title_len INTEGER NOT NULL, '
+                'meta_len INTEGER NOT NULL, '
+                'body_len INTEGER NOT NULL, '
+                'metas TEXT NOT NULL)'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS docs_type ON docs (type)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL UNIQUE)')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS postings ('
+                'term INTEGER NOT NULL, '
+                'doc INTEGER NOT NULL, '
+                'title INTEGER NOT NULL, '
+                'meta INTEGER NOT NULL, '
+                'body INTEGER NOT NULL, '
+                'PRIMARY KEY (term, doc)) WITHOUT ROWID'
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc)')
+
+    def get_type(self, col_type: str) -> dict:
+        """
+        Get the indexed files of a given collection type
+        :param col_type: Collection type, ie: "posts"
+        :return: Dictionary of path => (mtime_ns, size)
+        """
+        with self.lock:
+            cursor = self.conn.execute('SELECT path, mtime, size FROM docs WHERE type = ?', (col_type,))
+            return {row[0]: (row[1], row[2]) for row in cursor}
+
+    def refresh(self, col_type: str, sources: list) -> int:
+        """
+        Bring the indexed files of a collection type in line with its sources
+
+        Only new and changed files are read and tokenized, files no longer in the sources are removed.
+        If the database is locked or read-only the refresh is skipped, (and tried again next time).
+
+        :param col_type: Collection type, ie: "posts"
+        :param sources: Every file of the type as (path, mtime_ns, size), ie: from FileCollection.get_sources
+        :return: Number of files added, changed or removed
+        """
+        indexed = self.get_type(col_type)
+        changed = []
+        for path, mtime, size in sources:
+            if indexed.pop(path, None) != (mtime, size):
+                changed.append((path, mtime, size))
+        # Anything still left was not in the sources
+        removed = list(indexed.keys())
+        if not changed and not removed:
+            return 0
+
+        docs = []
+        for path, mtime, size in changed:
+            try:
+                file = MarkdownLoader(SiteConfig.get_path_root() + path)
+            except FileNotFoundError:
+                # Removed since the sources were checked
+                removed.append(path)
+                continue
+            metas = file.get_metas()
+            fields = (
+                Counter(tokenize(str(metas.get('title', '')))),
+                Counter(tokenize(_get_meta_text(metas))),
+                Counter(tokenize(file.get_content())),
+            )
+            docs.append((path, mtime, size, metas, fields))
+
+        try:
+            with self.lock, self.conn:
+                # Take the write lock before looking anything up, so a refresh in another process
+                # cannot add the same files between removing the old versions and adding the new ones
+                self.conn.execute('BEGIN IMMEDIATE')
+                # Terms of the old versions, any no longer used by a file once the new versions are in are dropped
+                previous = self._remove([path for path, *_ in docs] + removed)
+                term_ids = self._get_term_ids(set().union(*(field for doc in docs for field in doc[4])))
+                for path, mtime, size, metas, fields in docs:
+                    cursor = self.conn.execute(
+                        'INSERT INTO docs (path, type, mtime, size, draft, title_len, meta_len, body_len, metas) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (
+                            path, col_type, mtime, size, 1 if metas.get('draft', False) else 0,
+                            sum(fields[0].values()), sum(fields[1].values()), sum(fields[2].values()),
+                            json.dumps(metas, default=str)
+                        )
+                    )
+                    doc = cursor.lastrowid
+                    terms = set(fields[0]) | set(fields[1]) | set(fields[2])
+                    self.conn.executemany(
+                        'INSERT INTO postings (term, doc, title, meta, body) VALUES (?, ?, ?, ?, ?)',
+                        [(term_ids[t], doc, fields[0][t], fields[1][t], fields[2][t]) for t in terms]
+                    )
+                self._prune_terms(list(previous))
+        except sqlite3.Error:
+            return 0
+
+        return len(docs) + len(removed)
+
+    def _remove(self, paths: list) -> set:
+        """
+        Remove files and their postings, (must be called within a transaction)
+        :return: Numbers of the terms the removed files used
+        """
+        terms = set()
+        for path in paths:
+            row = self.conn.execute('SELECT id FROM docs WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                terms.update(term for term, in self.conn.execute('SELECT term FROM postings WHERE doc = ?', row))
+                self.conn.execute('DELETE FROM postings WHERE doc = ?', row)
+                self.conn.execute('DELETE FROM docs WHERE id = ?', row)
+        return terms
+
+    def _prune_terms(self, term_ids: list) -> None:
+        """
+        Delete any of the given terms which no file uses anymore, (must be called within a transaction)
+        """
+        for i in range(0, len(term_ids), self.BATCH):
+            batch = term_ids[i:i + self.BATCH]
+            self.conn.execute(
+                'DELETE FROM terms WHERE id IN (%s) '
+                'AND NOT EXISTS (SELECT 1 FROM postings WHERE postings.term = terms.id)' % ','.join('?' * len(batch)),
+                batch
+            )
+
+    def _get_term_ids(self, terms: set) -> dict:
+        """
+        Get the numbers of the given terms, adding any which are new, (must be called within a transaction)
+        :return: Dictionary of term => id
+        """
+        self.conn.executemany('INSERT OR IGNORE INTO terms (term) VALUES (?)', [(t,) for t in terms])
+        return self._find_terms(list(terms))
+
+    def _find_terms(self, terms: list) -> dict:
+        """
+        Look up the numbers of existing terms
+        :return: Dictionary of term => id, (terms not in the index are left out)
+        """
+        ids = {}
+        for i in range(0, len(terms), self.BATCH):
+            batch = terms[i:i + self.BATCH]
+            cursor = self.conn.execute(
+                'SELECT term, id FROM terms WHERE term IN (%s)' % ','.join('?' * len(batch)), batch
+            )
+            ids.update(cursor)
+        return ids
+
+    def search(
+        self, query: str, col_types: list, drafts: bool = True, limit: int = 10, offset: int = 0
+    ) -> tuple:
+        """
+        Find the files best matching a query, ranked with BM25 across the title, metas and body
+
+        Files matching any of the query terms are returned,
+        those matching more of them, (or rarer ones, or in boosted fields), rank higher.
+
+        :param query: Search text, ie: "zebra stripes"
+        :param col_types: Collection types to include, ie: ["posts"]
+        :param drafts: Set to False to leave out any file marked as a draft
+        :param limit: Maximum number of results to return
+        :param offset: Number of results to skip, (for pagination)
+        :return: Total number of matches, and a list of (score, path, type, metas) for the requested page
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+
+        boosts = SiteConfig.get_search_boosts()
+        with self.lock:
+            count, *averages = self.conn.execute(
+                'SELECT COUNT(*), AVG(title_len), AVG(meta_len), AVG(body_len) FROM docs'
+            ).fetchone()
+            if count == 0:
+                return 0, []
+            # Fields which are empty everywhere do not affect the ranking
+            averages = [avg or 1 for avg in averages]
+            weights = [boosts['title'], boosts['meta'], boosts['body']]
+
+            scores = {}
+            for term_id in self._find_terms(terms).values():
+                rows = self.conn.execute(
+                    'SELECT p.doc, p.title, p.meta, p.body, d.title_len, d.meta_len, d.body_len, d.type, d.draft '
+                    'FROM postings p JOIN docs d ON d.id = p.doc WHERE p.term = ?',
+                    (term_id,)
+                ).fetchall()
+                # Document frequency is across every type, so scores do not depend on the filters
+                idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+                for doc, *row in rows:
+                    if row[6] not in col_types or (row[7] and not drafts):
+                        continue
+                    tf = 0.0
+                    for i in range(3):
+                        # BM25F, each field is normalized by its own average length before being weighted
+                        tf += weights[i] * row[i] / (1 - self.B + self.B * row[i + 3] / averages[i])
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (self.K1 + 1) / (tf + self.K1)
+
+            # Ties are broken by the order files were indexed in so pages are stable
+            ranked = sorted(scores.items(), key=lambda s: (-s[1], s[0]))[offset:offset + limit]
+            results = []
+            if ranked:
+                info = {
+                    row[0]: row[1:] for row in self.conn.execute(
+                        'SELECT id, path, type, metas FROM docs WHERE id IN (%s)' % ','.join('?' * len(ranked)),
+                        [doc for doc, _ in ranked]
+                    )
+                }
+                for doc, score in ranked:
+                    path, col_type, metas = info[doc]
+                    results.append((score, path, col_type, json.loads(metas)))
+
+        return len(scores), results
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def get_search_index() -> Union[SearchIndex, None]:
+    """
+    Get the full-text search index for this site, or None if it is disabled or cannot be opened
+    """
+    global _index
+    if _index is None and SiteConfig.get_search_enabled():
+        try:
+            _index = SearchIndex(SiteConfig.get_path_search_index())
+        except sqlite3.Error:
+            _index = None
+
+    return _index
@@ -21,8 +21,170 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
+import hashlib
 import json
-from typing import Union
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, Union
+from urllib.parse import parse_qs
+
+import timing
+
+# Optional Brotli module, (False if not installed), only imported once a response is compressed
+_brotli = None
+
+_DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _get_brotli():
+    """
+    Get the brotli module, or None if it is not installed
+    """
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+
+    return _brotli or None
+
+
+def _http_date(timestamp: float) -> str:
+    """
+    Format a timestamp as an HTTP date, ie: "Mon, 10 Apr 2023 12:00:00 GMT"
+
+    The same as email.utils.formatdate(timestamp, usegmt=True), without importing the email package.
+    """
+    t = time.gmtime(timestamp)
+    return '%s, %02d %s %04d %02d:%02d:%02d GMT' % (
+        _DAYS[t.tm_wday], t.tm_mday, _MONTHS[t.tm_mon - 1], t.tm_year, t.tm_hour, t.tm_min, t.tm_sec
+    )
+
+
+class SimpleSiteError(Exception):
+    def __init__(self, message: str, code: int = 500):
+        """
+        Raise to abort the current request and render an error to the user
+        :param message: Message to display
+        :param code: HTTP status code
+        """
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class Request:
+    def __init__(self, environ: dict):
+        """
+        Minimal request wrapper around a CGI or WSGI environment
+        :param environ: os.environ for CGI, or the WSGI environ dictionary
+        """
+        self.environ = environ
+        self.query = {}
+        self.query_all = parse_qs(environ.get('QUERY_STRING', ''))
+        for key, values in self.query_all.items():
+            self.query[key] = values[0]
+
+    def get(self, key: str, default: Union[str, None] = None) -> Union[str, None]:
+        """
+        Get a single query string parameter
+        :param key: Parameter name, ie: "page"
+        :param default: Value to return if the parameter was not sent
+        """
+        return self.query.get(key, default)
+
+    def get_all(self, key: str) -> list:
+        """
+        Get every value sent for a query string parameter, in the order sent
+        :param key: Parameter name, ie: "page"
+        """
+        return list(self.query_all.get(key, []))
+
+    def get_header(self, name: str) -> Union[str, None]:
+        """
+        Get a request header as sent by the client
+        :param name: Header name, ie: "If-None-Match"
+        """
+        return self.environ.get('HTTP_' + name.upper().replace('-', '_'))
+
+
+class Response:
+    def __init__(self, body: Union[str, bytes, Iterable[str]], code: int = 200, type: str = 'text/html', headers: Union[dict, None] = None):
+        """
+        A fully rendered response, ready to be sent via CGI or WSGI
+        :param body: Body content, (str, bytes if already encoded, or an iterable of str chunks to stream)
+        :param code: HTTP status code
+        :param type: Content-Type of the body
+        :param headers: Any additional headers to send
+        """
+        self.body = body
+        self.code = code
+        self.type = type
+        self.headers = headers or {}
+
+    # Size of the blocks streamed responses are sent in
+    STREAM_BLOCK_SIZE = 65536
+
+    def is_stream(self) -> bool:
+        """
+        Check if the body is streamed, (generated chunk by chunk), rather than a complete string
+        """
+        return not isinstance(self.body, (str, bytes))
+
+    def get_body(self) -> bytes:
+        """
+        Get the body encoded for sending to the client, (streamed bodies are read in full)
+        """
+        if self.is_stream():
+            return b''.join(self.iter_body())
+        if isinstance(self.body, bytes):
+            return self.body
+        return self.body.encode('utf-8')
+
+    def iter_body(self) -> Iterator[bytes]:
+        """
+        Iterate over the body encoded for sending to the client, in blocks of roughly STREAM_BLOCK_SIZE
+        """
+        if not self.is_stream():
+            return iter([self.get_body()])
+
+        # Bound now, so the body can be replaced by a wrapper around this iterator, (ie: compression)
+        return self._iter_blocks(self.body)
+
+    @classmethod
+    def _iter_blocks(cls, chunks: Iterable[Union[str, bytes]]) -> Iterator[bytes]:
+        block = []
+        size = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            block.append(chunk)
+            size += len(chunk)
+            if size >= cls.STREAM_BLOCK_SIZE:
+                yield b''.join(block)
+                block = []
+                size = 0
+        if block:
+            yield b''.join(block)
+
+    def get_status(self) -> str:
+        """
+        Get the full status line, ie: "200 OK"
+        """
+        return str(self.code) + ' ' + SimpleSite.STATUS_CODES.get(self.code, 'Unknown')
+
+    def get_headers(self) -> list:
+        """
+        Get all headers for this response as a list of (name, value) tuples
+        """
+        return [('Content-Type', self.type)] + list(self.headers.items())
 
 
 class SimpleSite:
@@ -95,34 +257,36 @@ class SimpleSite:
         511: 'Network Authentication Required'
     }
 
-    type: str = ''
+    # Bodies smaller than this are not worth compressing
+    COMPRESS_MIN_SIZE = 1024
+    # Number of compressed bodies to keep in memory
+    COMPRESS_CACHE_ENTRIES = 32
+
+    # Compressed bodies of cacheable responses, (sha1 of body + encoding) => bytes
+    _compressed = OrderedDict()
+    _compressed_lock = threading.Lock()
 
     @classmethod
-    def _pre_render(cls) -> None:
+    def _check_type(cls, type: str) -> str:
         """
-        Perform checks and any work necessary prior to rendering a page, called automatically
+        Ensure the requested content type is one of the supported registered types
         """
-        if cls.type not in [SimpleSite.TYPE_HTML, SimpleSite.TYPE_XML, SimpleSite.TYPE_JSON]:
+        if type not in [SimpleSite.TYPE_HTML, SimpleSite.TYPE_XML, SimpleSite.TYPE_JSON]:
             # Type not one of the supported registered types, remap to a supported one
-            cls.type = cls.TYPE_HTML
-
-    @classmethod
-    def _header(cls, code: int = 200, headers: dict = {}) -> None:
-
-        cls._pre_render()
-
-        print('Content-Type: ' + cls.type)
-        print('Status: ' + str(code))
-        for h in headers:
-            print(h + ': ' + headers[h])
-        print()
+            return cls.TYPE_HTML
+        return type
 
     @classmethod
-    def error(cls, message: str, code: int = 500) -> None:
+    def error(cls, message: str, code: int = 500, type: str = TYPE_HTML, headers: Union[dict, None] = None) -> Response:
         """
         Render an error to the user to indicate something happened
+        :param message: Message to display
+        :param code: HTTP status code
+        :param type: Content type to render the error as
+        :param headers: Any additional headers to send, ie: {"Retry-After": "5"}
         """
-        if cls.type == SimpleSite.TYPE_XML:
+        type = cls._check_type(type)
+        if type == SimpleSite.TYPE_XML:
             template = '''
             <?xml version="1.0"?>
             <xml><error>%s</error></xml>
@@ -137,13 +301,12 @@ class SimpleSite:
             <body>%s</body>
             </html>
             '''
+            type = SimpleSite.TYPE_HTML
 
-        cls._header(code)
-        print(template % message)
-        exit()
+        return Response(template % message, code, type, dict(headers or {}))
 
     @classmethod
-    def redirect(cls, path: str, code: int = 301) -> None:
+    def redirect(cls, path: str, code: int = 301, type: str = TYPE_HTML) -> Response:
         """
         Render a crawler-compliant redirect along with the requested redirect type
         """
@@ -152,7 +315,8 @@ class SimpleSite:
         except KeyError:
             text = 'Redirect'
 
-        if cls.type == SimpleSite.TYPE_XML:
+        type = cls._check_type(type)
+        if type == SimpleSite.TYPE_XML:
             template = '''
             <?xml version="1.0"?>
             <xml><redirect type="%s">%s</redirect></xml>
@@ -167,20 +331,403 @@ class SimpleSite:
             <body>%s: <a href="%s">Content is available here</a></body>
             </html>
             '''
+            type = SimpleSite.TYPE_HTML
 
-        cls._header(code, {'Location': path})
-        print(template % (text, path))
-        exit()
+        return Response(template % (text, path), code, type, {'Location': path})
 
     @classmethod
-    def render(cls, payload: Union[str, dict, list]) -> None:
+    def render(
+            cls,
+            payload: Union[str, dict, list, Iterator[str]],
+            type: str = TYPE_HTML,
+            headers: Union[dict, None] = None
+    ) -> Response:
         """
         Render a full page
-        :param payload: str | dict | list
+        :param payload: str | dict | list, or an iterator of str chunks to stream, (already encoded for JSON)
+        :param type: Content-Type of the page
+        :param headers: Any additional headers to send, ie: validators from get_validators
+        """
+        type = cls._check_type(type)
+        with timing.span('render'):
+            if type == cls.TYPE_JSON and isinstance(payload, (str, dict, list)):
+                body = json.dumps(payload)
+            elif isinstance(payload, list):
+                body = ''.join(payload)
+            else:
+                body = payload
+
+        return Response(body, 200, type, dict(headers or {}))
+
+    @classmethod
+    def get_validators(cls, sources: list) -> dict:
+        """
+        Build the ETag and Last-Modified headers for a response generated from the given source files
+        :param sources: List of (path, mtime_ns, size) for every source file involved
+        """
+        etag = hashlib.sha1(repr(sources).encode('utf-8')).hexdigest()[:20]
+        last_modified = max([source[1] for source in sources] + [0]) / 1e9
+        return {
+            'ETag': '"' + etag + '"',
+            'Last-Modified': _http_date(last_modified),
+        }
+
+    @classmethod
+    def not_modified(cls, request: Request, validators: dict, type: str = TYPE_HTML) -> Union[Response, None]:
+        """
+        Get a 304 response if the client already has the current version, (or None if it needs the full page)
+        :param request: Current request
+        :param validators: Headers as returned by get_validators
+        :param type: Content-Type of the page
+        """
+        tags = cls._get_if_none_match(request)
+        if tags is not None:
+            # If-None-Match takes precedence over If-Modified-Since when both are sent
+            # Compressed representations carry the encoding as a suffix on the ETag
+            tags = [tag.replace('-br"', '"').replace('-gzip"', '"') for tag in tags]
+            if validators['ETag'] not in tags and '*' not in tags:
+                return None
+        else:
+            if_modified_since = request.get_header('If-Modified-Since')
+            if if_modified_since is None:
+                return None
+            from email.utils import parsedate_to_datetime
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+                if since < parsedate_to_datetime(validators['Last-Modified']):
+                    return None
+            except (TypeError, ValueError):
+                return None
+
+        return Response('', 304, cls._check_type(type), dict(validators))
+
+    @staticmethod
+    def _get_if_none_match(request: Request) -> Union[list, None]:
+        """
+        Get the entity tags from the If-None-Match header, (or None if not sent)
+        """
+        if_none_match = request.get_header('If-None-Match')
+        if if_none_match is None:
+            return None
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        # Weak comparison, (compression by a proxy may turn this into a weak tag)
+        return [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+    @classmethod
+    def handle(cls, handler: Callable[[Request], Response], environ: dict) -> Response:
+        """
+        Run a request handler and return its response, rendering any raised SimpleSiteError
+        :param handler: Handler to run, ie: handlers.crawler
+        :param environ: os.environ for CGI, or the WSGI environ dictionary
+        """
+        request = Request(environ)
+        timing.start()
+        debug = cls._get_timing_config()[0]
+        try:
+            response = handler(request)
+        except SimpleSiteError as e:
+            response = cls.error(e.message, e.code)
+
+        with timing.span('compress'):
+            response = cls.compress(request, response)
+        if debug:
+            # Streamed bodies are still to be generated, so their time is only included in the timing log
+            response.headers['Server-Timing'] = timing.get_header()
+        return response
+
+    @classmethod
+    def _get_timing_config(cls) -> tuple:
+        """
+        Get if the Server-Timing header is enabled, along with the timing log and its threshold, (path, seconds)
+
+        Timing is switched off for the current request if neither are enabled.
+        """
+        # Imported here as the configuration itself relies on SimpleSite
+        from siteconfig import SiteConfig
+        try:
+            config = (SiteConfig.get_debug(), SiteConfig.get_path_timing_log(), SiteConfig.get_timing_slow())
+        except SimpleSiteError:
+            # Configuration is incomplete, the handler will report that
+            config = (False, None, 0.0)
+
+        if not config[0] and config[1] is None:
+            timing.stop()
+        return config
+
+    @classmethod
+    def log_timing(cls, request: Request, response: Response) -> None:
+        """
+        Write the timings of a finished request to the timing log, if enabled
+        :param request: Request which was handled
+        :param response: Response which was sent
+        """
+        path, slow = cls._get_timing_config()[1:]
+        if path is not None:
+            query = request.environ.get('QUERY_STRING', '')
+            name = request.environ.get('SCRIPT_NAME', '') + request.environ.get('PATH_INFO', '')
+            timing.log(path, slow, name + ('?' + query if query else ''), response.code)
+
+    @classmethod
+    def get_encoding(cls, request: Request) -> Union[str, None]:
+        """
+        Negotiate the content encoding to use from the Accept-Encoding header
+        :return: "br", "gzip" or None for no compression
+        """
+        accepted = {}
+        for part in (request.get_header('Accept-Encoding') or '').split(','):
+            params = part.strip().split(';')
+            quality = 1.0
+            for param in params[1:]:
+                param = param.strip()
+                if param.startswith('q='):
+                    try:
+                        quality = float(param[2:])
+                    except ValueError:
+                        quality = 0.0
+            accepted[params[0].strip().lower()] = quality
+
+        for encoding in ('br', 'gzip'):
+            if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+                if encoding == 'br' and _get_brotli() is None:
+                    continue
+                return encoding
+        return None
+
+    @classmethod
+    def compress(cls, request: Request, response: Response) -> Response:
+        """
+        Compress a response body if the client supports it
+
+        Cacheable responses, (those with an ETag), keep their compressed bytes so repeated hits skip compression.
+
+        :param request: Current request
+        :param response: Response to compress
+        """
+        if response.code == 304 and 'ETag' in response.headers:
+            # Not modified responses describe the page the client already has,
+            # so they carry the same headers the full response would have
+            response.headers['Vary'] = 'Accept-Encoding'
+            encoding = cls.get_encoding(request)
+            # Pages too small to compress are sent as-is, (the client then holds the bare ETag)
+            if encoding is not None and response.headers['ETag'] not in (cls._get_if_none_match(request) or []):
+                response.headers['ETag'] = response.headers['ETag'][:-1] + '-' + encoding + '"'
+            return response
+
+        if response.code != 200:
+            return response
+
+        if response.is_stream():
+            # Streamed responses are compressed as they are generated, (and never cached)
+            response.headers['Vary'] = 'Accept-Encoding'
+            encoding = cls.get_encoding(request)
+            if encoding is not None:
+                response.body = cls._compress_stream(response.iter_body(), encoding)
+                response.headers['Content-Encoding'] = encoding
+                if 'ETag' in response.headers:
+                    response.headers['ETag'] = response.headers['ETag'][:-1] + '-' + encoding + '"'
+            return response
+
+        body = response.get_body()
+        if len(body) < cls.COMPRESS_MIN_SIZE:
+            return response
+
+        # The body differs depending on the encoding, even if the client does not support compression
+        response.headers['Vary'] = 'Accept-Encoding'
+        encoding = cls.get_encoding(request)
+        if encoding is None:
+            return response
+
+        cacheable = 'ETag' in response.headers
+        key = hashlib.sha1(body).hexdigest() + '.' + encoding
+        compressed = cls._read_compressed(key) if cacheable else None
+        if compressed is None:
+            if encoding == 'br':
+                compressed = _get_brotli().compress(body)
+            else:
+                # wbits of 31 produces a gzip container
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                compressed = compressor.compress(body) + compressor.flush()
+            if cacheable:
+                cls._write_compressed(key, compressed)
+
+        response.body = compressed
+        response.headers['Content-Encoding'] = encoding
+        if cacheable:
+            response.headers['ETag'] = response.headers['ETag'][:-1] + '-' + encoding + '"'
+        return response
+
+    @staticmethod
+    def _compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+        """
+        Compress a stream of chunks incrementally
         """
-        cls._header(200)
-        if cls.type == cls.TYPE_JSON:
-            print(json.dumps(payload))
+        if encoding == 'br':
+            compressor = _get_brotli().Compressor()
+            for chunk in chunks:
+                out = compressor.process(chunk)
+                if out:
+                    yield out
+            yield compressor.finish()
         else:
-            print(payload)
+            # wbits of 31 produces a gzip container
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            for chunk in chunks:
+                out = compressor.compress(chunk)
+                if out:
+                    yield out
+            yield compressor.flush()
+
+    @classmethod
+    def _get_compressed_path(cls) -> Union[str, None]:
+        """
+        Get the directory to store compressed bodies in, (within the render cache), or None if not configured
+        """
+        # Imported here as the configuration itself relies on SimpleSite
+        from siteconfig import SiteConfig
+        try:
+            path = SiteConfig.get_path_render_cache()
+        except SimpleSiteError:
+            return None
+        return os.path.join(path, 'compressed') if path is not None else None
+
+    @classmethod
+    def _read_compressed(cls, key: str) -> Union[bytes, None]:
+        with cls._compressed_lock:
+            if key in cls._compressed:
+                cls._compressed.move_to_end(key)
+                return cls._compressed[key]
+
+        path = cls._get_compressed_path()
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, key), 'rb') as fp:
+                return fp.read()
+        except OSError:
+            return None
+
+    @classmethod
+    def _write_compressed(cls, key: str, compressed: bytes) -> None:
+        with cls._compressed_lock:
+            cls._compressed[key] = compressed
+            while len(cls._compressed) > cls.COMPRESS_CACHE_ENTRIES:
+                cls._compressed.popitem(last=False)
+
+        path = cls._get_compressed_path()
+        if path is None:
+            return
+        tmp = None
+        try:
+            os.makedirs(path, exist_ok=True)
+            cls._evict_compressed(path)
+            import tempfile
+            fd, tmp = tempfile.mkstemp(dir=path, prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(compressed)
+            os.replace(tmp, os.path.join(path, key))
+            tmp = None
+        except OSError:
+            # Cache is best-effort
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    @classmethod
+    def _evict_compressed(cls, path: str) -> None:
+        """
+        Remove the oldest compressed bodies on disk to make room for a new one
+
+        Entries from older content pile up, so only the most recent ones are kept on disk too.
+        """
+        entries = []
+        for entry in os.scandir(path):
+            # Temporary files belong to writes still in progress
+            if not entry.name.startswith('.tmp-'):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    # Already evicted by another process
+                    pass
+
+        entries.sort()
+        for mtime, entry_path in entries[:max(0, len(entries) - cls.COMPRESS_CACHE_ENTRIES + 1)]:
+            try:
+                os.unlink(entry_path)
+            except FileNotFoundError:
+                # Already evicted by another process
+                pass
+
+    @classmethod
+    def cgi(cls, handler: Callable[[Request], Response]) -> None:
+        """
+        Run a request handler as a CGI script, printing the response to stdout and exiting
+        :param handler: Handler to run, ie: handlers.crawler
+        """
+        environ = dict(os.environ)
+        age = timing.get_process_age()
+        response = cls.handle(handler, environ)
+        if age is not None:
+            # Interpreter startup and imports, up until the request was handled
+            timing.add('startup', age)
+            if 'Server-Timing' in response.headers:
+                response.headers['Server-Timing'] = timing.get_header()
+
+        head = 'Content-Type: ' + response.type + '\n'
+        head += 'Status: ' + str(response.code) + '\n'
+        for h in response.headers:
+            head += h + ': ' + response.headers[h] + '\n'
+        sys.stdout.flush()
+        if response.is_stream():
+            # Send the headers with the first block, then the rest as it is generated
+            head = (head + '\n').encode('utf-8')
+            for block in response.iter_body():
+                sys.stdout.buffer.write(head + block)
+                head = b''
+            sys.stdout.buffer.write(head)
+        else:
+            body = b''
+            if response.code != 304:
+                # Not modified responses have no body, a length would describe the page they stand in for
+                body = response.get_body()
+                head += 'Content-Length: ' + str(len(body)) + '\n'
+            head += '\n'
+
+            # Send the entire response in a single write
+            sys.stdout.buffer.write(head.encode('utf-8') + body)
+        sys.stdout.buffer.flush()
+        cls.log_timing(Request(environ), response)
         exit()
+
+    @classmethod
+    def wsgi(cls, handler: Callable[[Request], Response], environ: dict, start_response: Callable) -> Iterable[bytes]:
+        """
+        Run a request handler as a WSGI application
+        :param handler: Handler to run, ie: handlers.crawler
+        :param environ: WSGI environ dictionary
+        :param start_response: WSGI start_response callable
+        """
+        response = cls.handle(handler, environ)
+        if response.is_stream():
+            start_response(response.get_status(), response.get_headers())
+            return cls._iter_logged(Request(environ), response)
+
+        if response.code == 304:
+            # Not modified responses have no body, a length would describe the page they stand in for
+            start_response(response.get_status(), response.get_headers())
+            cls.log_timing(Request(environ), response)
+            return [b'']
+
+        body = response.get_body()
+        start_response(response.get_status(), response.get_headers() + [('Content-Length', str(len(body)))])
+        cls.log_timing(Request(environ), response)
+        return [body]
+
+    @classmethod
+    def _iter_logged(cls, request: Request, response: Response) -> Iterator[bytes]:
+        """
+        Stream a response body, logging the request timings once it has been sent
+        """
+        yield from response.iter_body()
+        cls.log_timing(request, response)
@@ -21,13 +21,32 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from simplesite import SimpleSite
+from simplesite import SimpleSiteError
 import configparser
 import os
+import sys
+import timing
+from typing import Union
 
 _config = None
 
 
+def _debug_excepthook(exc_type, exc_value, exc_traceback):
+    """
+    Print uncaught exceptions to the browser when debug is enabled
+
+    Replaces cgitb, which costs more to import than most requests take to render.
+    """
+    import traceback
+    from html import escape
+
+    trace = ''.join(traceback.format_exception(exc_type, exc_value, exc_traceback))
+    print('Content-Type: text/html\n')
+    print('<pre>' + escape(trace) + '</pre>')
+    sys.stdout.flush()
+    sys.__excepthook__(exc_type, exc_value, exc_traceback)
+
+
 class SiteConfig:
 
     def __init__(self):
@@ -39,8 +58,38 @@ class SiteConfig:
         self.default_view = None
         self.types = []
         self.debug = False
+        self.index = False
+        self.path_index = os.path.join(self.path_cgi, '.metaindex.sqlite')
+        self.index_watched = False
+        self.search = False
+        self.path_search_index = os.path.join(self.path_cgi, '.searchindex.sqlite')
+        self.search_page_size = 10
+        self.search_boosts = {'title': 3.0, 'meta': 1.5, 'body': 1.0}
+        self.workers = 0
+        self.worker_mode = 'process'
+        self.io_threads = 0
+        self.libyaml = True
+        self.scan_depth = 1
+        self.scan_ignore = ()
+        self.excerpt_length = 0
+        self.render_cache_entries = 256
+        self.listing_page_size = 50
+        self.path_timing_log = None
+        self.timing_slow = 0.0
+        self.path_render_cache = None
+        self.path_page_cache = None
+        self.page_cache_bytes = 64 * 1024 * 1024
+        self.admission_slots = 0
+        self.admission_queue = 0
+        self.admission_wait = 2.0
+        self.admission_retry_after = 5
+        self.path_admission = os.path.join(self.path_cgi, '.admission')
 
     def load(self):
+        with timing.span('config'):
+            self._load()
+
+    def _load(self):
 
         try:
             config = configparser.ConfigParser()
@@ -51,13 +100,70 @@ class SiteConfig:
             self.default_view = config['site']['defaultview']
             self.types = list(map(lambda x: x.strip(), config['site']['types'].split(',')))
             self.debug = config.getboolean('site', 'debug')
+
+            # Optional persistent metadata index
+            self.index = config.getboolean('index', 'enabled', fallback=False)
+            if config.has_option('index', 'path'):
+                self.path_index = os.path.join(self.path_cgi, config['index']['path'])
+            self.index_watched = config.getboolean('index', 'watched', fallback=False)
+
+            # Optional full-text search index for search.json
+            self.search = config.getboolean('search', 'enabled', fallback=False)
+            if config.has_option('search', 'path'):
+                self.path_search_index = os.path.join(self.path_cgi, config['search']['path'])
+            self.search_page_size = config.getint('search', 'page_size', fallback=10)
+            self.search_boosts = {
+                'title': config.getfloat('search', 'boost_title', fallback=3.0),
+                'meta': config.getfloat('search', 'boost_meta', fallback=1.5),
+                'body': config.getfloat('search', 'boost_body', fallback=1.0),
+            }
+
+            # Optional parallel loading of files
+            self.workers = config.getint('loading', 'workers', fallback=0)
+            self.worker_mode = config.get('loading', 'mode', fallback='process')
+            if self.worker_mode not in ('process', 'thread'):
+                raise SimpleSiteError('Invalid loading mode "' + self.worker_mode + '", must be process or thread')
+            # Threads to keep filesystem calls in flight at once, (for slow network mounts), 0 or 1 for one at a time
+            self.io_threads = config.getint('loading', 'io_threads', fallback=0)
+            # Parse front matter with the LibYAML bindings of PyYAML when they are available
+            self.libyaml = config.getboolean('loading', 'libyaml', fallback=True)
+            # Maximum length of automatic excerpts, 0 for the full first paragraph
+            self.excerpt_length = config.getint('loading', 'excerpt_length', fallback=0)
+            # How many levels of subdirectories to look for files in, and file or directory names to skip
+            self.scan_depth = config.getint('loading', 'depth', fallback=1)
+            self.scan_ignore = tuple(
+                x.strip() for x in config.get('loading', 'ignore', fallback='').split(',') if x.strip() != ''
+            )
+
+            # Number of files per listing page, 0 to list everything on a single page
+            self.listing_page_size = config.getint('listing', 'page_size', fallback=50)
+
+            # Optional log of request timings, (slow is in seconds)
+            if config.get('timing', 'log', fallback='') != '':
+                self.path_timing_log = os.path.join(self.path_cgi, config['timing']['log'])
+            self.timing_slow = config.getfloat('timing', 'slow', fallback=0.0)
+
+            # Optional caching of rendered content
+            self.render_cache_entries = config.getint('cache', 'render_entries', fallback=256)
+            if config.get('cache', 'render_path', fallback='') != '':
+                self.path_render_cache = os.path.join(self.path_cgi, config['cache']['render_path'])
+            if config.get('cache', 'page_path', fallback='') != '':
+                self.path_page_cache = os.path.join(self.path_cgi, config['cache']['page_path'])
+            self.page_cache_bytes = config.getint('cache', 'page_bytes', fallback=64 * 1024 * 1024)
+
+            # Optional limit of concurrent page renders across every process, (wait is in seconds)
+            self.admission_slots = config.getint('admission', 'slots', fallback=0)
+            self.admission_queue = config.getint('admission', 'queue', fallback=0)
+            self.admission_wait = config.getfloat('admission', 'wait', fallback=2.0)
+            self.admission_retry_after = config.getint('admission', 'retry_after', fallback=5)
+            if config.has_option('admission', 'path'):
+                self.path_admission = os.path.join(self.path_cgi, config['admission']['path'])
         except KeyError:
-            SimpleSite.error('Server-side configuration not complete, please check cgi-bin/config.ini')
+            raise SimpleSiteError('Server-side configuration not complete, please check cgi-bin/config.ini')
 
         if self.debug:
             # This will enable debug output to the browser
-            import cgitb
-            cgitb.enable()
+            sys.excepthook = _debug_excepthook
 
     @classmethod
     def get_host(cls) -> str:
@@ -80,6 +186,13 @@ class SiteConfig:
         """
         return get_config().path_cgi
 
+    @classmethod
+    def get_path_config(cls) -> str:
+        """
+        Get the fully resolved path to the configuration file, ie: "/var/www/mysite/cgi-bin/config.ini"
+        """
+        return get_config().path_config
+
     @classmethod
     def get_path_web(cls) -> str:
         """
@@ -108,6 +221,188 @@ class SiteConfig:
         """
         return get_config().debug
 
+    @classmethod
+    def get_index_enabled(cls) -> bool:
+        """
+        Get if the persistent metadata index has been enabled
+        """
+        return get_config().index
+
+    @classmethod
+    def get_path_index(cls) -> str:
+        """
+        Get the fully resolved path of the metadata index, ie: "/var/www/mysite/cgi-bin/.metaindex.sqlite"
+        """
+        return get_config().path_index
+
+    @classmethod
+    def get_search_enabled(cls) -> bool:
+        """
+        Get if the full-text search index, (and search.json), has been enabled
+        """
+        return get_config().search
+
+    @classmethod
+    def get_path_search_index(cls) -> str:
+        """
+        Get the fully resolved path of the search index, ie: "/var/www/mysite/cgi-bin/.searchindex.sqlite"
+        """
+        return get_config().path_search_index
+
+    @classmethod
+    def get_search_page_size(cls) -> int:
+        """
+        Get the default number of search results per page
+        """
+        return get_config().search_page_size
+
+    @classmethod
+    def get_search_boosts(cls) -> dict:
+        """
+        Get the ranking weight of each searched field, ie: {"title": 3.0, "meta": 1.5, "body": 1.0}
+        """
+        return get_config().search_boosts
+
+    @classmethod
+    def get_index_watched(cls) -> bool:
+        """
+        Get if the metadata index is kept up to date by watcher.py and can be trusted without checking the files
+        """
+        return get_config().index_watched
+
+    @classmethod
+    def get_workers(cls) -> int:
+        """
+        Get the number of workers to use for loading files, 0 or 1 to load sequentially
+        """
+        return get_config().workers
+
+    @classmethod
+    def get_worker_mode(cls) -> str:
+        """
+        Get the type of worker to use for loading files, ie: "process" or "thread"
+        """
+        return get_config().worker_mode
+
+    @classmethod
+    def get_io_threads(cls) -> int:
+        """
+        Get the number of threads to use for listing, stat'ing and reading files, 0 or 1 to make one call at a time
+        """
+        return get_config().io_threads
+
+    @classmethod
+    def get_libyaml(cls) -> bool:
+        """
+        Get if front matter should be parsed with LibYAML, (when PyYAML was built with it)
+        """
+        return get_config().libyaml
+
+    @classmethod
+    def get_scan_depth(cls) -> int:
+        """
+        Get the number of subdirectory levels to look for files in, 0 for only the top level of each type
+        """
+        return get_config().scan_depth
+
+    @classmethod
+    def get_scan_ignore(cls) -> tuple:
+        """
+        Get the glob patterns of file and directory names to skip when scanning, ie: ("_drafts", "*.sync-conflict-*")
+        """
+        return get_config().scan_ignore
+
+    @classmethod
+    def get_excerpt_length(cls) -> int:
+        """
+        Get the maximum number of characters of automatic excerpts, 0 for no limit
+        """
+        return get_config().excerpt_length
+
+    @classmethod
+    def get_render_cache_entries(cls) -> int:
+        """
+        Get the maximum number of rendered Markdown files to cache
+        """
+        return get_config().render_cache_entries
+
+    @classmethod
+    def get_path_render_cache(cls) -> Union[str, None]:
+        """
+        Get the fully resolved directory to cache rendered Markdown in, or None to only cache in memory
+        """
+        return get_config().path_render_cache
+
+    @classmethod
+    def get_path_page_cache(cls) -> Union[str, None]:
+        """
+        Get the fully resolved directory to cache complete crawler pages in, or None if disabled
+        """
+        return get_config().path_page_cache
+
+    @classmethod
+    def get_page_cache_bytes(cls) -> int:
+        """
+        Get the maximum total size of all cached crawler pages
+        """
+        return get_config().page_cache_bytes
+
+    @classmethod
+    def get_admission_slots(cls) -> int:
+        """
+        Get the maximum number of pages rendered at once across every process, 0 for no limit
+        """
+        return get_config().admission_slots
+
+    @classmethod
+    def get_admission_queue(cls) -> int:
+        """
+        Get the maximum number of requests waiting for a free slot, any more are turned away immediately
+        """
+        return get_config().admission_queue
+
+    @classmethod
+    def get_admission_wait(cls) -> float:
+        """
+        Get the maximum number of seconds a queued request waits for a free slot
+        """
+        return get_config().admission_wait
+
+    @classmethod
+    def get_admission_retry_after(cls) -> int:
+        """
+        Get the number of seconds turned away clients are asked to wait before retrying
+        """
+        return get_config().admission_retry_after
+
+    @classmethod
+    def get_path_admission(cls) -> str:
+        """
+        Get the fully resolved directory of the lock files used to count concurrent renders
+        """
+        return get_config().path_admission
+
+    @classmethod
+    def get_listing_page_size(cls) -> int:
+        """
+        Get the number of files to render per listing page, 0 for no pagination
+        """
+        return get_config().listing_page_size
+
+    @classmethod
+    def get_path_timing_log(cls) -> Union[str, None]:
+        """
+        Get the fully resolved path of the request timing log, or None if it is disabled
+        """
+        return get_config().path_timing_log
+
+    @classmethod
+    def get_timing_slow(cls) -> float:
+        """
+        Get the minimum duration, in seconds, of requests to write to the timing log
+        """
+        return get_config().timing_slow
+
     @classmethod
     def get_home_url(cls) -> str:
         """
@@ -120,12 +415,29 @@ class SiteConfig:
 def get_config() -> SiteConfig:
     global _config
     if _config is None:
-        _config = SiteConfig()
-        _config.load()
+        config = SiteConfig()
+        config.load()
+        # Only keep the configuration once it loaded successfully,
+        # long-running processes will retry on the next request.
+        _config = config
 
     return _config
 
 
+def init_worker_config(path_config: str, path_root: str) -> None:
+    """
+    Ensure a worker process uses the same configuration as its parent
+
+    Required when worker processes are started with "spawn" rather than "fork",
+    as they will not inherit any changes made to the configuration at runtime.
+    """
+    config = get_config_for_tests()
+    if config.path_config != path_config or config.path_root != path_root or config.host is None:
+        config.path_config = path_config
+        config.path_root = path_root
+        config.load()
+
+
 def get_config_for_tests() -> SiteConfig:
     """
     Get the system configuration, BUT DO NOT LOAD IT!
@@ -21,7 +21,176 @@ DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 """
 
-from bs4 import BeautifulSoup
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Union
+
+from siteconfig import SiteConfig
+import timing
+
+# Compiled templates, path => (mtime_ns, CompiledTemplate)
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+# Placeholder used to mark slots while compiling, (cannot appear in a parsed document)
+_SLOT = '\x00slot%d\x00'
+_SLOT_RE = re.compile('\x00slot([0-9]+)\x00')
+
+
+def _escape(text: str) -> str:
+    """
+    Escape text the same way BeautifulSoup's default "minimal" formatter does
+    """
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _render_tag(name: str, attrs: dict) -> str:
+    """
+    Render a void element with its attributes sorted, matching BeautifulSoup output
+    """
+    html = '<' + name
+    for key in sorted(attrs):
+        value = _escape(str(attrs[key]))
+        quote = '"'
+        if '"' in value:
+            if "'" in value:
+                value = value.replace('"', '&quot;')
+            else:
+                quote = "'"
+        html += ' ' + key + '=' + quote + value + quote
+    return html + '/>'
+
+
+class CompiledTemplate:
+    # Slot numbers reserved for the title text, the end of <head>, and the end of <div id="cms">,
+    # existing <meta> and <link> tags are numbered after these.
+    SLOT_TITLE = 0
+    SLOT_HEAD = 1
+    SLOT_BODY = 2
+
+    def __init__(self, segments: list, title: Union[str, None], tags: list):
+        """
+        A template pre-split into static HTML segments and dynamic slots
+
+        :param segments: Static HTML strings and slot numbers, in document order
+        :param title: Original title text, or None if the template has no <title>
+        :param tags: Name and attributes of every <meta> and <link> within <head>, in slot order
+        """
+        self.segments = segments
+        self.title = title
+        self.tags = tags
+
+    @classmethod
+    def compile(cls, template: str) -> 'CompiledTemplate':
+        """
+        Parse a template file and split it into segments
+        :param template: Filename of template to load
+        :throws FileNotFoundError:
+        """
+        from bs4 import BeautifulSoup
+
+        with open(template) as fp:
+            soup = BeautifulSoup(fp, 'lxml')
+
+        title = None
+        if soup.title is not None:
+            title = soup.title.get_text()
+            soup.title.string = _SLOT % cls.SLOT_TITLE
+
+        tags = []
+        if soup.head is not None:
+            for tag in soup.head.find_all(['meta', 'link']):
+                attrs = {}
+                for key, value in tag.attrs.items():
+                    # Multi-valued attributes, (ie: rel), are parsed as lists
+                    attrs[key] = ' '.join(value) if isinstance(value, list) else value
+                tags.append({'name': tag.name, 'attrs': attrs})
+                tag.replace_with(_SLOT % (cls.SLOT_BODY + len(tags)))
+            soup.head.append(_SLOT % cls.SLOT_HEAD)
+
+        target = soup.find('div', {'id': 'cms'})
+        if target is not None:
+            target.append(_SLOT % cls.SLOT_BODY)
+
+        segments = []
+        for i, part in enumerate(_SLOT_RE.split(str(soup))):
+            # Split alternates static HTML and the captured slot numbers
+            segments.append(int(part) if i % 2 else part)
+
+        return cls(segments, title, tags)
+
+    @classmethod
+    def load(cls, template: str) -> 'CompiledTemplate':
+        """
+        Get the compiled version of a template, compiling it only when the file has changed
+        :param template: Filename of template to load
+        :throws FileNotFoundError:
+        """
+        mtime = os.stat(template).st_mtime_ns
+        with _compiled_lock:
+            cached = _compiled.get(template)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        compiled = cls._read_cache(template, mtime)
+        if compiled is None:
+            compiled = cls.compile(template)
+            cls._write_cache(template, mtime, compiled)
+
+        with _compiled_lock:
+            _compiled[template] = (mtime, compiled)
+        return compiled
+
+    @staticmethod
+    def _get_cache_file(template: str) -> Union[str, None]:
+        path = SiteConfig.get_path_render_cache()
+        if path is None:
+            return None
+        return os.path.join(path, 'template-' + hashlib.sha1(template.encode('utf-8')).hexdigest() + '.json')
+
+    @classmethod
+    def _read_cache(cls, template: str, mtime: int) -> Union['CompiledTemplate', None]:
+        """
+        Load a previously compiled template from the disk cache, (so CGI requests can skip parsing too)
+        """
+        filename = cls._get_cache_file(template)
+        if filename is None:
+            return None
+
+        try:
+            with open(filename, 'r', encoding='utf-8') as fp:
+                data = json.load(fp)
+            if data['mtime'] != mtime:
+                return None
+            return cls(data['segments'], data['title'], data['tags'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @classmethod
+    def _write_cache(cls, template: str, mtime: int, compiled: 'CompiledTemplate') -> None:
+        filename = cls._get_cache_file(template)
+        if filename is None:
+            return
+
+        data = {'mtime': mtime, 'segments': compiled.segments, 'title': compiled.title, 'tags': compiled.tags}
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            import tempfile
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), prefix='.tmp-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+                json.dump(data, fp)
+            os.replace(tmp, filename)
+        except OSError:
+            # Cache is best-effort, (but never leave a partial file behind)
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
 
 
 class Templater:
@@ -32,8 +201,24 @@ class Templater:
         :param template: Filename of template to load
         :throws FileNotFoundError:
         """
-        with open(template) as fp:
-            self.soup = BeautifulSoup(fp, 'lxml')
+        with timing.span('template'):
+            self.template = CompiledTemplate.load(template)
+        self.title = None
+        # Attribute overrides for existing tags, slot => attrs
+        self.tags = {}
+        # New elements to append to <head> in the order they were set, [name, attrs] or ['title', text]
+        self.appended = []
+        self.body = []
+
+    @property
+    def soup(self):
+        """
+        Get the rendered page parsed as a BeautifulSoup DOM
+
+        Only intended for inspection, changes made to the returned object are not rendered.
+        """
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(str(self), 'lxml')
 
     def set_title(self, title: str):
         """
@@ -41,13 +226,16 @@ class Templater:
         :param title: Page title to set
         """
         # Set the base title
-        try:
-            self.soup.title.string = title
-        except AttributeError:
+        if self.template.title is not None:
+            self.title = title
+        else:
             # does not exist yet
-            tag = self.soup.new_tag('title')
-            tag.string = title
-            self.soup.head.append(tag)
+            for item in self.appended:
+                if item[0] == 'title':
+                    item[1] = title
+                    break
+            else:
+                self.appended.append(['title', title])
 
         # And set the supplemental titles (opengraph and the like)
         self.set_meta_content('og:title', title)
@@ -66,36 +254,75 @@ class Templater:
         Set the canonical link for this page
         :param href: Fully resolved URL
         """
-        try:
-            self.soup.head.find('link', {'rel': 'canonical'})['href'] = href
-        except TypeError:
-            # Does not exist
-            tag = self.soup.new_tag('link', attrs={'rel': 'canonical', 'href': href})
-            self.soup.head.append(tag)
+        self.set_link('canonical', href)
+
+    def set_link(self, rel: str, href: str):
+        """
+        Set a <link> within the head of this page, ie: "next" and "prev" for paginated listings
+        :param rel: Link relationship
+        :param href: Fully resolved URL
+        """
+        self._set_attribute('link', 'rel', rel, 'href', href)
 
     def set_body(self, body: str):
         """
         Set the body content for this page, will render into <div id="cms"/>
         :param body: HTML content of body
         """
-        # Since soup only likes to deal with full Objects and not strings,
-        # we will build a new Soup object based off the incoming fragment
-        frag = BeautifulSoup(body, 'html.parser')
-        target = self.soup.find('div', {'id': 'cms'})
-        target.append(frag)
+        # The fragment is spliced in as-is, there is no need to parse it
+        self.body.append(body)
 
     def set_meta_content(self, key: str, content: str, prop: str = 'property'):
-        try:
-            self.soup.head.find('meta', {prop: key})['content'] = content
-        except TypeError:
-            # Does not exist
-            tag = self.soup.new_tag('meta', attrs={prop: key, 'content': content})
-            self.soup.head.append(tag)
+        self._set_attribute('meta', prop, key, 'content', content)
+
+    def _set_attribute(self, name: str, prop: str, key: str, attr: str, value: str):
+        """
+        Set an attribute on the first <name> element within <head> where "prop" matches "key",
+        appending a new element if none exist
+        """
+        def matches(attrs: dict) -> bool:
+            if prop == 'rel':
+                # rel is a multi-valued attribute
+                return key in attrs.get(prop, '').split()
+            return attrs.get(prop) == key
+
+        for slot, tag in enumerate(self.template.tags, CompiledTemplate.SLOT_BODY + 1):
+            if tag['name'] == name and matches(tag['attrs']):
+                self.tags.setdefault(slot, dict(tag['attrs']))[attr] = value
+                return
+
+        for item in self.appended:
+            if item[0] == name and matches(item[1]):
+                item[1][attr] = value
+                return
+
+        # Does not exist
+        self.appended.append([name, {prop: key, attr: value}])
 
     def __str__(self):
         """
         Fetch this rendered template as an HTML string, ready for direct output to the browser
-
-        (Just calls str(soup)...)
         """
-        return str(self.soup)
+        with timing.span('template'):
+            return self._render()
+
+    def _render(self) -> str:
+        html = []
+        for segment in self.template.segments:
+            if isinstance(segment, str):
+                html.append(segment)
+            elif segment == CompiledTemplate.SLOT_TITLE:
+                html.append(_escape(self.title if self.title is not None else self.template.title))
+            elif segment == CompiledTemplate.SLOT_HEAD:
+                for name, value in self.appended:
+                    if name == 'title':
+                        html.append('<title>' + _escape(value) + '</title>')
+                    else:
+                        html.append(_render_tag(name, value))
+            elif segment == CompiledTemplate.SLOT_BODY:
+                html.extend(self.body)
+            else:
+                tag = self.template.tags[segment - CompiledTemplate.SLOT_BODY - 1]
+                html.append(_render_tag(tag['name'], self.tags.get(segment, tag['attrs'])))
+
+        return ''.join(html)
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from admission import Admission
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_slots(self):
+        admission = Admission(self.path, 2, 0, 1.0)
+        first = admission.acquire()
+        second = admission.acquire()
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        # Every slot is taken and there is no queue, turned away without waiting
+        start = time.monotonic()
+        self.assertIsNone(Admission(self.path, 2, 0, 1.0).acquire())
+        self.assertLess(time.monotonic() - start, 0.5)
+
+        admission.release(first)
+        third = admission.acquire()
+        self.assertIsNotNone(third)
+        admission.release(second)
+        admission.release(third)
+        self.assertEqual({'admitted': 3, 'queued': 0, 'rejected': 0}, admission.get_stats())
+        self.assertEqual(['slot-0.lock', 'slot-1.lock'], sorted(os.listdir(self.path)))
+
+    def test_queue(self):
+        admission = Admission(self.path, 1, 1, 2.0)
+        slot = admission.acquire()
+        results = []
+        waiting = threading.Thread(target=lambda: results.append(admission.acquire()))
+        waiting.start()
+        time.sleep(0.1)
+
+        # The only place in the queue is taken too
+        self.assertIsNone(admission.acquire())
+        admission.release(slot)
+        waiting.join()
+        self.assertIsNotNone(results[0])
+        admission.release(results[0])
+
+        # Gives up once it has waited long enough
+        slot = admission.acquire()
+        admission.wait = 0.1
+        self.assertIsNone(admission.acquire())
+        admission.release(slot)
+        self.assertEqual({'admitted': 3, 'queued': 2, 'rejected': 2}, admission.get_stats())
+
+    def test_unavailable(self):
+        admission = Admission(os.path.join(self.path, 'removed'), 1, 0, 1.0)
+        # Lock files cannot be created, requests are let through rather than failing
+        slot = admission.acquire()
+        self.assertEqual(Admission.UNLIMITED, slot)
+        admission.release(slot)
+        self.assertEqual({'admitted': 1, 'queued': 0, 'rejected': 0}, admission.get_stats())
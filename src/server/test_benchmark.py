@@ -0,0 +1,92 @@
+import builtins
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from benchmark import Corpus, SlowFilesystem, time_imports, time_script
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_corpus(self):
+        corpus = Corpus(self.tmp, documents=20, body_size=500, front_matter='complex', topics=3)
+        corpus.generate({'index': {'enabled': 'true'}})
+        self.assertEqual(7, len(os.listdir(os.path.join(self.tmp, 'posts', 'topic-0'))))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'pages', 'page-0.md')))
+        self.assertTrue(os.path.exists(os.path.join(self.tmp, 'cgi-bin', 'crawler.py')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmp, 'cgi-bin', 'test_benchmark.py')))
+        with open(os.path.join(self.tmp, 'cgi-bin', 'config.ini')) as fp:
+            self.assertIn('[index]\nenabled = true\n', fp.read())
+
+        # The same shape and seed always produces the same site
+        with open(os.path.join(self.tmp, 'posts', 'topic-1', 'post-4.md')) as fp:
+            original = fp.read()
+        shutil.rmtree(os.path.join(self.tmp, 'posts'))
+        os.unlink(os.path.join(self.tmp, '.corpus.json'))
+        corpus.generate({})
+        with open(os.path.join(self.tmp, 'posts', 'topic-1', 'post-4.md')) as fp:
+            self.assertEqual(original, fp.read())
+
+        result = time_script(corpus, 'meta.py', 'type=posts', 1)
+        self.assertEqual('cold', result['mode'])
+        self.assertGreater(result['peak_memory'], 0)
+
+    def test_script_errors(self):
+        corpus = Corpus(self.tmp)
+        os.makedirs(os.path.join(self.tmp, 'cgi-bin'))
+        with open(os.path.join(self.tmp, 'cgi-bin', 'noisy.py'), 'w') as fp:
+            # More than a pipe can hold before the script exits
+            fp.write('import sys\nsys.stderr.write("x" * 1000000 + "done")\nsys.exit(1)\n')
+
+        with self.assertRaisesRegex(RuntimeError, 'noisy.py\\?page=1 failed: x+done'):
+            time_script(corpus, 'noisy.py', 'page=1', 1)
+
+    def test_slow_filesystem(self):
+        with open(os.path.join(self.tmp, 'a.md'), 'w') as fp:
+            fp.write('# Test')
+        originals = (os.scandir, os.stat, builtins.open)
+
+        with SlowFilesystem(0.01):
+            start = time.perf_counter()
+            with os.scandir(self.tmp) as it:
+                entries = list(it)
+            self.assertEqual(['a.md'], [entry.name for entry in entries])
+            self.assertFalse(entries[0].is_dir())
+            self.assertEqual(os.path.getsize(os.path.join(self.tmp, 'a.md')), entries[0].stat().st_size)
+            with open(entries[0].path) as fp:
+                self.assertEqual('# Test', fp.read())
+            # Listing, stat'ing and opening, (getsize stats too)
+            self.assertGreaterEqual(time.perf_counter() - start, 0.04)
+
+        self.assertEqual(originals, (os.scandir, os.stat, builtins.open))
+
+    def test_imports(self):
+        corpus = Corpus(self.tmp, documents=20, body_size=500, front_matter='simple', topics=0)
+        corpus.generate({'index': {'enabled': 'true'}, 'cache': {'render_path': '.cache', 'page_path': '.pages'}})
+        # First request fills the index
+        time_script(corpus, 'meta.py', '', 1)
+
+        for script, query in (('meta.py', ''), ('sitemap.py', ''), ('crawler.py', 'page=/missing.html')):
+            imports = time_imports(corpus, script, query)
+            self.assertGreater(imports['total'], 0)
+            for module in ('markdown', 'bs4', 'frontmatter', 'yaml', 'searchindex'):
+                self.assertNotIn(module, imports['loaded'], script + ' should not import ' + module)
+            if script != 'crawler.py':
+                # Only rendering pages needs these
+                for module in ('admission', 'pagecache'):
+                    self.assertNotIn(module, imports['loaded'], script + ' should not import ' + module)
+
+        imports = time_imports(corpus, 'crawler.py', 'page=/posts/post-0.html')
+        self.assertIn('markdown', imports['loaded'])
+
+        # Served from the page cache the second time
+        imports = time_imports(corpus, 'crawler.py', 'page=/posts/post-0.html')
+        for module in ('markdown', 'bs4', 'frontmatter', 'yaml'):
+            self.assertNotIn(module, imports['loaded'], 'cached page should not import ' + module)
@@ -0,0 +1,99 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import admission
+import handlers
+from build import Builder
+from siteconfig import get_config_for_tests
+
+# Override some of the config settings for the test environment
+config = get_config_for_tests()
+config.path_config = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/config.ini')
+config.path_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets')
+config.load()
+
+
+class TestBuilder(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def test_build(self):
+        stats = Builder(self.output, 2).build()
+        self.assertGreater(stats['rendered'], 0)
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'tests/good_file.html')))
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'tests.html')))
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'sitemap.xml')))
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'meta.json')))
+        # Drafts are never exported
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'tests/draft_file.html')))
+
+        with open(os.path.join(self.output, 'tests/good_file.html')) as fp:
+            self.assertIn('<h1>Testing Bug Features</h1>', fp.read())
+
+        # Nothing changed, so nothing should be rendered the second time around
+        stats = Builder(self.output, 2).build()
+        self.assertEqual(0, stats['rendered'])
+
+    def test_build_into_root(self):
+        with self.assertRaises(ValueError):
+            Builder(config.path_root)
+
+    def test_build_sitemaps_and_names(self):
+        root = tempfile.mkdtemp()
+        orig_root = config.path_root
+        try:
+            shutil.copytree(os.path.join(orig_root, 'tests'), os.path.join(root, 'tests'))
+            shutil.copy(os.path.join(orig_root, 'index.html'), root)
+            shutil.copy(os.path.join(root, 'tests', 'good_file.md'), os.path.join(root, 'tests', 'a.md-notes.md'))
+            # Six published files and no drafts, (seven URLs with the listing page)
+            os.remove(os.path.join(root, 'tests', 'draft_file.md'))
+            os.remove(os.path.join(root, 'tests', 'auto_excerpt.md'))
+            config.path_root = root
+            handlers.SITEMAP_LIMIT = 3
+            builder = Builder(self.output, 1)
+            builder.build()
+        finally:
+            handlers.SITEMAP_LIMIT = 50000
+            config.path_root = orig_root
+            shutil.rmtree(root)
+
+        self.assertEqual([], builder.failed)
+        # Only the extension is swapped, everywhere the page is linked from too
+        with open(os.path.join(self.output, 'tests/a.md-notes.html')) as fp:
+            self.assertIn('https://markdownmaster.test/tests/a.md-notes.html', fp.read())
+        with open(os.path.join(self.output, 'tests.html')) as fp:
+            self.assertIn('https://markdownmaster.test/tests/a.md-notes.html', fp.read())
+
+        # Every child sitemap the index links to is written, and no others
+        with open(os.path.join(self.output, 'sitemap.xml')) as fp:
+            linked = sorted(re.findall(r'(sitemap-tests-[0-9]+\.xml)</loc>', fp.read()))
+        sitemaps = sorted(f for f in os.listdir(self.output) if f.startswith('sitemap-'))
+        self.assertEqual(['sitemap-tests-1.xml', 'sitemap-tests-2.xml', 'sitemap-tests-3.xml'], linked)
+        self.assertEqual(linked, sitemaps)
+
+    def test_build_ignores_admission(self):
+        admission_dir = tempfile.mkdtemp()
+        path_admission = config.path_admission
+        try:
+            # Live traffic holding the only render slot
+            config.admission_slots = 1
+            config.path_admission = admission_dir
+            slot = admission.get_admission().acquire()
+            builder = Builder(self.output, 2)
+            stats = builder.build()
+            admission.get_admission().release(slot)
+        finally:
+            config.admission_slots = 0
+            config.path_admission = path_admission
+            admission._admission = None
+            shutil.rmtree(admission_dir)
+
+        self.assertEqual(0, stats['failed'])
+        self.assertEqual([], builder.failed)
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'tests/good_file.html')))
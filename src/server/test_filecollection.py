@@ -1,6 +1,9 @@
 from unittest import TestCase
 import os
+import shutil
+import tempfile
 
+import filecollection
 from filecollection import FileCollection
 from markdownloader import MarkdownLoader
 from siteconfig import get_config_for_tests
@@ -30,3 +33,166 @@ class TestFileCollection(TestCase):
 
         file = collection.get_by_path('/invalid/file.md')
         self.assertIsNone(file)
+
+    def test_parallel_loading(self):
+        sequential = FileCollection('tests')
+        for mode in ('process', 'thread'):
+            config.workers = 2
+            config.worker_mode = mode
+            filecollection._executor = None
+            try:
+                parallel = FileCollection('tests')
+            finally:
+                filecollection._get_executor().shutdown()
+                filecollection._executor = None
+                config.workers = 0
+
+            self.assertEqual([f.path for f in sequential.files], [f.path for f in parallel.files])
+            self.assertEqual([f.get_metas() for f in sequential.files], [f.get_metas() for f in parallel.files])
+
+    def test_load_all(self):
+        collections = FileCollection.load_all(['tests', 'doesnotexist'])
+        self.assertEqual(['tests', 'doesnotexist'], list(collections.keys()))
+        self.assertIsInstance(collections['tests'], FileCollection)
+        self.assertIsNone(collections['doesnotexist'])
+
+    def test_reuse_scan(self):
+        scans = {}
+        sources = FileCollection.get_sources('tests', scans)
+        self.assertEqual(['tests'], list(scans.keys()))
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Collection was scanned again')
+
+        original = FileCollection.__dict__['_scan']
+        FileCollection._scan = staticmethod(fail)
+        try:
+            collections = FileCollection.load_all(['tests'], scans)
+        finally:
+            FileCollection._scan = original
+
+        self.assertEqual(len(sources), len(collections['tests'].files))
+        self.assertEqual([f.path for f in FileCollection('tests').files], [f.path for f in collections['tests'].files])
+
+    def test_indexes(self):
+        collection = FileCollection('tests')
+        self.assertEqual(
+            ['/tests/good_file.md', '/tests/good_file_no_date.md'], [f.path for f in collection.by_tag('test')]
+        )
+        self.assertEqual(
+            ['/tests/good_file.md', '/tests/good_file_no_date.md'], [f.path for f in collection.by_author('ALICE')]
+        )
+        self.assertEqual([], collection.by_tag('nope'))
+        self.assertEqual(['/tests/draft_file.md'], [f.path for f in collection.get_drafts()])
+
+        published = collection.published_sorted()
+        self.assertEqual(len(collection.files) - 1, len(published))
+        dates = [f.get_meta(['date']) for f in published]
+        self.assertEqual(sorted(dates, reverse=True), dates)
+        self.assertEqual(published[1:3], collection.published_sorted(limit=2, offset=1))
+
+        self.assertEqual(
+            ['/tests/dates_are_difficult.md', '/tests/good_file.md', '/tests/topic/2023-03-14-test.md'],
+            [f.path for f in collection.by_date('2023-03-01', '2023-04-30')]
+        )
+        self.assertEqual(
+            ['/tests/good_file.md', '/tests/topic/2023-03-14-test.md'],
+            [f.path for f in collection.by_date('2023-03', '2023-03')]
+        )
+
+    def test_scan(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for path in ['a.md', 'b.txt', 'one/b.md', 'one/two/c.md', 'one/two/three/d.md',
+                         '_drafts/e.md', 'one/f (conflicted copy).md', 'one/g.md']:
+                os.makedirs(os.path.dirname(os.path.join(tmp, path)), exist_ok=True)
+                with open(os.path.join(tmp, path), 'w') as fp:
+                    fp.write('# Test')
+            # Points back up the tree, must not be followed forever
+            os.symlink(tmp, os.path.join(tmp, 'one', 'two', 'loop'))
+            os.symlink(os.path.join(tmp, 'missing.md'), os.path.join(tmp, 'broken.md'))
+
+            def scan():
+                return [path[len(tmp):] for path, stat in FileCollection._scan(tmp)]
+
+            self.assertEqual(['/_drafts/e.md', '/a.md', '/one/b.md', '/one/f (conflicted copy).md', '/one/g.md'], scan())
+
+            config.scan_depth = 0
+            self.assertEqual(['/a.md'], scan())
+
+            config.scan_depth = 10
+            config.scan_ignore = ('_drafts', '*(conflicted copy*')
+            self.assertEqual(['/a.md', '/one/b.md', '/one/g.md', '/one/two/c.md', '/one/two/three/d.md'], scan())
+
+            directories = []
+            files = FileCollection._scan(tmp, directories)
+            self.assertEqual(
+                [tmp, tmp + '/one', tmp + '/one/two', tmp + '/one/two/three'],
+                directories
+            )
+            self.assertEqual(os.stat(os.path.join(tmp, 'a.md')).st_mtime_ns, files[0][1].st_mtime_ns)
+        finally:
+            config.scan_depth = 1
+            config.scan_ignore = ()
+            shutil.rmtree(tmp)
+
+    def test_io_threads(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for path in ['a.md', 'z/b.md', 'one/b.md', 'one/two/c.md', 'one/two/three/d.md', 'one-two.md', 'one/g.md']:
+                os.makedirs(os.path.dirname(os.path.join(tmp, path)), exist_ok=True)
+                with open(os.path.join(tmp, path), 'w') as fp:
+                    fp.write('# Test')
+            os.symlink(tmp, os.path.join(tmp, 'one', 'two', 'loop'))
+            os.symlink(os.path.join(tmp, 'one'), os.path.join(tmp, 'z', 'also-one'))
+            os.symlink(os.path.join(tmp, 'missing.md'), os.path.join(tmp, 'broken.md'))
+
+            config.scan_depth = 10
+            sequential_directories = []
+            sequential = FileCollection._scan(tmp, sequential_directories)
+            sequential_collection = FileCollection('tests')
+
+            config.io_threads = 4
+            concurrent_directories = []
+            concurrent = FileCollection._scan(tmp, concurrent_directories)
+            concurrent_collection = FileCollection('tests')
+        finally:
+            if filecollection._io_executor is not None:
+                filecollection._io_executor.shutdown()
+            filecollection._io_executor = None
+            config.io_threads = 0
+            config.scan_depth = 1
+            shutil.rmtree(tmp)
+
+        # The same files in the same order, (the symlinked directory is only scanned once either way)
+        self.assertEqual([path for path, stat in sequential], [path for path, stat in concurrent])
+        self.assertEqual(sequential_directories, concurrent_directories)
+        self.assertEqual([s.st_ino for p, s in sequential], [s.st_ino for p, s in concurrent])
+        self.assertEqual([f.path for f in sequential_collection.files], [f.path for f in concurrent_collection.files])
+        self.assertEqual(
+            [f.get_metas() for f in sequential_collection.files], [f.get_metas() for f in concurrent_collection.files]
+        )
+
+    def test_keep_warm(self):
+        tmp = tempfile.mkdtemp()
+        orig_root = config.path_root
+        try:
+            shutil.copytree(os.path.join(orig_root, 'tests'), os.path.join(tmp, 'tests'))
+            config.path_root = tmp
+            FileCollection.keep_warm = True
+            collection = FileCollection('tests')
+            file = collection.get_by_path('/tests/good_file.md')
+            self.assertIn('Zebras', str(file))
+            # Rendered files kept between requests do not hold on to their body
+            self.assertEqual('', file.post.content)
+            self.assertIs(file, FileCollection('tests').get_by_path('/tests/good_file.md'))
+
+            os.remove(os.path.join(tmp, 'tests', 'good_file.md'))
+            FileCollection('tests')
+            self.assertNotIn(os.path.join(tmp, 'tests', 'good_file.md'), FileCollection._loaders)
+            self.assertIn(os.path.join(tmp, 'tests', 'draft_file.md'), FileCollection._loaders)
+        finally:
+            FileCollection.keep_warm = False
+            FileCollection._loaders = {}
+            config.path_root = orig_root
+            shutil.rmtree(tmp)
@@ -0,0 +1,394 @@
+import gzip
+import json
+import re
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+import admission
+import handlers
+import pagecache
+import searchindex
+from simplesite import SimpleSite
+from siteconfig import get_config_for_tests
+
+# Override some of the config settings for the test environment
+config = get_config_for_tests()
+config.path_config = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/config.ini')
+config.path_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets')
+config.load()
+
+
+class TestHandlers(unittest.TestCase):
+    def test_crawler_redirect(self):
+        response = SimpleSite.handle(handlers.crawler, {})
+        self.assertEqual(301, response.code)
+        self.assertEqual('https://markdownmaster.test/tests/good_file.html', response.headers['Location'])
+
+    def test_crawler_page(self):
+        response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests/good_file.html'})
+        self.assertEqual(200, response.code)
+        self.assertEqual(SimpleSite.TYPE_HTML, response.type)
+        self.assertIn('<div id="cms"><h1>Testing Bug Features</h1><h1>Test Page</h1>', response.body)
+
+    def test_crawler_listing(self):
+        response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests.html'})
+        self.assertEqual(200, response.code)
+        self.assertIn('<h1>Listing of tests</h1>', response.body)
+        self.assertIn('https://markdownmaster.test/tests/good_file.html', response.body)
+        self.assertNotIn('https://markdownmaster.test/tests/draft_file.html', response.body)
+
+    def test_crawler_page_cache(self):
+        tmp = tempfile.mkdtemp()
+        loader = handlers.MarkdownLoader
+        try:
+            config.path_page_cache = tmp
+            for query in ('page=/tests/good_file.html', 'page=/tests.html&tag=document'):
+                first = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': query})
+                # Nothing should be parsed when the page is served from the cache
+                handlers.MarkdownLoader = None
+                second = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': query})
+                handlers.MarkdownLoader = loader
+                self.assertEqual(200, second.code)
+                self.assertEqual(first.get_body(), second.get_body())
+                self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+            self.assertEqual({'hits': 2, 'misses': 2}, pagecache.get_page_cache().get_stats())
+        finally:
+            handlers.MarkdownLoader = loader
+            config.path_page_cache = None
+            pagecache._cache = None
+            shutil.rmtree(tmp)
+
+    def test_crawler_admission(self):
+        tmp = tempfile.mkdtemp()
+        path_admission = config.path_admission
+        try:
+            first = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests/good_file.html'})
+            config.admission_slots = 1
+            config.path_admission = tmp
+            config.path_page_cache = os.path.join(tmp, 'pages')
+            slot = admission.get_admission().acquire()
+
+            # Every slot is busy rendering
+            for query in ('page=/tests/good_file.html', 'page=/tests.html'):
+                response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': query})
+                self.assertEqual(503, response.code)
+                self.assertEqual('5', response.headers['Retry-After'])
+                self.assertNotIn('ETag', response.headers)
+
+            # Nothing needs rendering for clients with the current version or pages already cached
+            response = SimpleSite.handle(handlers.crawler, {
+                'QUERY_STRING': 'page=/tests/good_file.html', 'HTTP_IF_NONE_MATCH': first.headers['ETag']
+            })
+            self.assertEqual(304, response.code)
+            pagecache.get_page_cache().set('tests/good_file', first.headers['ETag'], first.get_body())
+            response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests/good_file.html'})
+            self.assertEqual(200, response.code)
+
+            admission.get_admission().release(slot)
+            response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests.html'})
+            self.assertEqual(200, response.code)
+            self.assertEqual({'admitted': 2, 'queued': 0, 'rejected': 2}, admission.get_admission().get_stats())
+        finally:
+            config.admission_slots = 0
+            config.path_admission = path_admission
+            config.path_page_cache = None
+            admission._admission = None
+            pagecache._cache = None
+            shutil.rmtree(tmp)
+
+    def test_crawler_tag_listing(self):
+        for query in ('page=/tests.html&tag=document', 'page=/tests.html?tag=document'):
+            response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': query})
+            self.assertEqual(200, response.code)
+            self.assertIn('<h1>Listing of tests tagged document</h1>', response.body)
+            self.assertIn('https://markdownmaster.test/tests/good_file.html', response.body)
+            self.assertNotIn('https://markdownmaster.test/tests/dates_are_difficult.html', response.body)
+            self.assertIn('<link href="https://markdownmaster.test/tests.html?tag=document" rel="canonical"/>', response.body)
+
+        response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests.html&author=alice'})
+        self.assertIn('<h1>Listing of tests by alice</h1>', response.body)
+        self.assertIn('https://markdownmaster.test/tests/good_file_no_date.html', response.body)
+
+    def test_crawler_listing_pages(self):
+        config.listing_page_size = 2
+        try:
+            response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests.html'})
+            self.assertIn('<link href="https://markdownmaster.test/tests.html" rel="canonical"/>', response.body)
+            self.assertIn('<link href="https://markdownmaster.test/tests.html?page=2" rel="next"/>', response.body)
+            self.assertNotIn('rel="prev"', response.body)
+            self.assertEqual(2, response.body.count('<article>'))
+
+            for query in ('page=/tests.html&page=3', 'page=/tests.html?page=3', 'page=/tests/page/3.html'):
+                response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': query})
+                self.assertEqual(200, response.code)
+                self.assertIn('<link href="https://markdownmaster.test/tests.html?page=2" rel="prev"/>', response.body)
+                self.assertNotIn('rel="next"', response.body)
+                # Oldest files are on the last page, newest first
+                good_file = response.body.index('https://markdownmaster.test/tests/good_file.html')
+                dated = response.body.index('https://markdownmaster.test/tests/topic/2023-03-14-test.html')
+                self.assertLess(good_file, dated)
+
+            for query in ('page=/tests.html&page=4', 'page=/tests.html&page=0', 'page=/tests.html&page=x'):
+                self.assertEqual(404, SimpleSite.handle(handlers.crawler, {'QUERY_STRING': query}).code)
+        finally:
+            config.listing_page_size = 50
+
+    def test_crawler_not_found(self):
+        response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests/nope.html'})
+        self.assertEqual(404, response.code)
+
+    def test_meta(self):
+        response = SimpleSite.handle(handlers.meta, {})
+        self.assertEqual(SimpleSite.TYPE_JSON, response.type)
+        self.assertTrue(response.is_stream())
+        payload = json.loads(response.get_body())
+        paths = [file['path'] for file in payload['tests']]
+        self.assertIn('/tests/good_file.md', paths)
+        self.assertIn('/tests/draft_file.md', paths)
+        # Versions and changes need the metadata index
+        self.assertNotIn('X-Meta-Version', response.headers)
+        self.assertEqual(404, SimpleSite.handle(handlers.meta, {'QUERY_STRING': 'since=abc.1'}).code)
+
+    def test_meta_filters(self):
+        query = 'type=tests&fields=title,date&drafts=0'
+        response = SimpleSite.handle(handlers.meta, {'QUERY_STRING': query})
+        payload = json.loads(response.get_body())
+        self.assertEqual(['tests'], list(payload.keys()))
+        files = {file['path']: file for file in payload['tests']}
+        self.assertNotIn('/tests/draft_file.md', files)
+        self.assertEqual(
+            {'title': 'Testing Bug Features', 'date': '2023-03-14'}, files['/tests/good_file.md']['meta']
+        )
+        self.assertEqual('https://markdownmaster.test/tests/good_file.html', files['/tests/good_file.md']['url'])
+
+        # Filtered documents are validated separately from the full document
+        self.assertNotEqual(
+            SimpleSite.handle(handlers.meta, {}).headers['ETag'], response.headers['ETag']
+        )
+
+        response = SimpleSite.handle(handlers.meta, {'QUERY_STRING': 'type=nonexistent'})
+        self.assertEqual(404, response.code)
+
+    def test_search(self):
+        response = SimpleSite.handle(handlers.search, {'QUERY_STRING': 'q=zebras'})
+        self.assertEqual(404, response.code)
+
+        tmp = tempfile.mkdtemp()
+        try:
+            config.search = True
+            config.path_search_index = os.path.join(tmp, '.searchindex.sqlite')
+            response = SimpleSite.handle(handlers.search, {'QUERY_STRING': 'q=zebras&fields=title&limit=1'})
+            self.assertEqual(200, response.code)
+            self.assertEqual(SimpleSite.TYPE_JSON, response.type)
+            payload = json.loads(response.get_body())
+            self.assertEqual('zebras', payload['query'])
+            self.assertEqual(2, payload['total'])
+            self.assertEqual(2, payload['pages'])
+            self.assertEqual(1, len(payload['results']))
+            self.assertEqual('https://markdownmaster.test/tests/good_file.html', payload['results'][0]['url'])
+            self.assertEqual({'title': 'Testing Bug Features'}, payload['results'][0]['meta'])
+
+            response = SimpleSite.handle(handlers.search, {
+                'QUERY_STRING': 'q=zebras&fields=title&limit=1', 'HTTP_IF_NONE_MATCH': response.headers['ETag']
+            })
+            self.assertEqual(304, response.code)
+
+            response = SimpleSite.handle(handlers.search, {'QUERY_STRING': 'q=zebras&page=2&limit=1'})
+            self.assertEqual('/tests/good_file_no_date.md', json.loads(response.get_body())['results'][0]['path'])
+
+            response = SimpleSite.handle(handlers.search, {'QUERY_STRING': 'q=zebras&page=x'})
+            self.assertEqual(400, response.code)
+        finally:
+            config.search = False
+            if searchindex._index is not None:
+                searchindex._index.close()
+            searchindex._index = None
+            shutil.rmtree(tmp)
+
+    def test_sitemap(self):
+        response = SimpleSite.handle(handlers.sitemap, {})
+        self.assertEqual(SimpleSite.TYPE_XML, response.type)
+        self.assertTrue(response.is_stream())
+        body = response.get_body().decode('utf-8')
+        self.assertIn('<urlset', body)
+        self.assertIn(
+            '<loc>https://markdownmaster.test/tests/good_file.html</loc>\n\t\t<lastmod>2023-03-14</lastmod>', body
+        )
+        self.assertNotIn('draft_file', body)
+
+    def test_sitemap_entries(self):
+        collection = handlers.FileCollection('tests')
+        # Generated one at a time rather than listed up front
+        self.assertIsInstance(handlers._get_sitemap_entries(collection), types.GeneratorType)
+
+        entries = list(handlers._get_sitemap_entries(collection))
+        self.assertEqual(len(collection.published_sorted()) + 1, len(entries))
+        # The listing page comes last, as recent as its most recent file
+        latest = max(lastmod for url, lastmod in entries[:-1])
+        self.assertEqual(('https://markdownmaster.test/tests.html', latest), entries[-1])
+
+    def test_sitemap_index(self):
+        limit = handlers.SITEMAP_LIMIT
+        handlers.SITEMAP_LIMIT = 3
+        try:
+            body = SimpleSite.handle(handlers.sitemap, {}).get_body().decode('utf-8')
+            self.assertIn('<sitemapindex', body)
+            self.assertIn('<loc>https://markdownmaster.test/sitemap-tests-1.xml</loc>', body)
+            self.assertIn('<loc>https://markdownmaster.test/sitemap-tests-2.xml</loc>', body)
+
+            urls = []
+            for page in range(1, 4):
+                response = SimpleSite.handle(handlers.sitemap, {'QUERY_STRING': 'type=tests&page=%d' % page})
+                body = response.get_body().decode('utf-8')
+                self.assertIn('<urlset', body)
+                urls += re.findall('<loc>(.*?)</loc>', body)
+
+            self.assertIn('https://markdownmaster.test/tests.html', urls)
+            self.assertIn('https://markdownmaster.test/tests/good_file.html', urls)
+            self.assertEqual(len(urls), len(set(urls)))
+
+            response = SimpleSite.handle(handlers.sitemap, {'QUERY_STRING': 'type=tests&page=10'})
+            self.assertEqual(404, response.code)
+        finally:
+            handlers.SITEMAP_LIMIT = limit
+
+    def test_conditional(self):
+        for handler, environ in [
+            (handlers.crawler, {'QUERY_STRING': 'page=/tests/good_file.html'}),
+            (handlers.crawler, {'QUERY_STRING': 'page=/tests.html'}),
+            (handlers.meta, {}),
+            (handlers.sitemap, {}),
+        ]:
+            response = SimpleSite.handle(handler, environ)
+            self.assertEqual(200, response.code)
+            etag = response.headers['ETag']
+            last_modified = response.headers['Last-Modified']
+
+            response = SimpleSite.handle(handler, dict(environ, HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(304, response.code)
+            self.assertEqual('', response.body)
+            self.assertEqual(etag, response.headers['ETag'])
+
+            response = SimpleSite.handle(handler, dict(environ, HTTP_IF_MODIFIED_SINCE=last_modified))
+            self.assertEqual(304, response.code)
+
+            response = SimpleSite.handle(handler, dict(environ, HTTP_IF_NONE_MATCH='"outdated"'))
+            self.assertEqual(200, response.code)
+
+    def test_server_timing(self):
+        response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests/good_file.html'})
+        self.assertRegex(response.headers['Server-Timing'], r'(^|, )markdown;dur=[0-9.]+')
+        self.assertRegex(response.headers['Server-Timing'], r'(^|, )template;dur=[0-9.]+')
+        self.assertRegex(response.headers['Server-Timing'], r', total;dur=[0-9.]+$')
+
+        response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests.html'})
+        self.assertRegex(response.headers['Server-Timing'], r'(^|, )scan;dur=[0-9.]+')
+
+        config.debug = False
+        try:
+            response = SimpleSite.handle(handlers.crawler, {'QUERY_STRING': 'page=/tests.html'})
+            self.assertNotIn('Server-Timing', response.headers)
+        finally:
+            config.debug = True
+
+    def test_timing_log(self):
+        fd, log = tempfile.mkstemp()
+        os.close(fd)
+        config.path_timing_log = log
+        try:
+            environ = {'PATH_INFO': '/cgi-bin/crawler.py', 'QUERY_STRING': 'page=/tests.html'}
+            SimpleSite.wsgi(handlers.crawler, environ, lambda status, headers: None)
+            b''.join(SimpleSite.wsgi(handlers.sitemap, {'PATH_INFO': '/sitemap.xml'}, lambda status, headers: None))
+
+            # Requests quicker than the threshold are not logged
+            config.timing_slow = 60
+            SimpleSite.wsgi(handlers.crawler, environ, lambda status, headers: None)
+
+            with open(log) as fp:
+                entries = [json.loads(line) for line in fp]
+            self.assertEqual(2, len(entries))
+            self.assertEqual('/cgi-bin/crawler.py?page=/tests.html', entries[0]['request'])
+            self.assertEqual(200, entries[0]['code'])
+            self.assertIn('scan', entries[0]['spans'])
+            # Streamed responses are logged once the body has been sent
+            self.assertEqual('/sitemap.xml', entries[1]['request'])
+            self.assertGreaterEqual(entries[1]['total'], entries[1]['spans']['scan'])
+        finally:
+            config.path_timing_log = None
+            config.timing_slow = 0.0
+            os.unlink(log)
+
+    def test_compression(self):
+        response = SimpleSite.handle(handlers.meta, {'HTTP_ACCEPT_ENCODING': 'gzip, deflate'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertTrue(response.headers['ETag'].endswith('-gzip"'))
+        payload = json.loads(gzip.decompress(response.get_body()))
+        self.assertIn('tests', payload)
+
+        # The compressed ETag is still accepted as a validator
+        etag = response.headers['ETag']
+        environ = {'HTTP_ACCEPT_ENCODING': 'gzip', 'HTTP_IF_NONE_MATCH': etag}
+        not_modified = SimpleSite.handle(handlers.meta, environ)
+        self.assertEqual(304, not_modified.code)
+        # With the same headers the full response would have had
+        self.assertEqual(etag, not_modified.headers['ETag'])
+        self.assertEqual('Accept-Encoding', not_modified.headers['Vary'])
+
+        environ = {'HTTP_ACCEPT_ENCODING': 'gzip', 'HTTP_IF_MODIFIED_SINCE': response.headers['Last-Modified']}
+        self.assertEqual(etag, SimpleSite.handle(handlers.meta, environ).headers['ETag'])
+
+        # Not modified responses have no body, so no length either
+        sent = []
+        body = SimpleSite.wsgi(
+            handlers.meta, dict(environ, HTTP_IF_NONE_MATCH=etag), lambda status, headers: sent.append(headers)
+        )
+        self.assertEqual(b'', b''.join(body))
+        self.assertNotIn('Content-Length', [name for name, value in sent[0]])
+
+        # Encodings refused by the client are not used
+        response = SimpleSite.handle(handlers.meta, {'HTTP_ACCEPT_ENCODING': 'gzip;q=0, identity'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+
+    def test_compressed_cache(self):
+        tmp = tempfile.mkdtemp()
+        render_cache = config.path_render_cache
+        config.path_render_cache = tmp
+        entries = SimpleSite.COMPRESS_CACHE_ENTRIES
+        SimpleSite.COMPRESS_CACHE_ENTRIES = 2
+        try:
+            path = os.path.join(tmp, 'compressed')
+            os.makedirs(path)
+            # Leftover from a write in progress, not counted as an entry
+            with open(os.path.join(path, '.tmp-pending'), 'wb') as fp:
+                fp.write(b'')
+            for key in ('a', 'b', 'c'):
+                SimpleSite._write_compressed(key, b'compressed')
+            self.assertEqual(['.tmp-pending', 'b', 'c'], sorted(os.listdir(path)))
+
+            # A failed write does not leave its temporary file behind
+            original = os.replace
+
+            def fail(*args, **kwargs):
+                raise OSError('Disk full')
+
+            os.replace = fail
+            try:
+                SimpleSite._write_compressed('d', b'compressed')
+            finally:
+                os.replace = original
+            self.assertEqual(['.tmp-pending', 'c'], sorted(os.listdir(path)))
+        finally:
+            SimpleSite.COMPRESS_CACHE_ENTRIES = entries
+            SimpleSite._compressed.clear()
+            config.path_render_cache = render_cache
+            shutil.rmtree(tmp)
+
+    def test_sitemap_compression(self):
+        response = SimpleSite.handle(handlers.sitemap, {'HTTP_ACCEPT_ENCODING': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertIn(b'</urlset>', gzip.decompress(response.get_body()))
@@ -1,7 +1,10 @@
+import glob
 import os
 import unittest
 
-from markdownloader import MarkdownLoader
+import frontmatter
+
+from markdownloader import MarkdownLoader, _get_excerpt, _load_post
 from siteconfig import get_config_for_tests
 
 # Override some of the config settings for the test environment
@@ -25,6 +28,28 @@ class TestMarkdownLoader(unittest.TestCase):
         self.assertEqual('https://markdownmaster.test/tests/good_file.html', md.url)
         self.assertEqual('/tests', md.dir)
 
+    def test_excerpt_length(self):
+        """
+        Test automatic excerpts are cut at the last full word within the maximum length
+        """
+        text = 'The quick brown fox [jumps](/over) the *lazy* dog.\nSecond line\n\nNext paragraph'
+        self.assertEqual('The quick brown fox jumps the lazy dog. Second line', _get_excerpt(text))
+        self.assertEqual('The quick brown…', _get_excerpt(text, 18))
+        self.assertEqual('The quick brown…', _get_excerpt(text, 16))
+        self.assertEqual('The quick…', _get_excerpt(text, 15))
+        # The ellipsis counts towards the maximum length
+        self.assertEqual('Suppercalifragi…', _get_excerpt('Suppercalifragilistic', 16))
+        for length in range(1, 60):
+            self.assertLessEqual(len(_get_excerpt(text, length)), length)
+        self.assertEqual('Short', _get_excerpt('Short', 16))
+
+        try:
+            config.excerpt_length = 40
+            excerpt = _get_file('auto_excerpt.md').get_meta(['excerpt'])
+            self.assertEqual('This sentence should come through as…', excerpt)
+        finally:
+            config.excerpt_length = 0
+
     def test_init_with_date(self):
         """
         Test for a Date object to be converted to a date string
@@ -68,3 +93,50 @@ class TestMarkdownLoader(unittest.TestCase):
         metas = md.get_metas()
         self.assertEqual('2023-03-14', metas['date'])
         self.assertEqual('Alice', metas['author'])
+
+    def test_lazy(self):
+        """
+        Test lazily loaded files are identical to fully loaded files
+        """
+        for filename in ['good_file.md', 'good_file_no_date.md', 'auto_excerpt.md', 'dates_are_difficult.md',
+                         'draft_file.md', 'topic/2023-03-14-test.md', 'topic/some_sub_file.md']:
+            md = _get_file(filename)
+            template_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/tests/', filename)
+            lazy = MarkdownLoader(template_file, lazy=True)
+            self.assertEqual(md.get_metas(), lazy.get_metas(), filename)
+            self.assertEqual(str(md), str(lazy), filename)
+
+    def test_lazy_excerpt(self):
+        """
+        Test the body of a lazily loaded file is not read until the excerpt is requested
+        """
+        template_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/tests/auto_excerpt.md')
+        md = MarkdownLoader(template_file, lazy=True)
+        self.assertEqual('', md.post.content)
+        self.assertFalse(md.get_meta(['draft']))
+        self.assertTrue(md._excerpt_pending)
+        self.assertTrue(md.get_meta(['excerpt']).startswith('This sentence should come through'))
+        self.assertFalse(md._content_loaded)
+
+    def test_libyaml_parity(self):
+        """
+        Test front matter is parsed identically to python-frontmatter, with and without LibYAML
+        """
+        base = os.path.dirname(os.path.realpath(__file__))
+        files = glob.glob(os.path.join(base, '../../examples/**/*.md'), recursive=True)
+        files += glob.glob(os.path.join(base, '../../test/assets/**/*.md'), recursive=True)
+        self.assertGreater(len(files), 20)
+
+        try:
+            for filename in files:
+                expected = frontmatter.load(filename)
+                results = []
+                for libyaml in (True, False):
+                    config.libyaml = libyaml
+                    post = _load_post(filename)
+                    self.assertEqual(expected.metadata, post.metadata, filename)
+                    self.assertEqual(expected.content, post.content, filename)
+                    results.append(MarkdownLoader(filename, lazy=True).get_metas())
+                self.assertEqual(results[0], results[1], filename)
+        finally:
+            config.libyaml = True
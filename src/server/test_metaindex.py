@@ -0,0 +1,171 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import handlers
+import metaindex
+from filecollection import FileCollection
+from simplesite import SimpleSite
+from siteconfig import get_config_for_tests
+
+# Override some of the config settings for the test environment
+config = get_config_for_tests()
+config.path_config = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/config.ini')
+config.path_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets')
+config.load()
+
+
+class TestMetaIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_root = config.path_root
+        shutil.copytree(os.path.join(self.orig_root, 'tests'), os.path.join(self.tmp, 'tests'))
+        config.path_root = self.tmp
+        config.index = True
+        config.path_index = os.path.join(self.tmp, '.metaindex.sqlite')
+        metaindex._index = None
+
+    def tearDown(self):
+        if metaindex._index is not None:
+            metaindex._index.close()
+        metaindex._index = None
+        config.index = False
+        config.path_root = self.orig_root
+        shutil.rmtree(self.tmp)
+
+    def test_collection_uses_index(self):
+        cold = FileCollection('tests')
+        warm = FileCollection('tests')
+        self.assertEqual(len(cold.files), len(warm.files))
+
+        for file in warm.files:
+            # Nothing should have been parsed from disk on the second scan
+            self.assertFalse(file._content_loaded)
+            self.assertEqual(cold.get_by_path(file.path).get_metas(), file.get_metas())
+
+        # Body content is still available on request
+        file = warm.get_by_path('/tests/good_file.md')
+        self.assertEqual('<h1>Test Page</h1>\n<p>This is test content about Zebras</p>', str(file))
+
+    def test_changed_and_removed_files(self):
+        FileCollection('tests')
+
+        os.remove(os.path.join(self.tmp, 'tests', 'draft_file.md'))
+        with open(os.path.join(self.tmp, 'tests', 'good_file.md'), 'a') as fp:
+            fp.write('\nMore content about Zebras\n')
+
+        collection = FileCollection('tests')
+        self.assertIsNone(collection.get_by_path('/tests/draft_file.md'))
+        self.assertIn('More content about Zebras', str(collection.get_by_path('/tests/good_file.md')))
+
+        records = metaindex.get_index().get_type('tests')
+        self.assertNotIn('/tests/draft_file.md', records)
+        # Changed file was re-parsed and its record refreshed
+        stat = os.stat(os.path.join(self.tmp, 'tests', 'good_file.md'))
+        self.assertEqual((stat.st_mtime_ns, stat.st_size), records['/tests/good_file.md'][:2])
+
+    def test_settings_change_clears_index(self):
+        FileCollection('tests')
+        self.assertGreater(len(metaindex.get_index().get_type('tests')), 0)
+        metaindex.get_index().close()
+
+        index = metaindex.MetaIndex(config.path_index, 'excerpt_length=0')
+        self.assertGreater(len(index.get_type('tests')), 0)
+        index.close()
+
+        index = metaindex.MetaIndex(config.path_index, 'excerpt_length=20')
+        self.assertEqual({}, index.get_type('tests'))
+        index.close()
+        metaindex._index = None
+
+    def test_journal(self):
+        index = metaindex.MetaIndex(config.path_index)
+        start = index.get_version()
+        self.assertTrue(start.endswith('.0'))
+        index.update('tests', [('/tests/a.md', 1, 1, {'title': 'A'}), ('/tests/b.md', 1, 1, {'title': 'B'})], [])
+        index.update('other', [('/other/c.md', 1, 1, {'title': 'C'})], [])
+        version = index.get_version()
+
+        self.assertEqual(
+            (
+                version, False,
+                [('tests', '/tests/a.md', '{"title": "A"}'), ('tests', '/tests/b.md', '{"title": "B"}')], []
+            ),
+            index.get_changes(start, ['tests'])
+        )
+        self.assertEqual((version, False, [], []), index.get_changes(version, ['tests', 'other']))
+
+        index.update('tests', [('/tests/a.md', 2, 2, {'title': 'A2'})], ['/tests/b.md'])
+        latest, full, changed, deleted = index.get_changes(version, ['tests'])
+        self.assertFalse(full)
+        self.assertEqual([('tests', '/tests/a.md', '{"title": "A2"}')], changed)
+        self.assertEqual([('tests', '/tests/b.md')], deleted)
+        # Every change gets a new version, even of the same file
+        self.assertGreater(int(latest.rpartition('.')[2]), int(version.rpartition('.')[2]))
+
+        # Unknown or malformed versions get everything
+        for since in ('', 'nope', 'abc.1', start.rpartition('.')[0] + '.999'):
+            self.assertEqual(
+                (latest, True, [('tests', '/tests/a.md', '{"title": "A2"}')], []), index.get_changes(since, ['tests'])
+            )
+
+        # Too old to still know about every deletion
+        index.JOURNAL_TOMBSTONES = 1
+        index.update('tests', [], ['/tests/a.md'])
+        self.assertTrue(index.get_changes(version, ['tests'])[1])
+        self.assertFalse(index.get_changes(latest, ['tests'])[1])
+        self.assertEqual([('tests', '/tests/a.md')], index.get_changes(latest, ['tests'])[3])
+        index.close()
+
+        # Versions from before the index was rebuilt are no longer valid
+        index = metaindex.MetaIndex(config.path_index, 'excerpt_length=20')
+        self.assertTrue(index.get_changes(latest, ['tests'])[1])
+        self.assertTrue(index.get_version().endswith('.0'))
+        self.assertNotEqual(start, index.get_version())
+        index.close()
+
+    def test_meta_changes(self):
+        full = SimpleSite.handle(handlers.meta, {'QUERY_STRING': 'type=tests'})
+        version = full.headers['X-Meta-Version']
+        document = json.loads(SimpleSite.handle(handlers.meta, {'QUERY_STRING': 'type=tests&since=' + version}).body)
+        # Filled by the first request, which had the version from before loading
+        self.assertFalse(document['full'])
+        self.assertEqual(
+            sorted(f['path'] for f in json.loads(full.get_body())['tests']),
+            sorted(f['path'] for f in document['changed']['tests'])
+        )
+
+        version = document['version']
+        response = SimpleSite.handle(handlers.meta, {'QUERY_STRING': 'type=tests&since=' + version})
+        self.assertEqual(
+            {'version': version, 'full': False, 'changed': {'tests': []}, 'deleted': {'tests': []}},
+            json.loads(response.body)
+        )
+        self.assertEqual(version, response.headers['X-Meta-Version'])
+
+        os.remove(os.path.join(self.tmp, 'tests', 'good_file_no_date.md'))
+        with open(os.path.join(self.tmp, 'tests', 'good_file.md'), 'a') as fp:
+            fp.write('\nMore content about Zebras\n')
+        document = json.loads(SimpleSite.handle(handlers.meta, {
+            'QUERY_STRING': 'type=tests&fields=title&drafts=0&since=' + version
+        }).body)
+        self.assertEqual(
+            [{
+                'url': 'https://markdownmaster.test/tests/good_file.html',
+                'path': '/tests/good_file.md',
+                'meta': {'title': 'Testing Bug Features'}
+            }],
+            document['changed']['tests']
+        )
+        self.assertEqual(['/tests/good_file_no_date.md'], document['deleted']['tests'])
+
+        # Unknown versions get everything, (and never drafts when they are left out)
+        document = json.loads(SimpleSite.handle(handlers.meta, {'QUERY_STRING': 'type=tests&drafts=0&since=x'}).body)
+        self.assertTrue(document['full'])
+        paths = [f['path'] for f in document['changed']['tests']]
+        self.assertIn('/tests/good_file.md', paths)
+        self.assertNotIn('/tests/draft_file.md', paths)
+        self.assertNotIn('/tests/good_file_no_date.md', paths)
+        self.assertEqual([], document['deleted']['tests'])
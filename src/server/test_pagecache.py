@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pagecache import PageCache
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_get(self):
+        cache = PageCache(self.path, 1000)
+        self.assertIsNone(cache.get('posts/test', '"abc"'))
+        cache.set('posts/test', '"abc"', b'<html>Test</html>')
+        self.assertEqual(b'<html>Test</html>', cache.get('posts/test', '"abc"'))
+
+        # Changed sources replace the same entry rather than adding another
+        self.assertIsNone(cache.get('posts/test', '"def"'))
+        cache.set('posts/test', '"def"', b'<html>Changed</html>')
+        self.assertEqual(b'<html>Changed</html>', PageCache(self.path, 1000).get('posts/test', '"def"'))
+        self.assertEqual(['.page'], [os.path.splitext(f)[1] for f in os.listdir(self.path)])
+        self.assertEqual({'hits': 1, 'misses': 2}, cache.get_stats())
+
+    def test_eviction(self):
+        # Room for three entries, (100 bytes plus the ETag line each)
+        cache = PageCache(self.path, 350)
+        for i in range(3):
+            cache.set('page-%d' % i, '"etag"', b'x' * 100)
+            # Spread the modification times, (some filesystems only have one second resolution)
+            os.utime(cache._get_filename('page-%d' % i), (i, i))
+
+        # Reading an entry makes it the most recently used
+        self.assertIsNotNone(cache.get('page-0', '"etag"'))
+        cache.set('page-3', '"etag"', b'x' * 100)
+
+        self.assertIsNotNone(cache.get('page-0', '"etag"'))
+        self.assertIsNone(cache.get('page-1', '"etag"'))
+        self.assertIsNotNone(cache.get('page-2', '"etag"'))
+        self.assertIsNotNone(cache.get('page-3', '"etag"'))
+
+        # Pages larger than the whole budget are never stored
+        cache.set('large', '"etag"', b'x' * 400)
+        self.assertIsNone(cache.get('large', '"etag"'))
+
+    def test_failed_write(self):
+        cache = PageCache(self.path, 1000)
+        replace = os.replace
+
+        def fail(src, dst):
+            raise OSError(28, 'No space left on device')
+
+        os.replace = fail
+        try:
+            cache.set('posts/test', '"abc"', b'<html>Test</html>')
+        finally:
+            os.replace = replace
+
+        # Nothing stored and no temporary file left behind
+        self.assertIsNone(cache.get('posts/test', '"abc"'))
+        self.assertEqual([], os.listdir(self.path))
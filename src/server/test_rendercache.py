@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rendercache import RenderCache
+
+
+class TestRenderCache(unittest.TestCase):
+    def test_render(self):
+        cache = RenderCache(2)
+        self.assertEqual('<h1>Test</h1>', cache.render('# Test'))
+        self.assertEqual('<h1>Test</h1>', cache.render('# Test'))
+        self.assertEqual('<p>Other</p>', cache.render('Other'))
+        self.assertEqual({'hits': 1, 'misses': 2, 'entries': 2}, cache.get_stats())
+
+        # Oldest entry is evicted once the cache is full
+        cache.render('Third')
+        self.assertEqual(2, len(cache.entries))
+        cache.render('# Test')
+        self.assertEqual(4, cache.misses)
+
+    def test_render_disk(self):
+        path = tempfile.mkdtemp()
+        try:
+            RenderCache(2, path).render('# Test')
+
+            # A new process, (or instance), picks up the rendered copy from disk
+            cache = RenderCache(2, path)
+            self.assertEqual('<h1>Test</h1>', cache.render('# Test'))
+            self.assertEqual(1, cache.hits)
+
+            cache.render('Other')
+            cache.render('Third')
+            self.assertEqual(2, len([f for f in os.listdir(path) if f.endswith('.html')]))
+        finally:
+            shutil.rmtree(path)
+
+    def test_failed_write(self):
+        path = tempfile.mkdtemp()
+        replace = os.replace
+
+        def fail(src, dst):
+            raise OSError(28, 'No space left on device')
+
+        os.replace = fail
+        try:
+            self.assertEqual('<h1>Test</h1>', RenderCache(2, path).render('# Test'))
+        finally:
+            os.replace = replace
+        try:
+            # Still rendered, but nothing stored and no temporary file left behind
+            self.assertEqual([], os.listdir(path))
+        finally:
+            shutil.rmtree(path)
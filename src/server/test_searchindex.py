@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import searchindex
+from filecollection import FileCollection
+from searchindex import tokenize
+from siteconfig import get_config_for_tests
+
+# Override some of the config settings for the test environment
+config = get_config_for_tests()
+config.path_config = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/config.ini')
+config.path_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets')
+config.load()
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_root = config.path_root
+        shutil.copytree(os.path.join(self.orig_root, 'tests'), os.path.join(self.tmp, 'tests'))
+        config.path_root = self.tmp
+        config.search = True
+        config.path_search_index = os.path.join(self.tmp, '.searchindex.sqlite')
+        searchindex._index = None
+
+    def tearDown(self):
+        if searchindex._index is not None:
+            searchindex._index.close()
+        searchindex._index = None
+        config.search = False
+        config.path_root = self.orig_root
+        shutil.rmtree(self.tmp)
+
+    def _refresh(self) -> int:
+        return searchindex.get_search_index().refresh('tests', FileCollection.get_sources('tests'))
+
+    def _search(self, query: str, **kwargs) -> list:
+        total, results = searchindex.get_search_index().search(query, ['tests'], **kwargs)
+        return [result[1] for result in results]
+
+    def test_tokenize(self):
+        self.assertEqual(
+            ['searching', 'the', 'docs', 'is', 'fast'],
+            tokenize('Searching [the docs](/docs.html){.button} is <b>_fast_</b>, a')
+        )
+
+    def test_search(self):
+        self.assertEqual(7, self._refresh())
+
+        self.assertEqual(['/tests/good_file.md', '/tests/good_file_no_date.md'], self._search('zebras'))
+        # Title matches rank above body matches
+        self.assertEqual('/tests/topic/some_sub_file.md', self._search('page subfile')[0])
+        # Metas are searched too, (author and tags)
+        self.assertEqual(['/tests/good_file.md', '/tests/good_file_no_date.md'], self._search('alice'))
+        self.assertEqual(['/tests/draft_file.md'], self._search('display'))
+        self.assertEqual([], self._search('display', drafts=False))
+        self.assertEqual([], self._search('unicorns'))
+        self.assertEqual([], self._search(''))
+
+        total, results = searchindex.get_search_index().search('test page', ['tests'], limit=2, offset=2)
+        self.assertEqual(4, total)
+        self.assertEqual(2, len(results))
+        self.assertGreater(results[0][0], 0)
+        self.assertEqual('Automatic Excerpt', results[1][3]['title'])
+
+        total, results = searchindex.get_search_index().search('zebras', ['pages'])
+        self.assertEqual(0, total)
+
+    def test_incremental(self):
+        self._refresh()
+        self.assertEqual(0, self._refresh())
+
+        with open(os.path.join(self.tmp, 'tests', 'auto_excerpt.md'), 'a') as fp:
+            fp.write('\n\nGiraffes are tall\n')
+        os.remove(os.path.join(self.tmp, 'tests', 'good_file_no_date.md'))
+        self.assertEqual(2, self._refresh())
+
+        self.assertEqual(['/tests/auto_excerpt.md'], self._search('giraffes'))
+        self.assertEqual(['/tests/good_file.md'], self._search('zebras'))
+
+        # Terms no file uses anymore are dropped along with the file
+        os.remove(os.path.join(self.tmp, 'tests', 'auto_excerpt.md'))
+        self.assertEqual(1, self._refresh())
+        conn = searchindex.get_search_index().conn
+        self.assertIsNone(conn.execute("SELECT id FROM terms WHERE term = 'giraffes'").fetchone())
+        self.assertEqual(0, conn.execute(
+            'SELECT COUNT(*) FROM terms WHERE NOT EXISTS (SELECT 1 FROM postings WHERE postings.term = terms.id)'
+        ).fetchone()[0])
+        self.assertEqual(['/tests/good_file.md'], self._search('zebras'))
+
+    def test_concurrent_refresh(self):
+        sources = FileCollection.get_sources('tests')
+        index = searchindex.get_search_index()
+        # Another process refreshing the same database
+        other = searchindex.SearchIndex(config.path_search_index)
+        other.conn.execute('PRAGMA busy_timeout = 100')
+        other_counts = []
+        get_term_ids = index._get_term_ids
+
+        def interleaved(terms):
+            # The other process tries to add the same files while this refresh is under way
+            other_counts.append(other.refresh('tests', sources))
+            return get_term_ids(terms)
+
+        index._get_term_ids = interleaved
+        try:
+            self.assertEqual(len(sources), index.refresh('tests', sources))
+        finally:
+            del index._get_term_ids
+            other.close()
+
+        # It waited for the write lock and gave up, rather than conflicting halfway through
+        self.assertEqual([0], other_counts)
+        self.assertEqual(len(sources), index.conn.execute('SELECT COUNT(*) FROM docs').fetchone()[0])
+        self.assertEqual(0, self._refresh())
@@ -1,9 +1,11 @@
 import os
+import shutil
+import tempfile
 import unittest
 
 from bs4 import BeautifulSoup
 
-from templater import Templater
+from templater import CompiledTemplate, Templater
 from siteconfig import get_config_for_tests
 
 # Override some of the config settings for the test environment
@@ -44,3 +46,36 @@ class TestTemplater(unittest.TestCase):
         tmpl = _get_good_template()
         tmpl.set_body('<p>hello world</p><a href="https://example.tld">There</a>')
         self.assertIn('<div id="cms"><p>hello world</p><a href="https://example.tld">There</a></div>', str(tmpl))
+
+    def test_set_canonical(self):
+        tmpl = _get_good_template()
+        tmpl.set_canonical('https://example.tld/page.html?a=1&b=2')
+        self.assertIn('<link href="https://example.tld/page.html?a=1&amp;b=2" rel="canonical"/>', str(tmpl))
+
+    def test_set_meta_content_existing(self):
+        tmpl = _get_good_template()
+        tmpl.set_meta_content('author', 'Alice', 'name')
+        self.assertIn('<meta content="Alice" name="author"/>', str(tmpl))
+        self.assertEqual(1, str(tmpl).count('name="author"'))
+
+    def test_compiled_once(self):
+        self.assertIs(_get_good_template().template, _get_good_template().template)
+
+    def test_failed_cache_write(self):
+        path = tempfile.mkdtemp()
+        replace = os.replace
+
+        def fail(src, dst):
+            raise OSError(28, 'No space left on device')
+
+        config.path_render_cache = path
+        os.replace = fail
+        try:
+            compiled = _get_good_template().template
+            CompiledTemplate._write_cache('index.html', 1, compiled)
+            # Nothing stored and no temporary file left behind
+            self.assertEqual([], os.listdir(path))
+        finally:
+            os.replace = replace
+            config.path_render_cache = None
+            shutil.rmtree(path)
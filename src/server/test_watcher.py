@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import metaindex
+from filecollection import FileCollection
+from siteconfig import get_config_for_tests
+from watcher import Inotify, Watcher
+
+# Override some of the config settings for the test environment
+config = get_config_for_tests()
+config.path_config = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets/config.ini')
+config.path_root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../test/assets')
+config.load()
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig_root = config.path_root
+        shutil.copytree(os.path.join(self.orig_root, 'tests'), os.path.join(self.tmp, 'tests'))
+        config.path_root = self.tmp
+        config.index = True
+        config.path_index = os.path.join(self.tmp, '.metaindex.sqlite')
+        metaindex._index = None
+
+    def tearDown(self):
+        if metaindex._index is not None:
+            metaindex._index.close()
+        metaindex._index = None
+        config.index = False
+        config.index_watched = False
+        config.path_root = self.orig_root
+        shutil.rmtree(self.tmp)
+
+    def test_watched_index_is_trusted(self):
+        expected = [file.path for file in FileCollection('tests').files]
+        index = metaindex.get_index()
+        index.update('tests', [], list(index.get_type('tests').keys()))
+
+        watcher = Watcher(index, poll=True)
+        self.assertEqual(len(expected), watcher.rescan())
+        watcher.heartbeat()
+        self.assertTrue(index.is_watched('tests'))
+
+        config.index_watched = True
+        os.remove(os.path.join(self.tmp, 'tests', 'draft_file.md'))
+        # The filesystem is not checked at all, so the removed file is still listed until the watcher catches up
+        self.assertEqual(expected, [file.path for file in FileCollection('tests').files])
+        self.assertEqual(expected, [source[0] for source in FileCollection.get_sources('tests')])
+
+        # Changes outside of the collections, (or to anything but Markdown), queue up nothing
+        self.assertFalse(watcher.handle(0, os.path.join(self.tmp, 'index.html')))
+        self.assertFalse(watcher.handle(0, os.path.join(self.tmp, 'tests', '.sync-tmp-1234')))
+        self.assertFalse(watcher.dirty_paths)
+        self.assertTrue(watcher.handle(0, os.path.join(self.tmp, 'tests', 'draft_file.md')))
+        self.assertEqual(1, watcher.flush())
+        self.assertNotIn('/tests/draft_file.md', [file.path for file in FileCollection('tests').files])
+
+        # Once the watcher stops, requests check the files themselves again
+        index.set_watched(None)
+        self.assertFalse(index.is_watched('tests'))
+
+    def test_inotify(self):
+        try:
+            Inotify().close()
+        except OSError:
+            self.skipTest('inotify not available')
+
+        index = metaindex.get_index()
+        watcher = Watcher(index, debounce=0.1)
+        watcher.inotify.add_watch(self.tmp)
+        watcher._watch_type('tests')
+        watcher.rescan()
+
+        with open(os.path.join(self.tmp, 'tests', 'new_file.md'), 'w') as fp:
+            fp.write('---\ntitle: New File\n---\n\nContent\n')
+        os.mkdir(os.path.join(self.tmp, 'new_topic'))
+        with open(os.path.join(self.tmp, 'new_topic', 'moved_file.md'), 'w') as fp:
+            fp.write('---\ntitle: Moved File\n---\n\nContent\n')
+        os.rename(os.path.join(self.tmp, 'new_topic'), os.path.join(self.tmp, 'tests', 'new_topic'))
+
+        for mask, path in watcher.inotify.read(1.0):
+            watcher.handle(mask, path)
+        watcher.flush()
+        watcher.inotify.close()
+
+        records = index.get_type('tests')
+        self.assertIn('New File', records['/tests/new_file.md'][2])
+        self.assertIn('Moved File', records['/tests/new_topic/moved_file.md'][2])
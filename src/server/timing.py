@@ -0,0 +1,165 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Union
+
+# Spans of the request currently being handled by this thread, (None when timing is disabled)
+_local = threading.local()
+_disabled = nullcontext()
+
+
+class _Span:
+    __slots__ = ('spans', 'name', 'start')
+
+    def __init__(self, spans: dict, name: str):
+        self.spans = spans
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        entry = self.spans.setdefault(self.name, [0.0, 0])
+        entry[0] += time.perf_counter() - self.start
+        entry[1] += 1
+
+
+def start() -> None:
+    """
+    Start timing a new request on this thread
+    """
+    _local.spans = {}
+    _local.start = time.perf_counter()
+
+
+def stop() -> None:
+    """
+    Stop timing on this thread, (ie: neither debug nor the timing log are enabled)
+    """
+    _local.spans = None
+
+
+def span(name: str):
+    """
+    Time a phase of the current request, phases with the same name are added together
+
+    Spans may be nested, (ie: "frontmatter" within "parse"), so they do not necessarily add up to the total.
+
+    :param name: Phase name, ie: "scan"
+    :return: Context manager
+    """
+    spans = getattr(_local, 'spans', None)
+    if spans is None:
+        return _disabled
+    return _Span(spans, name)
+
+
+def add(name: str, duration: float) -> None:
+    """
+    Record a phase which was timed elsewhere
+    :param name: Phase name, ie: "startup"
+    :param duration: Duration in seconds
+    """
+    spans = getattr(_local, 'spans', None)
+    if spans is not None:
+        entry = spans.setdefault(name, [0.0, 0])
+        entry[0] += duration
+        entry[1] += 1
+
+
+def get_process_age() -> Union[float, None]:
+    """
+    Get the number of seconds since this process started, (Linux only), or None if not available
+
+    Covers interpreter startup and imports, which happen before any of the application can time them.
+    """
+    try:
+        with open('/proc/self/stat') as fp:
+            # Fields after the command name, which may itself contain spaces; starttime is field 22
+            fields = fp.read().rpartition(')')[2].split()
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - started
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def get_total() -> float:
+    """
+    Get the number of seconds since the current request started
+    """
+    return time.perf_counter() - getattr(_local, 'start', time.perf_counter())
+
+
+def get_spans() -> dict:
+    """
+    Get the phases of the current request
+    :return: Dictionary of name => (seconds, count)
+    """
+    spans = getattr(_local, 'spans', None) or {}
+    return {name: (entry[0], entry[1]) for name, entry in spans.items()}
+
+
+def get_header() -> str:
+    """
+    Get the phases of the current request as a Server-Timing header value, (durations in milliseconds)
+    """
+    parts = []
+    for name, (duration, count) in get_spans().items():
+        parts.append('%s;dur=%.2f' % (name, duration * 1000) + (';desc="%dx"' % count if count > 1 else ''))
+    parts.append('total;dur=%.2f' % (get_total() * 1000))
+    return ', '.join(parts)
+
+
+def log(path: str, slow: float, request: str, code: int) -> None:
+    """
+    Append the current request to the timing log as a single JSON line, if it was slow enough
+
+    :param path: Fully resolved path of the log file
+    :param slow: Only log requests which took at least this many seconds
+    :param request: Request to log, ie: "crawler?page=/posts.html"
+    :param code: HTTP status code sent
+    """
+    total = get_total()
+    if total < slow:
+        return
+
+    line = json.dumps({
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'request': request,
+        'code': code,
+        'total': round(total * 1000, 2),
+        'spans': {name: round(duration * 1000, 2) for name, (duration, count) in get_spans().items()},
+    })
+    try:
+        # A single append of one line, so concurrent CGI processes do not interleave
+        with open(path, 'a', encoding='utf-8') as fp:
+            fp.write(line + '\n')
+    except OSError:
+        # Timing is only diagnostics, never fail a request because of it
+        pass
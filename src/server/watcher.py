@@ -0,0 +1,374 @@
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from typing import Union
+
+from filecollection import FileCollection, is_ignored, load_files
+from metaindex import MetaIndex, get_index
+from searchindex import get_search_index
+from siteconfig import SiteConfig
+
+# Event flags, (from sys/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# struct inotify_event, (wd, mask, cookie, len), followed by the null-padded name
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    def __init__(self):
+        """
+        Open a new inotify instance via libc
+
+        :throws OSError: If inotify is not available, ie: not Linux or out of instances
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not supported on this system')
+
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # Watch descriptor => directory
+        self.watches = {}
+
+    def add_watch(self, directory: str) -> None:
+        """
+        Watch a single directory, (not recursive)
+        :param directory: Fully resolved path
+        :throws OSError:
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), directory)
+        self.watches[wd] = directory
+
+    def read(self, timeout: float) -> list:
+        """
+        Wait for events on any of the watched directories
+
+        :param timeout: Maximum number of seconds to wait
+        :return: List of (mask, fully resolved path), empty if nothing happened within the timeout
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_IGNORED:
+                # Directory was removed or unmounted, the kernel has already dropped the watch
+                self.watches.pop(wd, None)
+            elif mask & IN_Q_OVERFLOW:
+                events.append((mask, None))
+            elif wd in self.watches:
+                events.append((mask, os.path.join(self.watches[wd], name) if name else self.watches[wd]))
+
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class Watcher:
+    # Seconds between heartbeats, must be well under MetaIndex.WATCHER_TIMEOUT
+    HEARTBEAT = 30
+    # Longest a continuous burst of changes can hold back indexing, in multiples of the debounce delay
+    MAX_DELAY = 10
+
+    def __init__(self, index: MetaIndex, poll: bool = False, interval: float = 5.0, debounce: float = 1.0):
+        """
+        Keep the metadata index up to date as files within the collection types change
+
+        Uses inotify where available and falls back to periodically checking every file otherwise.
+
+        :param index: Metadata index to maintain
+        :param poll: Set to True to always poll instead of using inotify, ie: for network mounts
+        :param interval: Seconds between checks when polling
+        :param debounce: Seconds to wait for a burst of changes to settle before indexing them
+        """
+        self.index = index
+        self.root = SiteConfig.get_path_root()
+        self.types = SiteConfig.get_types()
+        self.interval = interval
+        self.debounce = debounce
+
+        self.inotify = None
+        if not poll:
+            try:
+                self.inotify = Inotify()
+            except OSError as e:
+                print('inotify not available, (%s), polling every %s seconds instead' % (e, interval), file=sys.stderr)
+
+        # Changes waiting for the current burst to settle, type => set of fully resolved paths
+        self.dirty_paths = {}
+        # Types which need a full check, ie: after a directory was created, moved or removed
+        self.dirty_types = set()
+        self.rescan_requested = False
+
+    def sync(self, col_type: str, paths: Union[list, None] = None) -> int:
+        """
+        Bring the index records of a collection type in line with the files on disk
+
+        :param col_type: Collection type, ie: "posts"
+        :param paths: Fully resolved paths which may have changed, or None to check every file of the type
+        :return: Number of records changed or removed
+        """
+        indexed = self.index.get_type(col_type)
+        removed = []
+        if paths is None:
+            try:
+                files = FileCollection._scan(os.path.join(self.root, col_type))
+            except FileNotFoundError:
+                files = []
+            found = {path[len(self.root):] for path, _ in files}
+            removed = [path for path in indexed if path not in found]
+        else:
+            files = []
+            for path in paths:
+                try:
+                    files.append((path, os.stat(path)))
+                except FileNotFoundError:
+                    if path[len(self.root):] in indexed:
+                        removed.append(path[len(self.root):])
+
+        pending = []
+        for path, stat in files:
+            record = indexed.get(path[len(self.root):])
+            if record is None or record[0] != stat.st_mtime_ns or record[1] != stat.st_size:
+                pending.append((path, stat))
+
+        changed = []
+        for (path, stat), loader in zip(pending, load_files([p[0] for p in pending], [p[1] for p in pending])):
+            changed.append((loader.path, stat.st_mtime_ns, stat.st_size, loader.get_metas()))
+
+        if changed or removed:
+            self.index.update(col_type, changed, removed)
+
+        search = get_search_index()
+        if search is not None:
+            # Keep the search index current too, so search requests have nothing left to do
+            search.refresh(col_type, [(path,) + record[0:2] for path, record in self.index.get_type(col_type).items()])
+        return len(changed) + len(removed)
+
+    def rescan(self) -> int:
+        """
+        Check every file of every collection type
+        :return: Number of records changed or removed
+        """
+        return sum(self.sync(col_type) for col_type in self.types)
+
+    def heartbeat(self) -> None:
+        """
+        Let request handlers know the index is being maintained, (and for which types)
+        """
+        self.index.set_watched([t for t in self.types if os.path.isdir(os.path.join(self.root, t))])
+
+    def _watch_type(self, col_type: str) -> None:
+        """
+        Watch a collection type directory and its subdirectories, (the same directories scanned for files)
+        :param col_type: Collection type, ie: "posts"
+        """
+        directory = os.path.join(self.root, col_type)
+        if not os.path.isdir(directory):
+            return
+
+        try:
+            directories = []
+            FileCollection._scan(directory, directories)
+            for path in directories:
+                self.inotify.add_watch(path)
+        except FileNotFoundError:
+            # Removed while being watched, the events for that will trigger another check
+            pass
+
+    def handle(self, mask: int, path: Union[str, None]) -> bool:
+        """
+        Queue up the work required for a single inotify event
+        :param mask: Event flags
+        :param path: Fully resolved path the event is for, (None if events were lost)
+        :return: True if the event queued any work, False if it was irrelevant, (ie: index.html or an ignored file)
+        """
+        if mask & IN_Q_OVERFLOW:
+            # Events were dropped by the kernel, there is no knowing what changed
+            self.rescan_requested = True
+            return True
+
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        if parts[0] not in self.types or len(parts) > SiteConfig.get_scan_depth() + 2:
+            return False
+        if any(is_ignored(part) for part in parts[1:]):
+            return False
+
+        if len(parts) == 1 or mask & (IN_ISDIR | IN_DELETE_SELF | IN_MOVE_SELF):
+            # Whole directories come and go at once, (ie: a sync client moving a folder into place)
+            self.dirty_types.add(parts[0])
+        elif path.endswith('.md'):
+            self.dirty_paths.setdefault(parts[0], set()).add(path)
+        else:
+            return False
+        return True
+
+    def flush(self) -> int:
+        """
+        Index all queued changes in one go
+        :return: Number of records changed or removed
+        """
+        if self.rescan_requested:
+            self.dirty_types.update(self.types)
+            self.rescan_requested = False
+
+        count = 0
+        for col_type in self.dirty_types:
+            if self.inotify is not None:
+                self._watch_type(col_type)
+            count += self.sync(col_type)
+            self.dirty_paths.pop(col_type, None)
+        for col_type, paths in self.dirty_paths.items():
+            count += self.sync(col_type, sorted(paths))
+
+        self.dirty_types = set()
+        self.dirty_paths = {}
+        self.heartbeat()
+        return count
+
+    def run(self) -> None:
+        """
+        Watch for changes until interrupted, (SIGINT or SIGTERM), SIGHUP triggers a full rescan
+        """
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, 'rescan_requested', True))
+
+        if self.inotify is not None:
+            # Watch before the initial scan so nothing changed during it is missed
+            self.inotify.add_watch(self.root)
+            for col_type in self.types:
+                self._watch_type(col_type)
+        print('Indexed %d changes' % self.rescan(), flush=True)
+        self.heartbeat()
+
+        last_heartbeat = time.monotonic()
+        last_change = 0
+        burst_start = None
+        try:
+            while True:
+                if self.inotify is not None:
+                    queued = False
+                    for mask, path in self.inotify.read(self.debounce):
+                        queued = self.handle(mask, path) or queued
+                    now = time.monotonic()
+                    if queued:
+                        # Only relevant changes start or extend a burst, other churn must not cut debouncing short
+                        last_change = now
+                        burst_start = burst_start or now
+
+                    dirty = self.rescan_requested or self.dirty_types or self.dirty_paths
+                    if not dirty:
+                        burst_start = None
+                    settled = now - last_change >= self.debounce
+                    overdue = burst_start is not None and now - burst_start >= self.debounce * self.MAX_DELAY
+                    if dirty and (settled or overdue):
+                        count = self.flush()
+                        burst_start = None
+                        last_heartbeat = now
+                        if count:
+                            print('Indexed %d changes' % count, flush=True)
+                else:
+                    time.sleep(self.interval)
+                    self.rescan_requested = True
+                    count = self.flush()
+                    last_heartbeat = time.monotonic()
+                    if count:
+                        print('Indexed %d changes' % count, flush=True)
+
+                if time.monotonic() - last_heartbeat >= self.HEARTBEAT:
+                    self.heartbeat()
+                    last_heartbeat = time.monotonic()
+        finally:
+            # Requests go back to checking the files themselves
+            self.index.set_watched(None)
+            if self.inotify is not None:
+                self.inotify.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the metadata index up to date as files are changed')
+    parser.add_argument('--rescan', action='store_true', help='Check every file once and exit')
+    parser.add_argument('--poll', action='store_true', help='Poll for changes instead of using inotify')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between checks when polling, (default: 5)')
+    parser.add_argument(
+        '--debounce', type=float, default=1.0,
+        help='Seconds to wait for a burst of changes to settle before indexing them, (default: 1)'
+    )
+    args = parser.parse_args()
+
+    index = get_index()
+    if index is None:
+        parser.error('The metadata index is not enabled or cannot be opened, please check cgi-bin/config.ini')
+
+    watcher = Watcher(index, args.poll, args.interval, args.debounce)
+    if args.rescan:
+        print('Indexed %d changes' % watcher.rescan())
+        return
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/opt/markdownmaster/bin/python3
+"""
+MarkdownMaster CMS
+
+The MIT License (MIT)
+Copyright (c) 2023 Charlie Powell
+https://github.com/cdp1337/markdownmaster
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of this software and
+associated documentation files (the "Software"), to deal in the Software without restriction,
+including without limitation the rights to use, copy, modify, merge, publish, distribute,
+sublicense, and/or sell copies of the Software, and to permit persons to whom the Software
+is furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all copies
+or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE
+AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM,
+DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+"""
+
+import argparse
+import re
+from socketserver import ThreadingMixIn
+from urllib.parse import quote
+from wsgiref.simple_server import WSGIServer, make_server
+
+import handlers
+from filecollection import FileCollection
+from simplesite import SimpleSite
+from siteconfig import get_config
+
+# Long-running process, keep parsed files in memory between requests
+FileCollection.keep_warm = True
+
+
+def application(environ: dict, start_response):
+    """
+    WSGI application serving the crawler, meta.json, search.json and sitemap.xml from a single long-running process
+
+    Supports both the rewritten CGI-style URLs, (/cgi-bin/crawler.py?page=...),
+    and direct URLs, (/posts/my_post.html, /meta.json, /search.json, /sitemap.xml).
+    """
+    path = environ.get('PATH_INFO', '/')
+
+    if path in ('/meta.json', '/cgi-bin/meta.py'):
+        return SimpleSite.wsgi(handlers.meta, environ, start_response)
+
+    if path in ('/search.json', '/cgi-bin/search.py'):
+        return SimpleSite.wsgi(handlers.search, environ, start_response)
+
+    if path in ('/sitemap.xml', '/cgi-bin/sitemap.py'):
+        return SimpleSite.wsgi(handlers.sitemap, environ, start_response)
+
+    match = re.match(r'^/sitemap-([a-z_0-9]+)-([0-9]+)\.xml$', path)
+    if match:
+        # Child sitemap, as linked from the sitemap index of large sites
+        environ = dict(environ)
+        environ['QUERY_STRING'] = 'type=' + match.group(1) + '&page=' + match.group(2)
+        return SimpleSite.wsgi(handlers.sitemap, environ, start_response)
+
+    if path != '/' and path != '/cgi-bin/crawler.py':
+        # Direct URL, translate it to the page parameter the crawler expects,
+        # any listing page number, (ie: "?page=2"), follows it the same as the CGI rewrite rules
+        query = environ.get('QUERY_STRING', '')
+        environ = dict(environ)
+        environ['QUERY_STRING'] = 'page=' + quote(path) + ('&' + query if query else '')
+
+    return SimpleSite.wsgi(handlers.crawler, environ, start_response)
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the MarkdownMaster server-side application as a threaded HTTP server')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', default=8000, type=int, help='Port to listen on')
+    args = parser.parse_args()
+
+    # Load the configuration up front so any problems are reported before serving requests
+    get_config()
+
+    with make_server(args.host, args.port, application, server_class=ThreadingWSGIServer) as httpd:
+        print('Serving on http://%s:%d' % (args.host, args.port))
+        httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()